@@ -0,0 +1,71 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+bench_png_output
+----------------------------------
+
+Compares the PNG-encoding of planar RGB frames through PIL
+(extract planes, merge them, save) with the direct raw encoder.
+
+Usage: python benchmarks/bench_png_output.py [width] [height] [repeats]
+"""
+import sys
+import timeit
+from io import BytesIO
+
+from PIL import Image
+
+from yuuno.clip import Size, RGB24
+from yuuno.output import raw2png
+from yuuno.output.srgb_png import srgb
+
+
+def make_planes(width: int, height: int) -> bytes:
+    # A smooth gradient with some texture. Similar enough to real footage
+    # to give the filters something to do.
+    planes = []
+    for p in range(3):
+        row = bytes((x * (p+1) + (x*x >> 7)) & 0xFF for x in range(width))
+        planes.append(b"".join(row[y % 13:] + row[:y % 13] for y in range(height)))
+    return b"".join(planes)
+
+
+def encode_pil(size: Size, raw: bytes, level: int) -> bytes:
+    plane_size = size.width * size.height
+    planes = [
+        Image.frombuffer("L", size, raw[i*plane_size:(i+1)*plane_size], "raw", "L", 0, 1)
+        for i in range(3)
+    ]
+    f = BytesIO()
+    Image.merge("RGB", planes).save(f, compress_level=level, **srgb())
+    return f.getvalue()
+
+
+def encode_raw(filter: str):
+    def _encode(size: Size, raw: bytes, level: int) -> bytes:
+        f = BytesIO()
+        raw2png.write_png(f, size, RGB24, raw, compress_level=level, filter=filter)
+        return f.getvalue()
+    return _encode
+
+
+def main():
+    width = int(sys.argv[1]) if len(sys.argv) > 1 else 1920
+    height = int(sys.argv[2]) if len(sys.argv) > 2 else 1080
+    repeats = int(sys.argv[3]) if len(sys.argv) > 3 else 5
+
+    size = Size(width, height)
+    raw = make_planes(width, height)
+
+    print(f"Frame: {width}x{height} RGB24, NumPy: {raw2png.numpy is not None}")
+    for level in (1, 6):
+        encoders = [("pil", encode_pil)] + [(f"raw/{f}", encode_raw(f)) for f in raw2png.FILTERS]
+        for name, func in encoders:
+            result = func(size, raw, level)
+            best = min(timeit.repeat(lambda: func(size, raw, level), number=1, repeat=repeats))
+            print(f"  level={level} {name:>12}: {best*1000:8.1f} ms  {len(result):>10} bytes")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,57 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+bench_wire
+----------------------------------
+
+Compares the per-request overhead of pickling Request/Response
+objects with the binary wire format, once for encoding and decoding
+alone and once including a round trip through a pipe.
+
+Usage: python benchmarks/bench_wire.py [repeats]
+"""
+import sys
+import pickle
+import timeit
+from multiprocessing import Pipe
+
+from yuuno.clip import Size, RGB24
+from yuuno.multi_scripts.subprocess import wire
+from yuuno.multi_scripts.subprocess.proxy import Request, Response
+
+
+MESSAGES = {
+    "frame request": Request(id=1234, type="script/subprocess/results/frame", data={
+        "id": "0", "frame": 1234, "slot": 1, "buffer": "psm_0123abcd", "capacity": 1920*1080*3
+    }, protect=True),
+    "frame response": Response(id=1234, data=(Size(1920, 1080), RGB24, 1920*1080*3), protected=True),
+    "batch response": Response(id=1234, data=[(Size(320, 180), RGB24, (i*172800, 172800)) for i in range(16)]),
+}
+
+CODECS = {
+    "pickle": (lambda obj: pickle.dumps(obj, protocol=pickle.HIGHEST_PROTOCOL), pickle.loads),
+    "wire": (wire.dumps, wire.loads),
+}
+
+
+def main():
+    repeats = int(sys.argv[1]) if len(sys.argv) > 1 else 20000
+    read, write = Pipe(duplex=False)
+
+    for name, message in MESSAGES.items():
+        print(f"{name}:")
+        for codec, (dumps, loads) in CODECS.items():
+            size = len(dumps(message))
+            codec_time = min(timeit.repeat(lambda: loads(dumps(message)), number=repeats, repeat=3)) / repeats
+
+            def _round_trip():
+                write.send_bytes(dumps(message))
+                loads(read.recv_bytes())
+            pipe_time = min(timeit.repeat(_round_trip, number=repeats, repeat=3)) / repeats
+
+            print(f"  {codec:>7}: {size:>5} bytes  {codec_time*1e6:7.2f} us/codec  {pipe_time*1e6:7.2f} us/pipe")
+
+
+if __name__ == '__main__':
+    main()
@@ -36,6 +36,8 @@ test_requirements = [
 
 extras_requires = {
     'vapoursynth': ['vapoursynth'],
+    'numpy': ['numpy'],
+    'lz4': ['lz4'],
 }
 
 setup(
@@ -71,7 +73,11 @@ setup(
         'Topic :: Multimedia :: Video :: Non-Linear Editor',
     ],
     entry_points={
-        'console_scripts': ['yuuno=yuuno.console_scripts:main']
+        'console_scripts': ['yuuno=yuuno.console_scripts:main'],
+        'yuuno.commands': [
+            'export=yuuno.commands.export:main',
+            'worker=yuuno.commands.worker:main'
+        ]
     },
     test_suite='tests',
     tests_require=test_requirements
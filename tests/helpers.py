@@ -1,5 +1,14 @@
+import time
+from concurrent.futures import Future
+
 from yuuno import Yuuno
+from yuuno.clip import Size, GRAY8
 from yuuno.core.environment import Environment
+from yuuno.multi_scripts.subprocess.framebuffer import OutOfBandFrame
+from yuuno.multi_scripts.subprocess.cache import FrameCache
+from yuuno.multi_scripts.subprocess.provider import ScriptProvider
+from yuuno.multi_scripts.subprocess.process import Subprocess
+from yuuno.utils import inline_resolved
 
 
 class AdditionalAsserts(object):
@@ -18,3 +27,138 @@ class TestEnvironment(Environment):
     @classmethod
     def create(cls):
         return TestEnvironment(parent=Yuuno.instance())
+
+
+class ManualRequester(object):
+    def __init__(self):
+        self.requests = []
+
+    def submit(self, type, data, protect=False):
+        fut = Future()
+        fut.set_running_or_notify_cancel()
+        self.requests.append((type, data, fut))
+        return fut
+
+
+class ManualSubprocess(Subprocess):
+    """
+    A subprocess that is never started. The requests are answered by hand.
+    """
+
+    def _create_framebuffers(self, slots, size, max_size):
+        return None
+
+    def _connect(self):
+        self.self_read = self.self_write = self.child_read = self.child_write = None
+        self.requester = ManualRequester()
+
+
+class ManualScript(object):
+    def __init__(self, pool, frame_cache=None):
+        self.framebuffers = pool
+        self.requester = ManualRequester()
+        self.frame_cache = FrameCache(0) if frame_cache is None else frame_cache
+        self.cache_id = 0
+        self.generation = 0
+        self.codec = None
+
+    def submit(self, type, data, protect=False):
+        return self.requester.submit(type, data, protect)
+
+    def meta(self, size, format):
+        # Resolve the meta-requests that have not been answered yet.
+        for type, _, fut in self.requester.requests:
+            if type == "script/subprocess/results/meta" and not fut.done():
+                fut.set_result((size, format))
+
+    @property
+    def frame_requests(self):
+        return [r for r in self.requester.requests if r[0] == "script/subprocess/results/frame"]
+
+    @property
+    def batch_requests(self):
+        return [r for r in self.requester.requests if r[0] == "script/subprocess/results/raw_batch"]
+
+    def respond_batch(self, request, frames):
+        # Emulates BasicCommands.frame_batch
+        _, data, fut = request
+        view = self.framebuffers.view(data["slot"]) if "buffer" in data else None
+        offset = 0
+        result = []
+        for frameno in data["frames"]:
+            raw = frames[frameno]
+            if view is not None and offset + len(raw) <= data["capacity"]:
+                view[offset:offset+len(raw)] = raw
+                payload = (offset, len(raw))
+                offset += len(raw)
+            else:
+                payload = OutOfBandFrame.create(raw)
+            result.append((Size(len(raw), 1), GRAY8, payload))
+        fut.set_result(result)
+
+
+class BytesFrame(object):
+    def __init__(self, data):
+        self.data = data
+
+    def size(self):
+        return Size(len(self.data), 1)
+
+    def format(self):
+        return GRAY8
+
+    def to_raw(self):
+        return self.data
+
+
+class BytesClip(object):
+    def __init__(self, frames):
+        self.frames = frames
+
+    def __len__(self):
+        return len(self.frames)
+
+    @inline_resolved
+    def __getitem__(self, item):
+        return BytesFrame(self.frames[item])
+
+
+class BytesScript(object):
+    def __init__(self, frames):
+        self.frames = BytesClip(frames)
+
+    @inline_resolved
+    def get_results(self):
+        return {"0": self.frames}
+
+
+class RecordingScript(object):
+    """
+    Creates an output for every piece of code executed.
+    It has a frame for each character of the code.
+    """
+
+    def __init__(self):
+        self.outputs = {}
+
+    @inline_resolved
+    def execute(self, code):
+        if code == "slow":
+            time.sleep(1)
+        elif code == "workers":
+            # Reports how many commands the subprocess runs at the same time.
+            code = f"workers={Yuuno.instance().environment.dispatch_workers}"
+        self.outputs[code] = BytesClip([(c * 64).encode() for c in code])
+
+    @inline_resolved
+    def get_results(self):
+        return self.outputs
+
+
+class RecordingScriptProvider(ScriptProvider):
+
+    def initialize(self, env):
+        self.script = RecordingScript()
+
+    def get_script(self):
+        return self.script
@@ -0,0 +1,71 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+test_animated_output
+----------------------------------
+
+Tests for `yuuno.output.animated` module.
+"""
+
+
+import unittest
+from io import BytesIO
+
+from PIL import Image, ImageSequence
+
+from yuuno.clip import Clip, iter_frames
+from yuuno.utils import inline_resolved
+from yuuno.output import YuunoAnimatedOutput
+
+
+class ColorClip(Clip):
+
+    def __init__(self, length):
+        super(ColorClip, self).__init__(None)
+        self.length = length
+        self.requested = []
+
+    def __len__(self):
+        return self.length
+
+    @inline_resolved
+    def __getitem__(self, item):
+        self.requested.append(item)
+        return Image.new("RGB", (8, 4), (item*20, 255-item*20, 0))
+
+
+class TestAnimatedOutput(unittest.TestCase):
+
+    def setUp(self):
+        self.output = YuunoAnimatedOutput()
+        self.clip = ColorClip(10)
+
+    def tearDown(self):
+        pass
+
+    def assertAnimation(self, data, format, frames):
+        im = Image.open(BytesIO(data))
+        self.assertEqual(im.format, format)
+        self.assertEqual(im.n_frames, len(frames))
+        self.assertEqual(im.info["loop"], 0)
+        for frame, expected in zip(ImageSequence.Iterator(im), frames):
+            self.assertEqual(frame.convert("RGB").getpixel((0, 0)), (expected*20, 255-expected*20, 0))
+
+    def test_001_iter_frames_prefetch(self):
+        frames = iter_frames(self.clip, range(10), prefetch=3)
+        next(frames)
+        self.assertEqual(self.clip.requested, [0, 1, 2, 3])
+        self.assertEqual(len(list(frames)), 9)
+
+    def test_002_apng(self):
+        self.output.format = "apng"
+        self.assertAnimation(self.output.bytes_of(self.clip, 2, 8, 2), "PNG", [2, 4, 6])
+
+    def test_003_gif(self):
+        self.output.format = "gif"
+        self.assertAnimation(self.output.bytes_of(self.clip, 2, 8, 2), "GIF", [2, 4, 6])
+
+    def test_004_empty_range(self):
+        with self.assertRaises(ValueError):
+            self.output.bytes_of(self.clip, 5, 5)
@@ -0,0 +1,82 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+test_delta_output
+----------------------------------
+
+Tests for `yuuno.output.delta` module.
+"""
+
+
+import unittest
+from unittest import mock
+
+from PIL import Image, ImageChops, ImageDraw
+
+from yuuno.output import YuunoDeltaOutput
+from yuuno.output import delta as delta_module
+from yuuno.output.delta import Rect, apply_delta
+
+
+class TestDeltaOutput(unittest.TestCase):
+
+    def setUp(self):
+        self.output = YuunoDeltaOutput(block_size=16)
+        self.output.image_output.icc_profile = None
+        self.previous = Image.linear_gradient("L").resize((100, 60)).convert("RGB")
+
+    def tearDown(self):
+        pass
+
+    def assertRoundtrip(self, previous, current, kind):
+        delta = self.output.delta_of(current, previous)
+        self.assertEqual(delta.kind, kind)
+        self.assertEqual(apply_delta(previous, delta).tobytes(), current.tobytes())
+        return delta
+
+    def test_001_no_previous(self):
+        self.assertRoundtrip(None, self.previous, "full")
+
+    def test_002_unchanged(self):
+        self.assertRoundtrip(self.previous, self.previous.copy(), "unchanged")
+
+    def test_003_rects(self):
+        current = self.previous.copy()
+        draw = ImageDraw.Draw(current)
+        draw.rectangle((2, 2, 20, 10), fill=(255, 0, 0))
+        draw.point((99, 59), fill=(0, 0, 255))
+
+        delta = self.assertRoundtrip(self.previous, current, "rects")
+        self.assertEqual([r for r, _ in delta.regions], [
+            Rect(0, 0, 32, 16),
+            Rect(96, 48, 4, 12),
+        ])
+
+    def test_004_residual(self):
+        current = ImageChops.add(self.previous, Image.new("RGB", self.previous.size, (3, 3, 3)))
+        self.assertRoundtrip(self.previous, current, "residual")
+
+    def test_005_scene_change(self):
+        current = Image.effect_noise(self.previous.size, 64).convert("RGB")
+        self.assertRoundtrip(self.previous, current, "full")
+
+    def test_006_grayscale(self):
+        previous = self.previous.convert("L")
+        current = previous.copy()
+        ImageDraw.Draw(current).point((50, 20), fill=0)
+
+        delta = self.assertRoundtrip(previous, current, "rects")
+        self.assertEqual([r for r, _ in delta.regions], [Rect(48, 16, 16, 16)])
+
+    def test_007_without_numpy(self):
+        current = self.previous.copy()
+        draw = ImageDraw.Draw(current)
+        draw.rectangle((2, 2, 20, 10), fill=(255, 0, 0))
+        draw.point((99, 59), fill=(0, 0, 255))
+        expected = self.output.delta_of(current, self.previous)
+
+        with mock.patch.object(delta_module, "numpy", None):
+            delta = self.assertRoundtrip(self.previous, current, "rects")
+            self.assertEqual([r for r, _ in delta.regions], [r for r, _ in expected.regions])
+            self.assertRoundtrip(self.previous, self.previous.copy(), "unchanged")
@@ -0,0 +1,60 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+test_export
+----------------------------------
+
+Tests for `yuuno.commands.export` module.
+"""
+
+
+import os
+import unittest
+import tempfile
+
+from PIL import Image
+
+from yuuno.clip import Clip
+from yuuno.utils import inline_resolved
+from yuuno.commands.export import export_frames
+
+
+class GreyClip(Clip):
+
+    def __init__(self, length):
+        super(GreyClip, self).__init__(None)
+        self.length = length
+
+    def __len__(self):
+        return self.length
+
+    @inline_resolved
+    def __getitem__(self, item):
+        return Image.new("L", (4, 4), item)
+
+
+class TestExport(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def test_001_export_sequence(self):
+        reports = []
+        pattern = os.path.join(self.directory.name, "%03d.png")
+        stats = export_frames(
+            GreyClip(10), range(1, 10, 3), pattern,
+            prefetch=2, workers=2,
+            report=reports.append, report_interval=0
+        )
+
+        self.assertEqual(stats.frames, 3)
+        self.assertEqual(stats.total, 3)
+        self.assertEqual(len(reports), 3)
+        self.assertEqual(sorted(os.listdir(self.directory.name)), ["001.png", "004.png", "007.png"])
+        with Image.open(pattern % 4) as im:
+            self.assertEqual(im.getpixel((0, 0)), 4)
+        self.assertEqual(stats.bytes, sum(os.path.getsize(pattern % i) for i in (1, 4, 7)))
@@ -10,13 +10,14 @@ Tests for `yuuno` module.
 
 
 import unittest
+from io import BytesIO
 
 from traitlets import default, HasTraits, Unicode
 
 from PIL import Image
 
-from yuuno.output import YuunoImageOutput
-from yuuno.clip import Frame
+from yuuno.output import YuunoImageOutput, raw2png
+from yuuno.clip import Frame, Size, RGB24, RGBA32, GRAY8
 
 
 class SinglePixelFrame(Frame, HasTraits):
@@ -35,6 +36,34 @@ class SinglePixelFrame(Frame, HasTraits):
         return Image.new(self.format, (1,1))
 
 
+class PlanarFrame(Frame):
+
+    def __init__(self, size, format, raw):
+        self._size = size
+        self._format = format
+        self._raw = raw
+
+    def size(self):
+        return self._size
+
+    def format(self):
+        return self._format
+
+    def to_raw(self):
+        return self._raw
+
+    def to_pil(self):
+        raise AssertionError("The raw encoder must not build a PIL-Image.")
+
+
+def planar_test_image(size, format):
+    plane = size.width * size.height
+    return bytes(
+        (i * 7 + (i % plane) // size.width * 3 + (i // plane) * 50) & 0xFF
+        for i in range(plane * format.num_planes)
+    )
+
+
 class TestPNGOutput(unittest.TestCase):
 
     EXPECTED_RESULT_SIMPLE = (
@@ -62,3 +91,46 @@ class TestPNGOutput(unittest.TestCase):
 
     def test_002_test_dump_nonsupported(self):
         self.assertEqual(self.output.bytes_of(SinglePixelFrame(format="CMYK")), self.EXPECTED_RESULT_CMYK_TO_RGB)
+
+    def test_003_test_write_to(self):
+        f = BytesIO()
+        self.output.write_to(SinglePixelFrame(format="RGB"), f)
+        self.assertEqual(f.getvalue(), self.EXPECTED_RESULT_SIMPLE)
+
+    def test_004_test_iter_chunks(self):
+        self.output.chunk_size = 7
+        chunks = list(self.output.iter_chunks(SinglePixelFrame(format="RGB")))
+        self.assertEqual(b"".join(chunks), self.EXPECTED_RESULT_SIMPLE)
+        self.assertTrue(all(len(c) == 7 for c in chunks[:-1]))
+
+    def test_005_test_iter_chunks_stop_early(self):
+        self.output.chunk_size = 1
+        self.output.chunk_queue_size = 1
+        chunks = self.output.iter_chunks(Image.new("RGB", (64, 64)))
+        self.assertEqual(next(chunks), self.EXPECTED_RESULT_SIMPLE[:1])
+        chunks.close()
+
+    def test_006_test_raw_encoder_roundtrip(self):
+        size = Size(17, 23)
+        for format, mode in ((RGB24, "RGB"), (RGBA32, "RGBA"), (GRAY8, "L")):
+            raw = planar_test_image(size, format)
+            plane = size.width * size.height
+            planes = [Image.frombytes("L", size, raw[i*plane:(i+1)*plane]) for i in range(format.num_planes)]
+            expected = planes[0] if mode == "L" else Image.merge(mode, planes)
+
+            for filter in raw2png.FILTERS:
+                with self.subTest(mode=mode, filter=filter):
+                    f = BytesIO()
+                    raw2png.write_png(f, size, format, raw, filter=filter)
+                    im = Image.open(BytesIO(f.getvalue()))
+                    self.assertEqual(im.mode, mode)
+                    self.assertEqual(im.tobytes(), expected.tobytes())
+                    self.assertEqual(im.info["srgb"], 3)
+
+    def test_007_test_raw_encoding_output(self):
+        size = Size(5, 3)
+        raw = planar_test_image(size, RGB24)
+        self.output.raw_encoding = True
+        im = Image.open(BytesIO(self.output.bytes_of(PlanarFrame(size, RGB24, raw))))
+        self.assertEqual(im.size, size)
+        self.assertNotIn("srgb", im.info)
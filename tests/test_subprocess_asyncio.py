@@ -0,0 +1,111 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+test_subprocess_asyncio
+----------------------------------
+
+Tests for the asyncio-variants of the subprocess client.
+"""
+
+
+import asyncio
+import unittest
+from threading import Timer
+
+from yuuno.clip import Size, GRAY8
+from yuuno.multi_scripts.subprocess.framebuffer import FrameBufferPool, OutOfBandFrame
+from yuuno.multi_scripts.subprocess.clip import ProxyClip, ProxyFrame
+
+from tests.helpers import ManualScript, ManualSubprocess
+
+
+def respond_later(fut, result, delay=0.01):
+    # Responses arrive on the handler thread, not on the event loop.
+    timer = Timer(delay, fut.set_result, (result,))
+    timer.start()
+    return timer
+
+
+class TestAsyncio(unittest.TestCase):
+
+    def setUp(self):
+        self.pool = FrameBufferPool(4)
+        self.script = ManualScript(self.pool)
+
+    def tearDown(self):
+        self.pool.close()
+
+    def run_async(self, coro):
+        return asyncio.run(asyncio.wait_for(coro, 5))
+
+    def test_001_to_raw(self):
+        frame = ProxyFrame("0", 0, self.script)
+
+        async def _test():
+            task = asyncio.ensure_future(frame.ato_raw())
+            await asyncio.sleep(0)
+            _, _, fut = self.script.frame_requests[0]
+            respond_later(fut, (Size(3, 1), GRAY8, OutOfBandFrame.create(b"abc")))
+            return await task
+
+        self.assertEqual(self.run_async(_test()), b"abc")
+
+    def test_002_overlapping_requests(self):
+        clip = ProxyClip("0", 10, self.script)
+
+        async def _test():
+            frames = await asyncio.gather(*(clip.aget(i) for i in range(4)))
+            tasks = [asyncio.ensure_future(f.ato_raw()) for f in frames]
+            await asyncio.sleep(0)
+
+            # All requests are in flight at the same time.
+            requests = self.script.frame_requests
+            self.assertEqual(len(requests), 4)
+            for i, (_, data, fut) in enumerate(requests):
+                respond_later(fut, (Size(1, 1), GRAY8, OutOfBandFrame.create(bytes([data["frame"]]))), 0.01 * (4 - i))
+            return await asyncio.gather(*tasks)
+
+        self.assertEqual(self.run_async(_test()), [b"\0", b"\1", b"\2", b"\3"])
+
+    def test_003_get_frames(self):
+        clip = ProxyClip("0", 10, self.script)
+        clip._frame_size = 1
+        frames = [bytes([i]) for i in range(10)]
+
+        async def _test():
+            task = asyncio.ensure_future(clip.aget_frames([1, 2]))
+            await asyncio.sleep(0)
+            self.script.respond_batch(self.script.batch_requests[0], frames)
+            return [f.to_raw() for f in await task]
+
+        self.assertEqual(self.run_async(_test()), [b"\1", b"\2"])
+
+    def test_004_out_of_range(self):
+        clip = ProxyClip("0", 1, self.script)
+        with self.assertRaises(IndexError):
+            self.run_async(clip.aget(1))
+
+    def test_005_script(self):
+        script = ManualSubprocess(None, None)
+
+        async def _test():
+            task = asyncio.ensure_future(script.aexecute("code"))
+            await asyncio.sleep(0)
+            _, data, fut = script.requester.requests[0]
+            self.assertEqual(data, {"type": "string", "code": "code"})
+            respond_later(fut, None)
+            await task
+
+            task = asyncio.ensure_future(script.aget_results())
+            await asyncio.sleep(0)
+            respond_later(script.requester.requests[1][2], {"0": 10})
+            return await task
+
+        results = self.run_async(_test())
+        self.assertEqual(list(results), ["0"])
+        self.assertEqual(len(results["0"]), 10)
+
+
+if __name__ == '__main__':
+    unittest.main()
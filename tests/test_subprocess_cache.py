@@ -0,0 +1,171 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+test_subprocess_cache
+----------------------------------
+
+Tests for `yuuno.multi_scripts.subprocess.cache` module.
+"""
+
+
+import unittest
+
+from yuuno.clip import Size, GRAY8, RGB24
+from yuuno.multi_scripts.subprocess.cache import FrameCache, FrameKey
+from yuuno.multi_scripts.subprocess.framebuffer import FrameBufferPool, OutOfBandFrame
+from yuuno.multi_scripts.subprocess.clip import ProxyFrame, ProxyClip
+from yuuno.multi_scripts.subprocess.process import FRAME_CACHE_SIZE
+
+from tests.helpers import ManualScript, ManualSubprocess
+
+
+def key(frame, script=0, generation=0):
+    return FrameKey(script, "0", frame, generation)
+
+
+class TestFrameCache(unittest.TestCase):
+
+    def test_001_get_put(self):
+        cache = FrameCache(10)
+        self.assertIsNone(cache.get(key(0)))
+        cache.put(key(0), Size(3, 1), GRAY8, b"abc")
+        self.assertEqual(cache.get(key(0)), (Size(3, 1), GRAY8, b"abc"))
+        self.assertIsNone(cache.get(key(0, generation=1)))
+        self.assertEqual((cache.hits, cache.misses), (1, 2))
+
+    def test_002_bounded_by_bytes(self):
+        cache = FrameCache(10)
+        for i in range(3):
+            cache.put(key(i), Size(4, 1), GRAY8, b"x" * 4)
+        self.assertEqual(cache.size, 8)
+        self.assertIsNone(cache.get(key(0)))
+
+        # Recently used frames are kept.
+        cache.get(key(1))
+        cache.put(key(3), Size(4, 1), GRAY8, b"x" * 4)
+        self.assertIsNotNone(cache.get(key(1)))
+        self.assertIsNone(cache.get(key(2)))
+
+    def test_003_too_large(self):
+        cache = FrameCache(2)
+        cache.put(key(0), Size(3, 1), GRAY8, b"abc")
+        self.assertEqual(len(cache), 0)
+
+    def test_004_disabled(self):
+        cache = FrameCache(0)
+        self.assertFalse(cache.enabled)
+        cache.put(key(0), Size(1, 1), GRAY8, b"a")
+        self.assertEqual(len(cache), 0)
+
+    def test_005_invalidate(self):
+        cache = FrameCache(10)
+        cache.put(key(0, script=0), Size(1, 1), GRAY8, b"a")
+        cache.put(key(0, script=1), Size(1, 1), GRAY8, b"b")
+        cache.invalidate(0)
+        self.assertIsNone(cache.get(key(0, script=0)))
+        self.assertIsNotNone(cache.get(key(0, script=1)))
+        self.assertEqual(cache.size, 1)
+
+
+class TestCachedFrames(unittest.TestCase):
+
+    def setUp(self):
+        self.pool = FrameBufferPool(2)
+        self.script = ManualScript(self.pool, FrameCache(1024))
+
+    def tearDown(self):
+        self.pool.close()
+
+    def respond(self, index, data):
+        _, _, fut = self.script.frame_requests[index]
+        fut.set_result((Size(len(data), 1), GRAY8, OutOfBandFrame.create(data)))
+
+    def test_001_shared_between_instances(self):
+        fut = ProxyFrame("0", 0, self.script)._raw_async()
+        self.respond(0, b"abc")
+        self.assertEqual(fut.result(timeout=1), b"abc")
+
+        frame = ProxyFrame("0", 0, self.script)
+        self.assertEqual(frame.to_raw(), b"abc")
+        self.assertEqual(frame.size(), Size(3, 1))
+        self.assertEqual(len(self.script.requester.requests), 1)
+
+    def test_002_new_generation(self):
+        ProxyFrame("0", 0, self.script)._raw_async()
+        self.respond(0, b"abc")
+
+        self.script.generation += 1
+        fut = ProxyFrame("0", 0, self.script)._raw_async()
+        self.assertEqual(len(self.script.frame_requests), 2)
+        self.respond(1, b"def")
+        self.assertEqual(fut.result(timeout=1), b"def")
+
+    def test_003_rendered_during_execute(self):
+        fut = ProxyFrame("0", 0, self.script)._raw_async()
+        self.script.generation += 1
+        self.respond(0, b"abc")
+        self.assertEqual(fut.result(timeout=1), b"abc")
+
+        # The frame belongs to the previous generation.
+        ProxyFrame("0", 0, self.script)._raw_async()
+        self.assertEqual(len(self.script.frame_requests), 2)
+
+    def test_004_pil(self):
+        fut = ProxyFrame("0", 0, self.script)._raw_async()
+        _, _, response = self.script.frame_requests[0]
+        response.set_result((Size(2, 2), RGB24, OutOfBandFrame.create(bytes(range(12)))))
+        fut.result(timeout=1)
+
+        image = ProxyFrame("0", 0, self.script).to_pil()
+        self.assertEqual(image.tobytes(), bytes([0, 4, 8, 1, 5, 9, 2, 6, 10, 3, 7, 11]))
+        self.assertEqual(len(self.script.requester.requests), 1)
+
+    def test_005_pil_not_copied(self):
+        script = ManualScript(self.pool, FrameCache(FRAME_CACHE_SIZE))
+        self.pool.reserve(0, 12)
+        self.pool.reserve(1, 12)
+        frame = ProxyFrame("0", 0, script)
+        fut = frame._pil_async()
+
+        _, data, response = script.frame_requests[0]
+        self.pool.view(data["slot"])[:12] = bytes(range(12))
+        response.set_result((Size(2, 2), RGB24, 12))
+        fut.result(timeout=1)
+
+        # The default cache does not make the image copy the frame out of the slot.
+        self.assertIsNone(frame._cached_raw)
+        self.assertEqual(len(script.frame_cache), 0)
+
+    def test_006_get_frames(self):
+        clip = ProxyClip("0", 10, self.script)
+        clip._frame_size = 1
+        frames = [bytes([i]) for i in range(10)]
+
+        fut = clip.get_frames([1, 2])
+        self.script.respond_batch(self.script.batch_requests[0], frames)
+        fut.result(timeout=1)
+
+        fut = clip.get_frames([0, 1, 2, 3])
+        _, data, _ = self.script.batch_requests[1]
+        self.assertEqual(data["frames"], [0, 3])
+        self.script.respond_batch(self.script.batch_requests[1], frames)
+        self.assertEqual([f.to_raw() for f in fut.result(timeout=1)], [b"\0", b"\1", b"\2", b"\3"])
+
+        # Everything is cached now.
+        self.assertEqual([f.to_raw() for f in clip.get_frames([3, 2]).result(timeout=1)], [b"\3", b"\2"])
+        self.assertEqual(len(self.script.batch_requests), 2)
+
+    def test_007_execute_invalidates(self):
+        script = ManualSubprocess(None, None, frame_cache=self.script.frame_cache)
+        script.cache_id = self.script.cache_id
+
+        ProxyFrame("0", 0, self.script)._raw_async()
+        self.respond(0, b"abc")
+        script.execute("code")
+        self.assertEqual(script.generation, 1)
+        self.assertEqual(len(script.frame_cache), 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,82 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+test_subprocess_compression
+----------------------------------
+
+Tests for `yuuno.multi_scripts.subprocess.compression` module.
+"""
+
+
+import os
+import unittest
+
+from yuuno.multi_scripts.subprocess.compression import AdaptiveCompressor, available_codecs, negotiate, decompress
+from yuuno.multi_scripts.subprocess.compression import MAX_BACKOFF
+
+
+FLAT = b"\x10" * 4096
+
+
+class TestNegotiation(unittest.TestCase):
+
+    def test_001_available(self):
+        self.assertIn("zlib", available_codecs())
+
+    def test_002_negotiate(self):
+        self.assertEqual(negotiate(["unknown", "zlib"]), "zlib")
+        self.assertIsNone(negotiate(["unknown"]))
+        self.assertIsNone(negotiate([]))
+
+    def test_003_round_trip(self):
+        for codec in available_codecs():
+            compressor = AdaptiveCompressor()
+            data, used = compressor.compress("0", FLAT, codec)
+            self.assertEqual(used, codec)
+            self.assertLess(len(data), len(FLAT) // 5)
+            self.assertEqual(decompress(used, data), FLAT)
+
+
+class TestAdaptiveCompressor(unittest.TestCase):
+
+    def setUp(self):
+        self.compressor = AdaptiveCompressor()
+
+    def compress(self, data, stream="0"):
+        return self.compressor.compress(stream, data, "zlib")[1]
+
+    def test_001_disabled(self):
+        self.assertEqual(self.compressor.compress("0", FLAT, None), (FLAT, None))
+
+    def test_002_bypass_noise(self):
+        noise = os.urandom(4096)
+        self.assertIsNone(self.compress(noise))
+        # The next frame is not even tried.
+        self.assertIsNone(self.compress(FLAT))
+        self.assertEqual(self.compress(FLAT), "zlib")
+
+    def test_003_backoff(self):
+        noise = os.urandom(4096)
+        stream = None
+        skips = []
+        for _ in range(8):
+            self.assertIsNone(self.compress(noise))
+            stream = self.compressor.streams["0"]
+            skips.append(stream.skip)
+            stream.skip = 0
+        # Successive failures wait longer.
+        self.assertEqual(skips, [1, 2, 4, 8, 16, 32, MAX_BACKOFF, MAX_BACKOFF])
+
+        # A frame that compresses resets the backoff.
+        self.assertEqual(self.compress(FLAT), "zlib")
+        self.assertIsNone(self.compress(noise))
+        self.assertEqual(stream.skip, 1)
+
+    def test_004_streams(self):
+        self.assertIsNone(self.compress(os.urandom(4096), "noise"))
+        self.assertEqual(self.compress(FLAT, "flat"), "zlib")
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,433 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+test_subprocess_framebuffer
+----------------------------------
+
+Tests for `yuuno.multi_scripts.subprocess.framebuffer` module.
+"""
+
+
+import unittest
+from unittest import mock
+
+from yuuno.clip import Size, GRAY8, RGB24
+from yuuno.multi_scripts.subprocess.framebuffer import FrameBufferPool, FrameBufferAttachments, OutOfBandFrame
+from yuuno.multi_scripts.subprocess.framebuffer import discard_out_of_band
+from yuuno.multi_scripts.subprocess.basic_commands import BasicCommands
+from yuuno.multi_scripts.subprocess.clip import ProxyFrame, ProxyClip
+
+from tests.helpers import ManualScript, BytesScript, BytesFrame
+
+
+class AttachedEnvironment(object):
+    def __init__(self):
+        self.attachments = FrameBufferAttachments()
+
+    def framebuffer(self, slot, name):
+        return self.attachments.get(slot, name)
+
+
+class TestFrameBufferPool(unittest.TestCase):
+
+    def setUp(self):
+        self.pools = []
+
+    def tearDown(self):
+        for pool in self.pools:
+            pool.close()
+
+    def create(self, *args):
+        pool = FrameBufferPool(*args)
+        self.pools.append(pool)
+        return pool
+
+    def test_001_lease(self):
+        pool = self.create(2)
+        first = pool.acquire()
+        second = pool.acquire()
+        self.assertTrue(first.done())
+        self.assertTrue(second.done())
+        self.assertNotEqual(first.result(timeout=1), second.result(timeout=1))
+
+    def test_002_wait_for_release(self):
+        pool = self.create(1)
+        first = pool.acquire()
+        second = pool.acquire()
+        self.assertFalse(second.done())
+
+        pool.release(first.result(timeout=1))
+        self.assertEqual(second.result(timeout=1), first.result(timeout=1))
+
+    def test_003_slots_are_separate(self):
+        pool = self.create(2)
+        pool.reserve(0, 4)
+        pool.reserve(1, 4)
+        pool.view(0)[:4] = b"aaaa"
+        pool.view(1)[:4] = b"bbbb"
+        self.assertEqual(bytes(pool.view(0)[:4]), b"aaaa")
+        self.assertEqual(bytes(pool.view(1)[:4]), b"bbbb")
+
+    def test_004_no_slots(self):
+        with self.assertRaises(ValueError):
+            FrameBufferPool(0)
+
+    def test_005_lazy_allocation(self):
+        pool = self.create(4)
+        self.assertEqual(pool.segments, [None] * 4)
+
+        segment = pool.reserve(0, 100)
+        self.assertGreaterEqual(segment.size, 100)
+        self.assertEqual(pool.segments[1:], [None] * 3)
+
+    def test_006_grow(self):
+        pool = self.create(1)
+        small = pool.reserve(0, 100)
+        self.assertIs(pool.reserve(0, 50), small)
+
+        name = small.name
+        large = pool.reserve(0, 1000)
+        self.assertNotEqual(large.name, name)
+        self.assertGreaterEqual(large.size, 1000)
+
+    def test_007_minimal_size(self):
+        pool = self.create(1, 4096)
+        self.assertGreaterEqual(pool.reserve(0, 1).size, 4096)
+
+    def test_008_max_size(self):
+        pool = self.create(1, 0, 100)
+        self.assertIsNone(pool.reserve(0, 101))
+        self.assertIsNone(pool.segments[0])
+        self.assertIsNotNone(pool.reserve(0, 100))
+
+    def test_009_attachments_follow(self):
+        pool = self.create(1)
+        attachments = FrameBufferAttachments()
+        try:
+            segment = pool.reserve(0, 3)
+            attachments.get(0, segment.name)[:3] = b"abc"
+            self.assertEqual(bytes(pool.view(0)[:3]), b"abc")
+
+            segment = pool.reserve(0, 8192)
+            attachments.get(0, segment.name)[:3] = b"def"
+            self.assertEqual(bytes(pool.view(0)[:3]), b"def")
+        finally:
+            attachments.close()
+
+
+class TestFrameTransfer(unittest.TestCase):
+
+    def setUp(self):
+        self.pool = FrameBufferPool(2)
+        self.env = AttachedEnvironment()
+
+    def tearDown(self):
+        self.env.attachments.close()
+        self.pool.close()
+
+    def test_001_write_into_slot(self):
+        commands = BasicCommands(BytesScript([b"abc", b"def"]), self.env)
+        first = self.pool.reserve(0, 3)
+        second = self.pool.reserve(1, 3)
+
+        self.assertEqual(commands.frame_data(id="0", frame=0, slot=1, buffer=second.name, capacity=3).result(timeout=1), 3)
+        self.assertEqual(commands.frame_data(id="0", frame=1, slot=0, buffer=first.name, capacity=3).result(timeout=1), 3)
+        self.assertEqual(bytes(self.pool.view(1)[:3]), b"abc")
+        self.assertEqual(bytes(self.pool.view(0)[:3]), b"def")
+
+    def test_002_oversized(self):
+        commands = BasicCommands(BytesScript([b"abc", b"def"]), self.env)
+        segment = self.pool.reserve(0, 2)
+
+        result = commands.frame_data(id="0", frame=0, slot=0, buffer=segment.name, capacity=2).result(timeout=1)
+        self.assertIsInstance(result, OutOfBandFrame)
+        self.assertEqual(result.read(), b"abc")
+
+        # Requests without a slot.
+        result = commands.frame_data(id="0", frame=1).result(timeout=1)
+        self.assertIsInstance(result, OutOfBandFrame)
+        self.assertEqual(result.read(), b"def")
+
+    def test_003_out_of_band_removed(self):
+        oob = OutOfBandFrame.create(b"abc")
+        self.assertEqual(oob.length, 3)
+        self.assertEqual(oob.read(), b"abc")
+        with self.assertRaises(FileNotFoundError):
+            oob.read()
+
+    def test_004_combined_request(self):
+        commands = BasicCommands(BytesScript([b"abc"]), self.env)
+        segment = self.pool.reserve(0, 3)
+
+        size, format, payload = commands.frame_full(id="0", frame=0, slot=0, buffer=segment.name, capacity=3).result(timeout=1)
+        self.assertEqual((size, format, payload), (Size(3, 1), GRAY8, 3))
+        self.assertEqual(bytes(self.pool.view(0)[:3]), b"abc")
+
+    def test_005_concurrent_transfers(self):
+        script = ManualScript(self.pool)
+        self.pool.reserve(0, 3)
+        self.pool.reserve(1, 3)
+
+        first = ProxyFrame("0", 0, script)._raw_async()
+        second = ProxyFrame("0", 1, script)._raw_async()
+        third = ProxyFrame("0", 2, script)._raw_async()
+
+        # Both slots are in transit. The third frame has to wait.
+        requests = script.frame_requests
+        self.assertEqual(len(requests), 2)
+        slots = [data["slot"] for _, data, _ in requests]
+        self.assertEqual(sorted(slots), [0, 1])
+
+        # Complete out of order.
+        self.pool.view(slots[1])[:3] = b"def"
+        requests[1][2].set_result((Size(3, 1), GRAY8, 3))
+        self.assertEqual(second.result(timeout=1), b"def")
+
+        # The slot has been handed over to the third frame.
+        requests = script.frame_requests
+        self.assertEqual(len(requests), 3)
+        self.assertEqual(requests[2][1]["slot"], slots[1])
+
+        self.pool.view(slots[0])[:3] = b"abc"
+        requests[0][2].set_result((Size(3, 1), GRAY8, 3))
+        self.assertEqual(first.result(timeout=1), b"abc")
+
+        requests[2][2].set_exception(RuntimeError("Failed"))
+        with self.assertRaises(RuntimeError):
+            third.result(timeout=1)
+        self.assertEqual(len(self.pool._free), 2)
+
+    def test_006_single_request(self):
+        script = ManualScript(self.pool)
+        frame = ProxyFrame("0", 0, script)
+        fut = frame.get_raw_data_async()
+
+        # The slot is still empty. The first frame is sent out of band.
+        _, data, response = script.frame_requests[0]
+        self.assertNotIn("buffer", data)
+        response.set_result((Size(16, 8), RGB24, OutOfBandFrame.create(b"x" * 384)))
+
+        self.assertEqual(fut.result(timeout=1), (Size(16, 8), RGB24, b"x" * 384))
+        self.assertEqual(len(script.requester.requests), 1)
+        self.assertEqual(frame.size(), Size(16, 8))
+
+        # The slot has grown so the next frame fits.
+        self.assertGreaterEqual(self.pool.segments[data["slot"]].size, 384)
+
+    def test_007_sized_from_meta(self):
+        script = ManualScript(self.pool)
+        frame = ProxyFrame("0", 0, script)
+        frame._cached_meta = (Size(16, 8), RGB24)
+        frame._raw_async()
+
+        _, data, _ = script.frame_requests[0]
+        self.assertGreaterEqual(data["capacity"], 16*8*3)
+        self.assertEqual(self.pool.segments[data["slot"]].name, data["buffer"])
+
+    def test_008_too_large_for_slots(self):
+        pool = FrameBufferPool(1, 0, 16)
+        script = ManualScript(pool)
+        try:
+            frame = ProxyFrame("0", 0, script)
+            frame._cached_meta = (Size(32, 1), GRAY8)
+            fut = frame._raw_async()
+
+            _, data, response = script.frame_requests[0]
+            self.assertNotIn("buffer", data)
+
+            response.set_result((Size(32, 1), GRAY8, OutOfBandFrame.create(b"x" * 32)))
+            self.assertEqual(fut.result(timeout=1), b"x" * 32)
+            self.assertIsNone(pool.segments[0])
+        finally:
+            pool.close()
+
+    def test_009_pil_from_slot(self):
+        script = ManualScript(self.pool)
+        self.pool.reserve(0, 12)
+        self.pool.reserve(1, 12)
+        frame = ProxyFrame("0", 0, script)
+        fut = frame._pil_async()
+
+        _, data, response = script.frame_requests[0]
+        self.pool.view(data["slot"])[:12] = bytes(range(12))
+        response.set_result((Size(2, 2), RGB24, 12))
+
+        image = fut.result(timeout=1)
+        self.assertEqual(image.tobytes(), bytes([0, 4, 8, 1, 5, 9, 2, 6, 10, 3, 7, 11]))
+        self.assertIs(frame.to_pil(), image)
+
+        # The frame has not been copied out of the slot and the slot can be reused.
+        self.assertIsNone(frame._cached_raw)
+        self.assertEqual(len(self.pool._free), 2)
+        self.pool.reserve(data["slot"], 1024)
+
+    def test_010_pil_out_of_band(self):
+        script = ManualScript(self.pool)
+        fut = ProxyFrame("0", 0, script)._pil_async()
+
+        _, _, response = script.frame_requests[0]
+        oob = OutOfBandFrame.create(bytes(range(12)))
+        response.set_result((Size(2, 2), RGB24, oob))
+
+        self.assertEqual(fut.result(timeout=1).tobytes(), bytes([0, 4, 8, 1, 5, 9, 2, 6, 10, 3, 7, 11]))
+        with self.assertRaises(FileNotFoundError):
+            oob.read()
+
+    def test_011_unknown_frames(self):
+        commands = BasicCommands(BytesScript([b"abc"]), self.env)
+        with self.assertRaisesRegex(KeyError, "missing"):
+            commands.frame_full(id="missing", frame=0).result(timeout=1)
+        with self.assertRaisesRegex(IndexError, "no frame 1"):
+            commands.frame_data(id="0", frame=1).result(timeout=1)
+        with self.assertRaises(IndexError):
+            commands.frame_meta(id="0", frame=-1).result(timeout=1)
+        with self.assertRaises(IndexError):
+            commands.frame_batch(id="0", frames=[0, 1]).result(timeout=1)
+
+    def test_012_discard_out_of_band(self):
+        payloads = [OutOfBandFrame.create(b"abc") for _ in range(3)]
+        payloads[1].read()
+        discard_out_of_band([(Size(3, 1), GRAY8, payload) for payload in payloads])
+        for payload in payloads:
+            with self.assertRaises(FileNotFoundError):
+                payload.read()
+
+
+class TestBatchTransfer(unittest.TestCase):
+
+    def setUp(self):
+        self.pool = FrameBufferPool(2)
+        self.env = AttachedEnvironment()
+
+    def tearDown(self):
+        self.env.attachments.close()
+        self.pool.close()
+
+    def test_001_pack_into_slot(self):
+        commands = BasicCommands(BytesScript([b"abc", b"defg", b"hi"]), self.env)
+        segment = self.pool.reserve(0, 7)
+
+        result = commands.frame_batch(id="0", frames=[2, 0], slot=0, buffer=segment.name, capacity=7).result(timeout=1)
+        self.assertEqual([(size, format) for size, format, _ in result], [(Size(2, 1), GRAY8), (Size(3, 1), GRAY8)])
+        self.assertEqual([payload for _, _, payload in result], [(0, 2), (2, 3)])
+        self.assertEqual(bytes(self.pool.view(0)[:5]), b"hiabc")
+
+    def test_002_overflow(self):
+        commands = BasicCommands(BytesScript([b"abc", b"defg"]), self.env)
+        segment = self.pool.reserve(0, 5)
+
+        result = commands.frame_batch(id="0", frames=[0, 1], slot=0, buffer=segment.name, capacity=5).result(timeout=1)
+        self.assertEqual(result[0][2], (0, 3))
+        self.assertIsInstance(result[1][2], OutOfBandFrame)
+        self.assertEqual(result[1][2].read(), b"defg")
+
+    def test_003_get_frames(self):
+        frames = [bytes([i]) * 4 for i in range(8)]
+        script = ManualScript(self.pool)
+        clip = ProxyClip("0", len(frames), script)
+
+        fut = clip.get_frames([5, 1, 3])
+        script.meta(Size(4, 1), GRAY8)
+        self.assertEqual(len(script.batch_requests), 1)
+        script.respond_batch(script.batch_requests[0], frames)
+
+        result = fut.result(timeout=1)
+        self.assertEqual([f.frameno for f in result], [5, 1, 3])
+        self.assertEqual([f.to_raw() for f in result], [frames[5], frames[1], frames[3]])
+        self.assertEqual(result[0].size(), Size(4, 1))
+
+        # The frame size is known now. No more meta-requests.
+        count = len(script.requester.requests)
+        clip.get_frames([0, 7])
+        self.assertEqual(len(script.requester.requests), count + 1)
+
+    def test_004_split_batches(self):
+        pool = FrameBufferPool(2, 0, 8)
+        frames = [bytes([i]) * 4 for i in range(5)]
+        script = ManualScript(pool)
+        clip = ProxyClip("0", len(frames), script)
+        try:
+            fut = clip.get_frames(range(5))
+            script.meta(Size(4, 1), GRAY8)
+
+            # Two frames fit into a slot.
+            requests = script.batch_requests
+            self.assertEqual([r[1]["frames"] for r in requests], [[0, 1], [2, 3]])
+            script.respond_batch(requests[0], frames)
+            script.respond_batch(requests[1], frames)
+
+            requests = script.batch_requests
+            self.assertEqual(requests[2][1]["frames"], [4])
+            script.respond_batch(requests[2], frames)
+
+            self.assertEqual([f.to_raw() for f in fut.result(timeout=1)], frames)
+        finally:
+            pool.close()
+
+    def test_005_out_of_range(self):
+        clip = ProxyClip("0", 2, ManualScript(self.pool))
+        with self.assertRaises(IndexError):
+            clip.get_frames([0, 2]).result(timeout=1)
+
+    def test_006_larger_than_max_size(self):
+        pool = FrameBufferPool(2, 0, 32)
+        frames = [bytes([i]) * 64 for i in range(3)]
+        script = ManualScript(pool)
+        clip = ProxyClip("0", len(frames), script)
+        try:
+            fut = clip.get_frames(range(3))
+            script.meta(Size(64, 1), GRAY8)
+
+            # The frames do not fit into the slots and are sent out of band.
+            payloads = []
+            while len(payloads) < len(frames):
+                request = script.batch_requests[len(payloads)]
+                self.assertNotIn("buffer", request[1])
+                script.respond_batch(request, frames)
+                payloads.extend(payload for _, _, payload in request[2].result())
+
+            self.assertEqual([f.to_raw() for f in fut.result(timeout=1)], frames)
+            for payload in payloads:
+                with self.assertRaises(FileNotFoundError):
+                    payload.read()
+        finally:
+            pool.close()
+
+    def test_007_failed_batch_removes_segments(self):
+        script = ManualScript(self.pool)
+        clip = ProxyClip("0", 3, script)
+        payloads = [OutOfBandFrame.create(b"abc") for _ in range(3)]
+        results = [(Size(3, 1), GRAY8, payload) for payload in payloads]
+        # The second frame references a slot that has never been allocated.
+        results[1] = (Size(3, 1), GRAY8, (0, 3))
+
+        with self.assertRaises(AttributeError):
+            clip._store_batch([0, 1, 2], results, 0, self.pool, 0)
+        for payload in (payloads[0], payloads[2]):
+            with self.assertRaises(FileNotFoundError):
+                payload.read()
+        payloads[1].read()
+
+    def test_008_failed_batch_in_subprocess(self):
+        commands = BasicCommands(BytesScript([b"abc", b"def"]), self.env)
+        create = OutOfBandFrame.create
+        created = []
+
+        def _create(data):
+            created.append(create(data))
+            return created[-1]
+
+        with mock.patch.object(BytesFrame, "to_raw", side_effect=[b"abc", RuntimeError("broken")]), \
+                mock.patch.object(OutOfBandFrame, "create", side_effect=_create):
+            with self.assertRaisesRegex(RuntimeError, "broken"):
+                commands.frame_batch(id="0", frames=[0, 1]).result(timeout=1)
+
+        # The segment of the first frame is never sent to the main process.
+        self.assertEqual(len(created), 1)
+        with self.assertRaises(FileNotFoundError):
+            created[0].read()
+
+
+if __name__ == '__main__':
+    unittest.main()
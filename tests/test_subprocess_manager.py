@@ -0,0 +1,404 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+test_subprocess_manager
+----------------------------------
+
+Tests for `yuuno.multi_scripts.subprocess.manager` module.
+"""
+
+
+import os
+import time
+import unittest
+from unittest import mock
+from multiprocessing import resource_tracker, get_all_start_methods
+
+import psutil
+
+from yuuno import Yuuno
+from yuuno.multi_scripts.subprocess.manager import SubprocessScriptManager, StartupStats, get_start_context
+from yuuno.multi_scripts.subprocess.provider import ScriptProviderInfo
+from yuuno.multi_scripts.subprocess.proxy import ConnectionLost
+
+from tests.helpers import ManualSubprocess
+
+
+class FakeProcess(object):
+    """
+    Takes a while to initialize, like a real subprocess.
+    """
+
+    def __init__(self, delay):
+        self.delay = delay
+        self.running = False
+        self.disposed = False
+
+    @property
+    def alive(self):
+        return self.running and not self.disposed
+
+    def initialize(self):
+        if self.running:
+            return
+        time.sleep(self.delay)
+        self.running = True
+
+    def dispose(self):
+        self.disposed = True
+
+
+class FakeManager(SubprocessScriptManager):
+
+    def __init__(self, warm_processes, delay=0.05):
+        self.delay = delay
+        self.spawned = []
+        super(FakeManager, self).__init__(None, warm_processes=warm_processes, auto_restart=False)
+
+    def _spawn(self):
+        process = FakeProcess(self.delay)
+        self.spawned.append(process)
+        return process
+
+    def wait_warm(self, count, timeout=5):
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            with self._lock:
+                if len(self._warm) >= count and not self._refilling:
+                    return True
+            time.sleep(0.01)
+        return False
+
+
+class TestWarmPool(unittest.TestCase):
+
+    def tearDown(self):
+        # The manager reads its defaults from the global instance.
+        Yuuno.clear_instance()
+
+    def test_001_prefill(self):
+        manager = FakeManager(3)
+        try:
+            self.assertTrue(manager.wait_warm(3))
+            self.assertEqual(len(manager.spawned), 3)
+            self.assertTrue(all(p.alive for p in manager.spawned))
+        finally:
+            manager.disable()
+
+    def test_002_create_is_warm(self):
+        manager = FakeManager(3, delay=0.2)
+        try:
+            self.assertTrue(manager.wait_warm(3))
+
+            for i in range(3):
+                script = manager.create(str(i), initialize=True)
+                self.assertTrue(script.alive)
+                self.assertIs(manager.get(str(i)), script)
+
+            stats = manager.startup_stats
+            self.assertEqual((stats.created, stats.warm, stats.cold), (3, 3, 0))
+            self.assertLess(stats.longest, 0.1)
+
+            # Refilled in the background.
+            self.assertTrue(manager.wait_warm(3))
+        finally:
+            manager.disable()
+
+    def test_003_cold_start(self):
+        manager = FakeManager(0)
+        try:
+            script = manager.create("test", initialize=True)
+            self.assertTrue(script.alive)
+            stats = manager.startup_stats
+            self.assertEqual((stats.created, stats.cold), (1, 1))
+            self.assertGreaterEqual(stats.last, 0.05)
+            self.assertEqual(len(manager.spawned), 1)
+        finally:
+            manager.disable()
+
+    def test_004_skip_dead(self):
+        manager = FakeManager(1)
+        try:
+            self.assertTrue(manager.wait_warm(1))
+            dead = manager.spawned[0]
+            dead.running = False
+
+            script = manager.create("test")
+            self.assertIsNot(script, dead)
+            self.assertTrue(dead.disposed)
+            self.assertEqual(manager.startup_stats.warm, 0)
+        finally:
+            manager.disable()
+
+    def test_005_disable(self):
+        manager = FakeManager(2)
+        self.assertTrue(manager.wait_warm(2))
+        manager.disable()
+        self.assertTrue(all(p.disposed for p in manager.spawned))
+
+    def test_006_stats(self):
+        stats = StartupStats().record(0.1, True).record(0.3, False)
+        self.assertEqual((stats.created, stats.warm, stats.cold), (2, 1, 1))
+        self.assertAlmostEqual(stats.average, 0.2)
+        self.assertEqual(stats.longest, 0.3)
+        self.assertEqual(stats.last, 0.3)
+
+
+class TestReplay(unittest.TestCase):
+
+    def test_001_requests_wait_for_replay(self):
+        script = ManualSubprocess(None, None)
+        script.execute("a")
+        script.execute("b")
+
+        replacement = ManualSubprocess(None, None)
+        script.adopt(replacement)
+        requests = replacement.requester.requests
+        results = script.get_results()
+        replay = script.replay()
+
+        # Only the replayed code reaches the subprocess.
+        self.assertEqual([data["code"] for _, data, _ in requests], ["a"])
+        generation = script.generation
+        requests[0][2].set_result(None)
+        self.assertEqual([data["code"] for _, data, _ in requests[1:]], ["b"])
+        requests[1][2].set_result(None)
+
+        replay.result(timeout=1)
+        self.assertGreater(script.generation, generation)
+        self.assertEqual(requests[2][0], "script/subprocess/results")
+        requests[2][2].set_result({"a": 1, "b": 1})
+        self.assertEqual(set(results.result(timeout=1)), {"a", "b"})
+
+        # Once replayed, requests are sent right away.
+        script.get_results()
+        self.assertEqual(len(requests), 4)
+
+
+class TestSpawner(unittest.TestCase):
+
+    def setUp(self):
+        # Spawning starts the resource tracker once. Do not count it.
+        resource_tracker.ensure_running()
+        self.current = psutil.Process()
+        self.before = {p.pid for p in self.current.children()}
+
+    def tearDown(self):
+        Yuuno.clear_instance()
+
+    def started(self):
+        return {p.pid for p in self.current.children()} - self.before
+
+    def manager(self, start_method, provider="yuuno.multi_scripts.subprocess.provider.ScriptProvider", **kwargs):
+        return SubprocessScriptManager(
+            ScriptProviderInfo(provider, [], {}),
+            warm_processes=0,
+            start_method=start_method,
+            **kwargs
+        )
+
+    def test_001_no_idle_processes(self):
+        manager = self.manager("spawn")
+        try:
+            self.assertEqual(self.started(), set())
+
+            script = manager.create("test")
+            self.assertEqual(self.started(), {script.process.pid})
+        finally:
+            manager.disable()
+        self.assertEqual(self.started(), set())
+
+    @unittest.skipUnless("forkserver" in get_all_start_methods(), "No forkserver on this platform")
+    def test_002_forkserver(self):
+        manager = self.manager("forkserver")
+        try:
+            for i in range(2):
+                script = manager.create(str(i), initialize=True)
+                self.assertTrue(script.alive)
+                # Forked from the server instead of started by this process.
+                self.assertNotEqual(psutil.Process(script.process.pid).ppid(), os.getpid())
+        finally:
+            manager.disable()
+
+    def test_003_fallback(self):
+        self.assertEqual(get_start_context("unknown").get_start_method(), "spawn")
+
+    def test_004_child_death(self):
+        manager = self.manager("spawn", auto_restart=False)
+        try:
+            script = manager.create("test", initialize=True)
+            psutil.Process(script.process.pid).kill()
+
+            with self.assertRaises(ConnectionLost):
+                script.get_results().result(timeout=5)
+            self.assertEqual(len(script.requester.waiting), 0)
+        finally:
+            manager.disable()
+
+    def wait_for_outputs(self, script, outputs, timeout=10):
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            try:
+                results = script.get_results().result(timeout=1)
+            except ConnectionLost:
+                pass
+            else:
+                if set(results) == outputs:
+                    return results
+            time.sleep(0.05)
+        self.fail(f"The outputs {outputs} did not come back.")
+
+    def wait_until(self, condition, timeout=10):
+        deadline = time.monotonic() + timeout
+        while not condition():
+            if time.monotonic() > deadline:
+                self.fail("Timed out.")
+            time.sleep(0.05)
+
+    def test_005_restart_and_replay(self):
+        manager = self.manager("forkserver", provider="tests.helpers.RecordingScriptProvider")
+        try:
+            script = manager.create("test", initialize=True)
+            script.execute("a").result(timeout=5)
+            script.execute("bc").result(timeout=5)
+            clip = script.get_results().result(timeout=5)["bc"]
+
+            first = script.process.pid
+            psutil.Process(first).kill()
+
+            results = self.wait_for_outputs(script, {"a", "bc"})
+            self.assertNotEqual(script.process.pid, first)
+            self.assertEqual(len(results["bc"]), 2)
+
+            # The replay succeeded. The restart does not count towards max_restarts anymore.
+            self.wait_until(lambda: "test" not in manager.restarts)
+
+            # Clips created before the restart use the new subprocess.
+            self.assertIs(clip.script, script)
+        finally:
+            manager.disable()
+
+    def test_006_give_up(self):
+        manager = self.manager("forkserver", provider="tests.helpers.RecordingScriptProvider", max_restarts=0)
+        try:
+            script = manager.create("test", initialize=True)
+            psutil.Process(script.process.pid).kill()
+
+            deadline = time.monotonic() + 5
+            while script.process is not None and time.monotonic() < deadline:
+                time.sleep(0.05)
+            self.assertIsNone(script.process)
+            with self.assertRaises(ConnectionLost):
+                script.get_results().result(timeout=5)
+        finally:
+            manager.disable()
+
+    def test_007_restarts_in_a_row(self):
+        manager = self.manager("forkserver", provider="tests.helpers.RecordingScriptProvider", max_restarts=1)
+        try:
+            script = manager.create("test", initialize=True)
+            script.execute("a").result(timeout=5)
+
+            # Unrelated crashes are survived as long as the script recovers in between.
+            for _ in range(3):
+                pid = script.process.pid
+                psutil.Process(pid).kill()
+                self.wait_until(lambda: script.process is not None and script.process.pid != pid)
+                self.wait_for_outputs(script, {"a"})
+                self.wait_until(lambda: "test" not in manager.restarts)
+            self.assertTrue(script.alive)
+        finally:
+            manager.disable()
+
+    def test_008_replay_timeout(self):
+        manager = self.manager(
+            "forkserver", provider="tests.helpers.RecordingScriptProvider",
+            max_restarts=2, replay_timeout=0.2
+        )
+        try:
+            script = manager.create("test", initialize=True)
+            script.execute("slow").result(timeout=5)
+            psutil.Process(script.process.pid).kill()
+
+            # The replay never finishes in time. The supervisor keeps restarting until it gives up.
+            self.wait_until(lambda: script.process is None)
+            self.assertEqual(manager.restarts["test"], 3)
+        finally:
+            manager.disable()
+
+    def test_009_sharded(self):
+        manager = self.manager("forkserver", provider="tests.helpers.RecordingScriptProvider")
+        try:
+            script = manager.create_sharded("test", 2, initialize=True)
+            self.assertIs(manager.get("test"), script)
+            self.assertEqual(set(manager.instances), {"test#0", "test#1"})
+
+            script.execute("abcd").result(timeout=5)
+            clip = script.get_results().result(timeout=5)["abcd"]
+            frames = clip.get_frames([3, 0, 1]).result(timeout=5)
+            self.assertEqual([f.to_raw() for f in frames], [b"d" * 64, b"a" * 64, b"b" * 64])
+            self.assertEqual(clip[2].result(timeout=5).to_raw(), b"c" * 64)
+        finally:
+            manager.disable()
+        self.assertFalse(script.alive)
+
+    @unittest.skipUnless("forkserver" in get_all_start_methods(), "No forkserver on this platform")
+    def test_010_forkserver_preload(self):
+        from multiprocessing import forkserver
+        get_start_context("forkserver")
+        get_start_context("forkserver")
+
+        # The modules preloaded by default are kept and ours are only added once.
+        modules = forkserver._forkserver._preload_modules
+        self.assertIn("__main__", modules)
+        self.assertEqual(modules.count("yuuno.multi_scripts.subprocess.preload"), 1)
+
+    def test_011_dispatch_workers(self):
+        manager = self.manager("forkserver", provider="tests.helpers.RecordingScriptProvider", dispatch_workers=2)
+        try:
+            script = manager.create("test", initialize=True)
+            script.execute("workers").result(timeout=5)
+            self.assertEqual(set(script.get_results().result(timeout=5)), {"workers=2"})
+        finally:
+            manager.disable()
+
+    def test_012_failed_restart(self):
+        manager = self.manager("forkserver", provider="tests.helpers.RecordingScriptProvider", max_restarts=1)
+        try:
+            broken = manager.create("broken", initialize=True)
+            script = manager.create("test", initialize=True)
+            script.execute("a").result(timeout=5)
+
+            with mock.patch.object(broken, "adopt", side_effect=BufferError("exported")), \
+                    mock.patch.object(Yuuno.instance().log, "exception") as log:
+                psutil.Process(broken.process.pid).kill()
+                self.wait_until(lambda: broken.process is None)
+            self.assertTrue(log.called)
+
+            # The supervisor survived and still restarts other scripts.
+            pid = script.process.pid
+            psutil.Process(pid).kill()
+            self.wait_until(lambda: script.process is not None and script.process.pid != pid)
+            self.wait_for_outputs(script, {"a"})
+        finally:
+            manager.disable()
+
+    def test_013_restart_releases_fds(self):
+        manager = self.manager("forkserver", provider="tests.helpers.RecordingScriptProvider")
+        try:
+            script = manager.create("test", initialize=True)
+            requester, pid = script.requester, script.process.pid
+            psutil.Process(pid).kill()
+            requester.join(5)
+
+            # The requester quit on its own when the subprocess died.
+            self.wait_until(lambda: script.process is not None and script.process.pid != pid)
+            self.assertTrue(requester._wakeup_read.closed)
+            self.assertTrue(requester._wakeup_write.closed)
+        finally:
+            manager.disable()
+
+
+if __name__ == '__main__':
+    unittest.main()
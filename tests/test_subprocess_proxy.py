@@ -0,0 +1,288 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+test_subprocess_proxy
+----------------------------------
+
+Tests for `yuuno.multi_scripts.subprocess.proxy` module.
+"""
+
+
+import time
+import unittest
+from threading import Thread, Event, Barrier, Lock
+from multiprocessing import Pipe
+from queue import Queue
+
+import psutil
+
+from yuuno.utils import inline_resolved
+from concurrent.futures import Future
+
+from yuuno.multi_scripts.subprocess.proxy import Requester, Responder, Response, ConnectionLost
+from yuuno.multi_scripts.subprocess.provider import ScriptProviderInfo
+from yuuno.multi_scripts.subprocess.process import LocalSubprocessEnvironment
+
+
+# How long stopping may take. The old implementation needed up to a second.
+MAX_SHUTDOWN_LATENCY = 0.2
+
+
+@inline_resolved
+def echo(data):
+    return data
+
+
+class ConnectedPair(object):
+    """
+    A requester and a responder connected through pipes.
+    """
+
+    def __init__(self, handlers, sentinel=None):
+        self.request_read, self.request_write = Pipe(duplex=False)
+        self.response_read, self.response_write = Pipe(duplex=False)
+
+        self.disconnected = Event()
+        self.responder = Responder(self.request_read, self.response_write, handlers, on_disconnect=self.disconnected.set)
+        self.requester = Requester(self.response_read, self.request_write)
+        self.requester.sentinel = sentinel
+        self.responder.start()
+        self.requester.start()
+
+    def stop(self):
+        for handler in (self.requester, self.responder):
+            if handler.is_alive():
+                handler.stop()
+            handler.close()
+
+
+class TestHandler(unittest.TestCase):
+
+    def setUp(self):
+        self.pair = ConnectedPair({"echo": echo, "never": lambda data: Future()})
+
+    def tearDown(self):
+        self.pair.stop()
+
+    def test_001_round_trip(self):
+        fut = self.pair.requester.submit("echo", {"data": 42})
+        self.assertEqual(fut.result(timeout=5), {"data": 42})
+
+    def test_002_unknown_command(self):
+        fut = self.pair.requester.submit("unknown", {})
+        with self.assertRaises(NotImplementedError):
+            fut.result(timeout=5)
+
+    def test_003_shutdown_latency(self):
+        # Make sure both threads are blocked waiting.
+        time.sleep(0.1)
+
+        for handler in (self.pair.requester, self.pair.responder):
+            start = time.monotonic()
+            handler.stop()
+            self.assertLess(time.monotonic() - start, MAX_SHUTDOWN_LATENCY)
+            self.assertFalse(handler.is_alive())
+
+    def test_004_idle_cpu(self):
+        # Idle handlers should be blocked in the kernel, not spinning.
+        start_wall = time.monotonic()
+        start_cpu = time.process_time()
+        time.sleep(0.5)
+        cpu = time.process_time() - start_cpu
+        wall = time.monotonic() - start_wall
+        self.assertLess(cpu / wall, 0.05)
+
+    def test_005_disconnect(self):
+        self.pair.request_write.close()
+        self.assertTrue(self.pair.disconnected.wait(5))
+        self.pair.responder.join(5)
+        self.assertFalse(self.pair.responder.is_alive())
+
+    def test_006_waiting_cleaned_up(self):
+        futs = [self.pair.requester.submit("echo", {"data": i}) for i in range(100)]
+        self.assertEqual([f.result(timeout=5) for f in futs], [{"data": i} for i in range(100)])
+        self.assertEqual(len(self.pair.requester.waiting), 0)
+
+    def test_007_fail_pending_on_disconnect(self):
+        pending = self.pair.requester.submit("never", {})
+        self.pair.responder.stop()
+        self.pair.response_write.close()
+
+        with self.assertRaises(ConnectionLost):
+            pending.result(timeout=5)
+        self.assertEqual(len(self.pair.requester.waiting), 0)
+
+        # Later requests fail right away.
+        with self.assertRaises(ConnectionLost):
+            self.pair.requester.submit("echo", {}).result(timeout=0)
+
+    def test_008_fail_pending_on_sentinel(self):
+        # Stands in for the sentinel of a dying process.
+        sentinel, process_alive = Pipe(duplex=False)
+        pair = ConnectedPair({"never": lambda data: Future()}, sentinel)
+        try:
+            pending = pair.requester.submit("never", {})
+            time.sleep(0.05)
+            process_alive.close()
+            with self.assertRaises(ConnectionLost):
+                pending.result(timeout=5)
+        finally:
+            pair.stop()
+
+    def test_009_fail_pending_on_stop(self):
+        pending = self.pair.requester.submit("never", {})
+        self.pair.requester.stop()
+        with self.assertRaises(ConnectionLost):
+            pending.result(timeout=0)
+
+    def test_010_close_without_start(self):
+        process = psutil.Process()
+        fds = process.num_fds()
+        for _ in range(10):
+            Requester(None, None).close()
+        self.assertEqual(process.num_fds(), fds)
+
+    def test_011_unclaimed_responses(self):
+        unclaimed = Queue()
+        self.pair.requester.on_unclaimed = unclaimed.put
+
+        # Nobody waits for this response.
+        self.pair.responder.send(Response(id=1000, data="frames"))
+        self.assertEqual(unclaimed.get(timeout=5), "frames")
+
+
+class TestEnvironmentLoop(unittest.TestCase):
+
+    def setUp(self):
+        self.parent_read, self.child_write = Pipe(duplex=False)
+        self.child_read, self.parent_write = Pipe(duplex=False)
+
+        self.env = LocalSubprocessEnvironment()
+        self.env.read = self.child_read
+        self.env.write = self.child_write
+        self.env._provider_meta = ScriptProviderInfo("yuuno.multi_scripts.subprocess.provider.ScriptProvider", [], {})
+        self.env.post_extension_load()
+        self.env.register_command("echo", lambda data: data)
+
+        self.active = 0
+        self.max_active = 0
+        self._active_lock = Lock()
+        self.barrier = Barrier(2, timeout=5)
+        self.env.register_command("read", self.read_command, shared=True)
+        self.env.register_command("write", self.write_command)
+
+        self.thread = Thread(target=self.env.run, daemon=True)
+        self.thread.start()
+
+        # The environment reports that it is ready.
+        self.assertTrue(self.parent_read.poll(5))
+        self.parent_read.recv_bytes()
+        self.requester = Requester(self.parent_read, self.parent_write)
+        self.requester.start()
+
+    def _track(self, delta):
+        with self._active_lock:
+            self.active += delta
+            self.max_active = max(self.max_active, self.active)
+
+    def read_command(self, wait):
+        self._track(1)
+        try:
+            if wait:
+                # Only passes if two reads run at the same time.
+                self.barrier.wait()
+            time.sleep(0.02)
+        finally:
+            self._track(-1)
+        return "read"
+
+    def write_command(self):
+        self._track(1)
+        try:
+            active = self.active
+            time.sleep(0.05)
+        finally:
+            self._track(-1)
+        return active
+
+    def tearDown(self):
+        if self.requester.is_alive():
+            self.requester.stop()
+        self.env.stop()
+        self.thread.join(5)
+
+    def test_001_dispatch(self):
+        fut = self.requester.submit("echo", {"data": "test"})
+        self.assertEqual(fut.result(timeout=5), "test")
+
+    def test_002_stop_latency(self):
+        time.sleep(0.1)
+        start = time.monotonic()
+        self.env.stop()
+        self.thread.join(5)
+        self.assertFalse(self.thread.is_alive())
+        self.assertLess(time.monotonic() - start, MAX_SHUTDOWN_LATENCY)
+
+    def test_003_stop_on_disconnect(self):
+        self.requester.stop()
+        self.parent_write.close()
+        self.thread.join(5)
+        self.assertFalse(self.thread.is_alive())
+
+    def test_004_shared_commands_overlap(self):
+        futs = [self.requester.submit("read", {"wait": True}) for _ in range(2)]
+        self.assertEqual([f.result(timeout=5) for f in futs], ["read", "read"])
+        self.assertEqual(self.max_active, 2)
+
+    def test_005_exclusive_commands(self):
+        futs = [self.requester.submit("read", {"wait": False}) for _ in range(3)]
+        write = self.requester.submit("write", {})
+        futs += [self.requester.submit("read", {"wait": False}) for _ in range(3)]
+
+        # No other command runs while the exclusive command runs.
+        self.assertEqual(write.result(timeout=5), 1)
+        for fut in futs:
+            self.assertEqual(fut.result(timeout=5), "read")
+
+
+class InterruptedQueue(Queue):
+    """
+    Raises KeyboardInterrupt while the loop waits for the next command.
+    """
+
+    interrupted = False
+
+    def get(self, *args, **kwargs):
+        if not self.interrupted:
+            self.interrupted = True
+            raise KeyboardInterrupt
+        return super(InterruptedQueue, self).get(*args, **kwargs)
+
+
+class TestEnvironmentInterrupt(unittest.TestCase):
+
+    def test_001_interrupt_while_waiting(self):
+        child_read, parent_write = Pipe(duplex=False)
+        parent_read, child_write = Pipe(duplex=False)
+
+        env = LocalSubprocessEnvironment()
+        env.read = child_read
+        env.write = child_write
+        env._provider_meta = ScriptProviderInfo("yuuno.multi_scripts.subprocess.provider.ScriptProvider", [], {})
+        env.post_extension_load()
+        env.queue = InterruptedQueue()
+
+        thread = Thread(target=env.run, daemon=True)
+        thread.start()
+        thread.join(5)
+        self.assertFalse(thread.is_alive())
+        self.assertTrue(env.stopped.is_set())
+
+        # The dispatch workers have been shut down.
+        with self.assertRaises(RuntimeError):
+            env.executor.submit(lambda: None)
+
+
+if __name__ == '__main__':
+    unittest.main()
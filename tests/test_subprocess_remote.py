@@ -0,0 +1,206 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+test_subprocess_remote
+----------------------------------
+
+Tests for `yuuno.multi_scripts.subprocess.remote` module.
+"""
+
+
+import os
+import socket
+import tempfile
+import time
+import unittest
+from io import StringIO
+from unittest import mock
+from contextlib import redirect_stderr
+from multiprocessing import get_context
+
+from yuuno.clip import Size
+from yuuno.commands import worker
+from yuuno.multi_scripts.subprocess.basic_commands import BasicCommands
+from yuuno.multi_scripts.subprocess.cache import FrameCache
+from yuuno.multi_scripts.subprocess.compression import available_codecs
+from yuuno.multi_scripts.subprocess.clip import ProxyFrame, ProxyClip
+from yuuno.multi_scripts.subprocess.provider import ScriptProviderInfo
+from yuuno.multi_scripts.subprocess.remote import RemoteScript, parse_address, serve
+
+from tests.helpers import ManualScript, BytesScript
+
+
+PROVIDER = ScriptProviderInfo("tests.helpers.RecordingScriptProvider", [], {})
+AUTHKEY = b"secret"
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+class TestInlineFrames(unittest.TestCase):
+
+    def test_001_parse_address(self):
+        self.assertEqual(parse_address("127.0.0.1:1234"), (("127.0.0.1", 1234), "AF_INET"))
+        self.assertEqual(parse_address(":1234"), (("127.0.0.1", 1234), "AF_INET"))
+        self.assertEqual(parse_address("unix:/tmp/yuuno"), ("/tmp/yuuno", "AF_UNIX"))
+        with self.assertRaises(ValueError):
+            parse_address("127.0.0.1")
+
+    def test_002_compression(self):
+        flat = b"a" * 1000
+        noise = os.urandom(1000)
+        commands = BasicCommands(BytesScript([flat, noise, flat, flat]), None)
+        script = ManualScript(None)
+        script.codec = "zlib"
+
+        codecs = []
+        for frameno, raw in enumerate([flat, noise, flat, flat]):
+            fut = ProxyFrame("0", frameno, script)._raw_async()
+            _, data, response = script.frame_requests[frameno]
+            result = commands.frame_full(**data).result(timeout=1)
+            codecs.append(result[2].codec)
+            response.set_result(result)
+            self.assertEqual(fut.result(timeout=1), raw)
+
+        # Noise is sent as it is, and so is the frame after it.
+        self.assertEqual(codecs, ["zlib", None, None, "zlib"])
+
+    def test_003_proxy_frame(self):
+        commands = BasicCommands(BytesScript([b"abc" * 10]), None)
+        script = ManualScript(None)
+        script.codec = "zlib"
+        fut = ProxyFrame("0", 0, script)._raw_async()
+
+        _, data, response = script.frame_requests[0]
+        self.assertEqual(data, {"id": "0", "frame": 0, "inline": True, "codec": "zlib"})
+        response.set_result(commands.frame_full(**data).result(timeout=1))
+        self.assertEqual(fut.result(timeout=1), b"abc" * 10)
+
+    def test_004_get_frames(self):
+        frames = [bytes([i]) * 100 for i in range(10)]
+        commands = BasicCommands(BytesScript(frames), None)
+        script = ManualScript(None)
+        script.codec = "zlib"
+        clip = ProxyClip("0", 10, script)
+        fut = clip.get_frames([1, 2])
+
+        _, data, response = script.batch_requests[0]
+        self.assertTrue(data["inline"])
+        result = commands.frame_batch(**data).result(timeout=1)
+        self.assertEqual([payload.codec for _, _, payload in result], ["zlib", "zlib"])
+        response.set_result(result)
+        self.assertEqual([f.to_raw() for f in fut.result(timeout=1)], [frames[1], frames[2]])
+
+    def run_worker(self, *args):
+        with mock.patch.object(worker, "serve") as serve, \
+                mock.patch.dict(os.environ, clear=True), \
+                mock.patch("sys.argv", ["yuuno worker", *args]), \
+                redirect_stderr(StringIO()):
+            worker.main()
+        return serve
+
+    def test_005_worker_requires_authkey(self):
+        for address in ("127.0.0.1:1234", "localhost:1234", ":1234"):
+            with self.assertRaises(SystemExit):
+                self.run_worker(address)
+
+        serve = self.run_worker("127.0.0.1:1234", "-k", "secret")
+        self.assertEqual(serve.call_args[1]["authkey"], b"secret")
+
+        # Only the file permissions protect a unix socket.
+        serve = self.run_worker("unix:/tmp/yuuno-worker")
+        self.assertIsNone(serve.call_args[1]["authkey"])
+
+
+class WorkerTestMixin(object):
+
+    address: str
+
+    def setUp(self):
+        self.worker = get_context("spawn").Process(
+            target=serve, args=(self.address,), kwargs={"authkey": AUTHKEY}
+        )
+        self.worker.start()
+        self.script = self.connect()
+
+    def tearDown(self):
+        self.script.dispose()
+        self.worker.terminate()
+        self.worker.join()
+
+    def connect(self, **kwargs):
+        deadline = time.monotonic() + 10
+        while True:
+            try:
+                return RemoteScript(self.address, PROVIDER, authkey=AUTHKEY, frame_cache=FrameCache(0), **kwargs)
+            except (ConnectionRefusedError, FileNotFoundError):
+                if time.monotonic() > deadline:
+                    raise
+                time.sleep(0.05)
+
+    def test_001_execute(self):
+        self.script.initialize()
+        self.assertTrue(self.script.alive)
+        self.script.execute("ab").result(timeout=10)
+        results = self.script.get_results().result(timeout=10)
+        self.assertEqual(list(results), ["ab"])
+        self.assertEqual(len(results["ab"]), 2)
+
+    def test_002_frames(self):
+        self.script.initialize()
+        self.assertEqual(self.script.codec, available_codecs()[0])
+        self.script.execute("ab").result(timeout=10)
+        clip = self.script.get_results().result(timeout=10)["ab"]
+
+        frame = clip[1].result(timeout=10)
+        self.assertEqual(frame.to_raw(), b"b" * 64)
+        self.assertEqual(frame.size(), Size(64, 1))
+        self.assertEqual([f.to_raw() for f in clip.get_frames([0, 1]).result(timeout=10)], [b"a" * 64, b"b" * 64])
+
+    def test_003_uncompressed(self):
+        self.script.dispose()
+        self.script = self.connect(compression=False)
+        self.script.initialize()
+        self.assertIsNone(self.script.codec)
+
+        self.script.execute("a").result(timeout=10)
+        clip = self.script.get_results().result(timeout=10)["a"]
+        self.assertEqual(clip[0].result(timeout=10).to_raw(), b"a" * 64)
+
+    def test_004_wrong_authkey(self):
+        from multiprocessing import AuthenticationError
+        with self.assertRaises(AuthenticationError):
+            RemoteScript(self.address, PROVIDER, authkey=b"wrong")
+
+    def test_005_unknown_output(self):
+        self.script.initialize()
+        with self.assertRaisesRegex(KeyError, "missing"):
+            ProxyFrame("missing", 0, self.script).to_raw()
+
+
+class TestTCPWorker(WorkerTestMixin, unittest.TestCase):
+
+    def setUp(self):
+        self.address = f"127.0.0.1:{free_port()}"
+        super(TestTCPWorker, self).setUp()
+
+
+@unittest.skipUnless(hasattr(socket, "AF_UNIX"), "No unix sockets on this platform")
+class TestUnixWorker(WorkerTestMixin, unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.address = "unix:" + os.path.join(self.directory.name, "worker")
+        super(TestUnixWorker, self).setUp()
+
+    def tearDown(self):
+        super(TestUnixWorker, self).tearDown()
+        self.directory.cleanup()
+
+
+if __name__ == '__main__':
+    unittest.main()
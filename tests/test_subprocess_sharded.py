@@ -0,0 +1,121 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+test_subprocess_sharded
+----------------------------------
+
+Tests for `yuuno.multi_scripts.subprocess.sharded` module.
+"""
+
+
+import unittest
+
+from yuuno.utils import inline_resolved
+from yuuno.multi_scripts.subprocess.sharded import ShardedClip, ShardedScript, ROUND_ROBIN, RANGE
+
+from tests.helpers import BytesClip, RecordingScript
+
+
+class ShardClip(BytesClip):
+    """
+    Records which frames have been requested from the shard.
+    """
+
+    def __init__(self, frames):
+        super(ShardClip, self).__init__(frames)
+        self.requested = []
+
+    def __getitem__(self, item):
+        self.requested.append(item)
+        return super(ShardClip, self).__getitem__(item)
+
+    @inline_resolved
+    def get_frames(self, indices):
+        return [self[i].result() for i in indices]
+
+
+class ShardScript(RecordingScript):
+
+    def __init__(self):
+        super(ShardScript, self).__init__()
+        self.running = True
+
+    @property
+    def alive(self):
+        return self.running
+
+    def dispose(self):
+        self.running = False
+
+
+class TestShardedClip(unittest.TestCase):
+
+    def clip(self, routing, length=8, shards=2):
+        self.shards = [ShardClip([bytes([i]) for i in range(length)]) for _ in range(shards)]
+        return ShardedClip("0", self.shards, routing)
+
+    def test_001_round_robin(self):
+        clip = self.clip(ROUND_ROBIN)
+        for i in range(8):
+            self.assertEqual(clip[i].result().to_raw(), bytes([i]))
+        self.assertEqual(self.shards[0].requested, [0, 2, 4, 6])
+        self.assertEqual(self.shards[1].requested, [1, 3, 5, 7])
+
+    def test_002_range(self):
+        clip = self.clip(RANGE, length=7, shards=3)
+        for i in range(7):
+            clip[i].result()
+        self.assertEqual([s.requested for s in self.shards], [[0, 1, 2], [3, 4], [5, 6]])
+
+    def test_003_get_frames_keeps_order(self):
+        clip = self.clip(ROUND_ROBIN)
+        frames = clip.get_frames([5, 2, 7, 0, 2]).result()
+        self.assertEqual([f.to_raw() for f in frames], [b"\5", b"\2", b"\7", b"\0", b"\2"])
+        self.assertEqual(self.shards[0].requested, [2, 0, 2])
+        self.assertEqual(self.shards[1].requested, [5, 7])
+
+    def test_004_out_of_range(self):
+        clip = self.clip(ROUND_ROBIN)
+        with self.assertRaises(IndexError):
+            clip[8].result()
+        with self.assertRaises(IndexError):
+            clip.get_frames([1, 8]).result()
+        self.assertEqual(clip.get_frames([]).result(), [])
+
+
+class TestShardedScript(unittest.TestCase):
+
+    def test_001_execute_everywhere(self):
+        shards = [ShardScript(), ShardScript()]
+        script = ShardedScript(shards, RANGE)
+        script.execute("abc").result()
+
+        results = script.get_results().result()
+        self.assertEqual(list(results), ["abc"])
+        self.assertEqual(results["abc"].routing, RANGE)
+        self.assertEqual(len(results["abc"]), 3)
+        self.assertEqual(results["abc"][2].result().to_raw(), b"c" * 64)
+
+    def test_002_disagreeing_shards(self):
+        shards = [ShardScript(), ShardScript()]
+        shards[0].execute("abc").result()
+        with self.assertRaises(ValueError):
+            ShardedScript(shards).get_results().result()
+
+    def test_003_dispose(self):
+        shards = [ShardScript(), ShardScript()]
+        script = ShardedScript(shards)
+        self.assertTrue(script.alive)
+        script.dispose()
+        self.assertFalse(any(s.alive for s in shards))
+
+    def test_004_invalid(self):
+        with self.assertRaises(ValueError):
+            ShardedScript([])
+        with self.assertRaises(ValueError):
+            ShardedScript([ShardScript()], "random")
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,94 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+test_subprocess_wire
+----------------------------------
+
+Tests for `yuuno.multi_scripts.subprocess.wire` module.
+"""
+
+
+import pickle
+import unittest
+
+from yuuno.clip import Size, RawFormat, GRAY8, RGB24
+from yuuno.multi_scripts.subprocess import wire
+from yuuno.multi_scripts.subprocess.proxy import Request, Response
+from yuuno.multi_scripts.subprocess.framebuffer import OutOfBandFrame
+
+
+YUV420P10 = RawFormat(10, 3, RawFormat.ColorFamily.YUV, RawFormat.SampleType.INTEGER, 1, 1)
+
+
+class TestWire(unittest.TestCase):
+
+    def assertRoundTrip(self, obj):
+        data = wire.dumps(obj)
+        result = wire.loads(data)
+        self.assertEqual(result, obj)
+        self.assertIs(type(result), type(obj))
+        return data
+
+    def test_001_frame_request(self):
+        data = self.assertRoundTrip(Request(id=12, type="script/subprocess/results/frame", data={
+            "id": "0", "frame": 1234, "slot": 1, "buffer": "psm_abcdef", "capacity": 1920*1080*3
+        }, protect=True))
+        self.assertEqual(data[0], wire.KIND_FRAME_REQUEST)
+
+    def test_002_frame_response(self):
+        result = wire.loads(wire.dumps(Response(id=3, data=(Size(1920, 1080), YUV420P10, 1234), protected=True)))
+        size, format, length = result.data
+        self.assertIs(type(size), Size)
+        self.assertIs(type(format), RawFormat)
+        self.assertIs(type(format.family), RawFormat.ColorFamily)
+        self.assertEqual(format, YUV420P10)
+        self.assertTrue(result.protected)
+
+    def test_003_batch_response(self):
+        self.assertRoundTrip(Response(id=3, data=[
+            (Size(16, 8), RGB24, (0, 384)),
+            (Size(16, 8), GRAY8, OutOfBandFrame("psm_1", 128)),
+        ]))
+
+    def test_004_batch_request(self):
+        data = self.assertRoundTrip(Request(id=1, type="script/subprocess/results/raw_batch", data={
+            "id": "clip", "frames": [5, 1, 3], "slot": 0, "buffer": "psm_1", "capacity": 4096
+        }, protect=True))
+        self.assertEqual(data[0], wire.KIND_BATCH_REQUEST)
+
+    def test_005_without_buffer(self):
+        self.assertRoundTrip(Request(id=1, type="script/subprocess/results/raw", data={
+            "id": "0", "frame": 1, "slot": 0
+        }))
+        self.assertRoundTrip(Response(id=1, data=(Size(16, 8), RGB24, OutOfBandFrame("psm_2", 384))))
+        self.assertRoundTrip(Response(id=1, data=384))
+
+    def test_006_pickle_fallback(self):
+        for obj in [
+            None,
+            Request(id=1, type="script/subprocess/execute", data={"type": "string", "code": "x = 1"}),
+            Request(id=1, type="script/subprocess/results/frame", data={"id": "0", "frame": 1, "slot": 0, "extra": 1}),
+            Request(id=1, type="script/subprocess/results/frame", data={"id": 0, "frame": 1, "slot": 0}),
+            Response(id=1, data={"0": 100}),
+            Response(id=1, data=2**64),
+            Response(id=1, data=(1, 2, 3)),
+            Response(id=1, data=[(Size(1, 1), GRAY8, 5)]),
+        ]:
+            data = self.assertRoundTrip(obj)
+            self.assertEqual(data[0], wire.KIND_PICKLE)
+
+    def test_007_errors_are_pickled(self):
+        result = wire.loads(wire.dumps(Response(id=1, error=ValueError("Test"), traceback=["a"])))
+        self.assertIsInstance(result.error, ValueError)
+        self.assertEqual(result.traceback, ["a"])
+
+    def test_008_smaller_than_pickle(self):
+        request = Request(id=12, type="script/subprocess/results/frame", data={
+            "id": "0", "frame": 1234, "slot": 1, "buffer": "psm_abcdef", "capacity": 1920*1080*3
+        }, protect=True)
+        self.assertLess(len(wire.dumps(request)), len(pickle.dumps(request)))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,66 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+test_tiled_output
+----------------------------------
+
+Tests for `yuuno.output.tiled` module.
+"""
+
+
+import unittest
+from io import BytesIO
+
+from PIL import Image
+
+from yuuno.clip import Size
+from yuuno.output import YuunoTiledOutput
+from yuuno.output.tiled import shutdown_executors
+
+
+class TestTiledOutput(unittest.TestCase):
+
+    def setUp(self):
+        self.output = YuunoTiledOutput(tile_size=16, workers=2)
+        self.output.image_output.icc_profile = None
+
+    def tearDown(self):
+        pass
+
+    def test_001_manifest(self):
+        manifest = self.output.manifest_of(Size(40, 20))
+        self.assertEqual(len(manifest.tiles), 6)
+        self.assertEqual(manifest.tiles[-1], (5, 32, 16, 8, 4))
+        self.assertEqual(manifest.as_dict()["tiles"][0], {"index": 0, "x": 0, "y": 0, "width": 16, "height": 16})
+
+    def test_002_reassemble(self):
+        source = Image.linear_gradient("L").resize((40, 20)).convert("RGB")
+        manifest, tiles = self.output.tiles_of(source)
+
+        result = Image.new("RGB", manifest.size)
+        seen = set()
+        for tile, data in tiles:
+            seen.add(tile.index)
+            result.paste(Image.open(BytesIO(data)), (tile.x, tile.y))
+
+        self.assertEqual(seen, {t.index for t in manifest.tiles})
+        self.assertEqual(result.tobytes(), source.tobytes())
+
+    def test_003_shared_executor(self):
+        other = YuunoTiledOutput(tile_size=16, workers=2)
+        self.assertIs(self.output.executor, other.executor)
+        self.assertIsNot(self.output.executor, YuunoTiledOutput(workers=1).executor)
+
+    def test_004_shutdown_executors(self):
+        executor = self.output.executor
+        executor.submit(lambda: None).result(timeout=5)
+        threads = set(executor._threads)
+
+        shutdown_executors()
+        self.assertFalse(any(thread.is_alive() for thread in threads))
+
+        # Writers start new threads when they are used again.
+        self.assertIsNot(self.output.executor, executor)
+        manifest, tiles = self.output.tiles_of(Image.new("RGB", (20, 20)))
+        self.assertEqual(len(list(tiles)), len(manifest.tiles))
@@ -113,3 +113,12 @@ class TestYuuno(AdditionalAsserts, unittest.TestCase):
 
         self.assertIsInstance(self.yuuno.get_extension(SupportedTestExtension), SupportedTestExtension)
         self.assertIsNone(self.yuuno.get_extension(UnsupportedTestExtension))
+
+    def test_006_test_stop_tiled_output(self):
+        from yuuno.output import YuunoTiledOutput
+        executor = YuunoTiledOutput(yuuno=self.yuuno, workers=1).executor
+        executor.submit(lambda: None).result(timeout=5)
+        threads = set(executor._threads)
+
+        self.yuuno.stop()
+        self.assertFalse(any(thread.is_alive() for thread in threads))
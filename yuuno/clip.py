@@ -17,7 +17,8 @@
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 import math
 from enum import IntEnum
-from typing import TypeVar, NamedTuple, Tuple
+from collections import deque
+from typing import TypeVar, NamedTuple, Tuple, Iterable, Iterator
 
 from PIL.Image import Image
 
@@ -151,3 +152,33 @@ class Clip(object):
         :return: A frame-instance with the given data.
         """
         raise NotImplementedError
+
+
+def iter_frames(clip: Clip, frames: Iterable[int], *, prefetch: int = 4) -> Iterator[Frame]:
+    """
+    Yields the given frames of the clip in order.
+
+    Up to prefetch frames are requested ahead of the consumer so they
+    can be rendered concurrently while never more than that are
+    held in memory.
+
+    :param clip:     The clip to extract the frames from.
+    :param frames:   The frame numbers.
+    :param prefetch: The maximal number of frames requested at once.
+    :return: An iterator over the frames.
+    """
+    pending = deque()
+    frames = iter(frames)
+
+    def _request():
+        frameno = next(frames, None)
+        if frameno is not None:
+            pending.append(clip[frameno])
+
+    for _ in range(max(prefetch, 1)):
+        _request()
+
+    while pending:
+        future = pending.popleft()
+        _request()
+        yield future.result()
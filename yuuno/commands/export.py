@@ -0,0 +1,195 @@
+# -*- encoding: utf-8 -*-
+
+# Yuuno - IPython + VapourSynth
+# Copyright (C) 2018 StuxCrystal (Roland Netzsch <stuxcrystal@encode.moe>)
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+import os
+import sys
+import time
+import argparse
+from pathlib import Path
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, NamedTuple, Optional, Sequence
+
+from yuuno.clip import Clip, Frame, iter_frames
+from yuuno.multi_scripts.script import Script
+from yuuno.output import YuunoImageOutput
+
+
+class ExportStats(NamedTuple):
+    frames: int
+    total: int
+    bytes: int
+    elapsed: float
+
+    @property
+    def fps(self) -> float:
+        return self.frames / self.elapsed if self.elapsed else 0.0
+
+    def __str__(self):
+        return (
+            f"{self.frames}/{self.total} frames, "
+            f"{self.fps:.2f} fps, "
+            f"{self.bytes / max(self.elapsed, 1e-9) / 1024 / 1024:.2f} MiB/s"
+        )
+
+
+def _write_frame(output: YuunoImageOutput, frame: Frame, path: str) -> int:
+    with open(path, "wb") as f:
+        output.write_to(frame, f)
+        return f.tell()
+
+
+def export_frames(
+        clip: Clip,
+        frames: Sequence[int],
+        pattern: str,
+        *,
+        output: Optional[YuunoImageOutput] = None,
+        prefetch: int = 4,
+        workers: int = 0,
+        report: Optional[Callable[[ExportStats], None]] = None,
+        report_interval: float = 1.0
+) -> ExportStats:
+    """
+    Writes the given frames of the clip as an image sequence.
+
+    Frames are requested with bounded concurrency and encoded
+    on a pool of threads while the next frames are rendered.
+
+    :param clip:            The clip to export.
+    :param frames:          The frame numbers to export.
+    :param pattern:         The path of the images. Formatted with the frame number (e.g. "%06d.png")
+    :param output:          The output used to encode the frames.
+    :param prefetch:        How many frames are requested ahead of the encoders.
+    :param workers:         How many frames are encoded at once. Defaults to the number of CPUs.
+    :param report:          Called with the current statistics while exporting.
+    :param report_interval: Seconds between two reports.
+    :return: The final statistics.
+    """
+    if output is None:
+        output = YuunoImageOutput()
+    workers = workers or os.cpu_count() or 1
+
+    started = time.monotonic()
+    last_report = started
+    written = 0
+    size = 0
+
+    def _stats():
+        return ExportStats(frames=written, total=len(frames), bytes=size, elapsed=time.monotonic() - started)
+
+    with ThreadPoolExecutor(workers) as pool:
+        pending = deque()
+
+        def _complete():
+            nonlocal written, size, last_report
+            size += pending.popleft().result()
+            written += 1
+            if report is not None and time.monotonic() - last_report >= report_interval:
+                last_report = time.monotonic()
+                report(_stats())
+
+        for frameno, frame in zip(frames, iter_frames(clip, frames, prefetch=prefetch)):
+            pending.append(pool.submit(_write_frame, output, frame, pattern % frameno))
+
+            # Do not render frames faster than they can be encoded.
+            while len(pending) > workers:
+                _complete()
+
+        while pending:
+            _complete()
+
+    return _stats()
+
+
+def _create_script() -> Script:
+    from yuuno import Yuuno
+    yuuno = Yuuno.instance()
+    if yuuno.get_extension("VapourSynth") is None:
+        raise RuntimeError("VapourSynth is not available.")
+
+    from yuuno.vs.provider import VSStandaloneScript
+    return VSStandaloneScript(yuuno.environment)
+
+
+def _load_clip(vsscript: Script, script: Path, output: str) -> Clip:
+    vsscript.execute(script).result()
+
+    outputs = vsscript.get_results().result()
+    if output not in outputs:
+        raise RuntimeError(f"The script does not set the output {output}.")
+    return outputs[output]
+
+
+def main():
+    """Exports the frames of a VapourSynth-script as an image sequence."""
+    parser = argparse.ArgumentParser(prog="yuuno export", description=main.__doc__)
+    parser.add_argument("script", type=Path, help="The .vpy-script to run.")
+    parser.add_argument("pattern", nargs="?", default="%06d.png", help="Path of the images. Formatted with the frame number. (Default: %%06d.png)")
+    parser.add_argument("-o", "--output", default="0", help="The output of the script to export. (Default: 0)")
+    parser.add_argument("-s", "--start", type=int, default=0, help="The first frame.")
+    parser.add_argument("-e", "--end", type=int, default=None, help="The frame after the last frame.")
+    parser.add_argument("--step", type=int, default=1, help="Export only every n-th frame.")
+    parser.add_argument("-p", "--prefetch", type=int, default=4, help="How many frames are requested at once. (Default: 4)")
+    parser.add_argument("-w", "--workers", type=int, default=0, help="How many frames are encoded at once. (Default: Number of CPUs)")
+    parser.add_argument("-c", "--compression", type=int, default=None, help="The zlib compression level.")
+    args = parser.parse_args(sys.argv[1:])
+
+    try:
+        args.pattern % 0
+    except TypeError:
+        parser.error("The pattern must contain a placeholder for the frame number. (e.g. %06d)")
+
+    directory = os.path.dirname(args.pattern)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+
+    from yuuno import init_standalone
+    yuuno = init_standalone()
+    try:
+        try:
+            vsscript = _create_script()
+        except RuntimeError as e:
+            print(e, file=sys.stderr)
+            sys.exit(1)
+
+        try:
+            try:
+                clip = _load_clip(vsscript, args.script, args.output)
+            except RuntimeError as e:
+                print(e, file=sys.stderr)
+                sys.exit(1)
+
+            end = len(clip) if args.end is None else min(args.end, len(clip))
+            frames = range(args.start, end, args.step)
+
+            if args.compression is not None:
+                yuuno.output.zlib_compression = args.compression
+
+            print(f"Exporting {len(frames)} frames to {args.pattern}", file=sys.stderr)
+            stats = export_frames(
+                clip, frames, args.pattern,
+                output=yuuno.output,
+                prefetch=args.prefetch,
+                workers=args.workers,
+                report=lambda s: print(s, file=sys.stderr)
+            )
+            print("Done:", stats, file=sys.stderr)
+        finally:
+            vsscript.dispose()
+    finally:
+        yuuno.stop()
@@ -0,0 +1,66 @@
+# -*- encoding: utf-8 -*-
+
+# Yuuno - IPython + VapourSynth
+# Copyright (C) 2018 StuxCrystal (Roland Netzsch <stuxcrystal@encode.moe>)
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+import os
+import sys
+import argparse
+
+from yuuno.multi_scripts.subprocess.process import DISPATCH_WORKERS
+from yuuno.multi_scripts.subprocess.remote import parse_address, serve
+
+
+# Read if no key is passed on the command line so it does not show up in the process list.
+AUTHKEY_VARIABLE = "YUUNO_WORKER_AUTHKEY"
+
+
+def _is_unix(address: str) -> bool:
+    _, family = parse_address(address)
+    return family == "AF_UNIX"
+
+
+def main():
+    """Runs scripts for other machines."""
+    parser = argparse.ArgumentParser(prog="yuuno worker", description=main.__doc__)
+    parser.add_argument("address", help="Where to listen. host:port or unix:/path/to/socket")
+    parser.add_argument("-k", "--authkey", default=None, help=f"The key clients authenticate with. (Default: ${AUTHKEY_VARIABLE})")
+    parser.add_argument("-j", "--dispatch-workers", type=int, default=DISPATCH_WORKERS, help=f"How many commands a script runs at the same time. (Default: {DISPATCH_WORKERS})")
+    args = parser.parse_args(sys.argv[1:])
+
+    try:
+        unix = _is_unix(args.address)
+    except ValueError as e:
+        parser.error(str(e))
+
+    authkey = args.authkey if args.authkey is not None else os.environ.get(AUTHKEY_VARIABLE, None)
+    if authkey is None and not unix:
+        # Whoever connects can execute code. Any local user can reach a TCP port,
+        # while access to a unix socket is restricted by its file permissions.
+        parser.error("An authkey is required to listen on a TCP address. Only unix: sockets can be used without one.")
+
+    print(f"Listening on {args.address}", file=sys.stderr)
+    try:
+        serve(
+            args.address,
+            authkey=None if authkey is None else authkey.encode("utf-8"),
+            dispatch_workers=args.dispatch_workers
+        )
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == '__main__':
+    main()
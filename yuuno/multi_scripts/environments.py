@@ -15,19 +15,25 @@
 #
 # You should have received a copy of the GNU Lesser General Public License
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
-from typing import Callable, Any, MutableMapping
+from typing import Callable, Any, MutableMapping, NamedTuple
 from yuuno.multi_scripts.subprocess.proxy import Request
 
 
+class CommandHandler(NamedTuple):
+    cb: Callable[[Request], Any]
+    shared: bool = False
+
+
 class RequestManager:
 
-    handlers: MutableMapping[str, Callable[[Request], Any]]
+    handlers: MutableMapping[str, CommandHandler]
 
-    def register_command(self, name: str, cb: Callable[[Request], Any]) -> None:
+    def register_command(self, name: str, cb: Callable[[Request], Any], *, shared: bool = False) -> None:
         """
         Registers a new command.
         :param name:   The name of the
         :param cb:
+        :param shared: True if the command does not change the script and can run alongside other shared commands.
         :return:
         """
-        self.handlers[name] = cb
+        self.handlers[name] = CommandHandler(cb, shared)
@@ -17,6 +17,8 @@
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 from typing import Dict, Optional, Iterator, TYPE_CHECKING
 
+from traitlets import CInt, CFloat, Unicode, Bool
+
 from yuuno.core.extension import Extension
 if TYPE_CHECKING:
     from yuuno.multi_scripts.script import ScriptManager
@@ -29,6 +31,17 @@ class MultiScriptExtension(Extension):
     managers: Dict[str, 'ScriptManager']
     providers: Dict[str, 'ScriptProviderRegistration']
 
+    framebuffer_slots: int = CInt(2, help="How many frames can be transferred from a subprocess at the same time.", config=True)
+    framebuffer_size: int = CInt(0, help="The minimal size of a framebuffer-slot in bytes. With 0 they are sized from the frames transferred.", config=True)
+    framebuffer_max_size: int = CInt(7680*4320*3, help="Frames larger than this are transferred in a shared memory segment of their own. 0 means unlimited.", config=True)
+    warm_processes: int = CInt(1, help="How many subprocesses are started ahead of time so new scripts can be created without waiting for them.", config=True)
+    frame_cache_size: int = CInt(256*1024*1024, help="How many bytes of frames transferred from subprocesses are cached. 0 disables the cache.", config=True)
+    dispatch_workers: int = CInt(4, help="How many commands a subprocess runs at the same time. Only commands reading frames and results run concurrently.", config=True)
+    auto_restart: bool = Bool(True, help="Restart subprocesses that died and execute the code of their script again.", config=True)
+    max_restarts: int = CInt(3, help="How often the subprocess of a script is restarted in a row before it is given up. A successful replay resets the count.", config=True)
+    replay_timeout: float = CFloat(60.0, help="How many seconds a restarted subprocess may take to execute the code of its script again before it is restarted once more.", config=True)
+    start_method: str = Unicode("forkserver", help="How subprocesses are started (forkserver or spawn). Falls back to spawn if the method is not supported.", config=True)
+
     @classmethod
     def is_supported(self):
         return True
@@ -16,10 +16,12 @@
 # You should have received a copy of the GNU Lesser General Public License
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 from pathlib import Path
-from typing import TYPE_CHECKING
+from typing import List, Optional, TYPE_CHECKING
 
-from yuuno.utils import future_yield_coro
+from yuuno.utils import future_yield_coro, gather
 from yuuno.multi_scripts.script import Script
+from yuuno.multi_scripts.subprocess.framebuffer import OutOfBandFrame, InlineFrame, discard_out_of_band
+from yuuno.multi_scripts.subprocess.compression import AdaptiveCompressor, negotiate
 
 if TYPE_CHECKING:
     from yuuno.multi_scripts.subprocess.process import LocalSubprocessEnvironment
@@ -29,26 +31,47 @@ class BasicCommands(object):
 
     script: Script
     env: 'LocalSubprocessEnvironment'
+    compressor: AdaptiveCompressor
 
     def __init__(self, script: Script, env: 'LocalSubprocessEnvironment'):
         self.script = script
         self.env = env
+        self.compressor = AdaptiveCompressor()
 
     @property
     def commands(self):
         return {
             'script/subprocess/execute': self.execute,
+            'script/subprocess/codecs': self.codecs,
             'script/subprocess/results': self.results,
             'script/subprocess/results/raw': self.frame_data,
+            'script/subprocess/results/raw_batch': self.frame_batch,
+            'script/subprocess/results/frame': self.frame_full,
             'script/subprocess/results/meta': self.frame_meta
         }
 
+    @property
+    def shared_commands(self):
+        # These commands only read from the script and may run concurrently.
+        return {
+            'script/subprocess/codecs',
+            'script/subprocess/results',
+            'script/subprocess/results/raw',
+            'script/subprocess/results/raw_batch',
+            'script/subprocess/results/frame',
+            'script/subprocess/results/meta'
+        }
+
     @future_yield_coro
     def execute(self, type: str, code: str):
         if type == 'path':
             code = Path(code)
         return (yield self.script.execute(code))
 
+    def codecs(self, offered: List[str]):
+        # The main process offers the codecs in the order of its preference.
+        return negotiate(offered)
+
     @future_yield_coro
     def results(self):
         outputs = yield self.script.get_results()
@@ -58,34 +81,92 @@ class BasicCommands(object):
         }
 
     @future_yield_coro
-    def frame_meta(self, id: str, frame: int):
+    def _get_clip(self, id: str):
         outputs = yield self.script.get_results()
         clip = outputs.get(id, None)
         if clip is None:
-            return None
-        try:
-            frame = yield clip[frame]
-        except IndexError:
-            return None
+            raise KeyError(f"The script has no output {id!r}.")
+        return clip
+
+    @staticmethod
+    def _check_frame(id: str, clip, frame: int) -> None:
+        if not 0 <= frame < len(clip):
+            raise IndexError(f"The output {id!r} has no frame {frame}.")
+
+    @future_yield_coro
+    def _get_frame(self, id: str, frame: int):
+        clip = yield self._get_clip(id)
+        self._check_frame(id, clip, frame)
+        return (yield clip[frame])
+
+    def _inline(self, id: str, data: bytes, codec: Optional[str]) -> InlineFrame:
+        # The main process cannot access our memory.
+        return InlineFrame(*self.compressor.compress(id, bytes(data), codec))
+
+    def _store(self, id: str, data: bytes, slot: int, buffer: Optional[str], capacity: int, inline: bool, codec: Optional[str]):
+        if inline:
+            return self._inline(id, data, codec)
+
+        if buffer is None or len(data) > capacity:
+            # Never send the frame itself through the pipe.
+            return OutOfBandFrame.create(data)
+
+        # The slot has been leased to this request by the main process.
+        self.env.framebuffer(slot, buffer)[:len(data)] = data
+        return len(data)
+
+    @future_yield_coro
+    def frame_meta(self, id: str, frame: int):
+        frame = yield self._get_frame(id, frame)
         return frame.size(), frame.format()
 
     @future_yield_coro
-    def frame_data(self, id: str, frame: int):
-        outputs = yield self.script.get_results()
-        clip = outputs.get(id, None)
-        if clip is None:
-            return None
-        try:
-            frame = yield clip[frame]
-        except IndexError:
-            return None
-        frame = frame.to_raw()
+    def frame_data(
+            self, id: str, frame: int, slot: int = 0, buffer: Optional[str] = None, capacity: int = 0,
+            inline: bool = False, codec: Optional[str] = None
+    ):
+        frame = yield self._get_frame(id, frame)
+        return self._store(id, frame.to_raw(), slot, buffer, capacity, inline, codec)
+
+    @future_yield_coro
+    def frame_full(
+            self, id: str, frame: int, slot: int = 0, buffer: Optional[str] = None, capacity: int = 0,
+            inline: bool = False, codec: Optional[str] = None
+    ):
+        frame = yield self._get_frame(id, frame)
+        return frame.size(), frame.format(), self._store(id, frame.to_raw(), slot, buffer, capacity, inline, codec)
 
-        from yuuno.multi_scripts.subprocess.process import FRAME_BUFFER_SIZE
-        if len(frame) > FRAME_BUFFER_SIZE:
-            return frame
+    @future_yield_coro
+    def frame_batch(
+            self, id: str, frames: List[int], slot: int = 0, buffer: Optional[str] = None, capacity: int = 0,
+            inline: bool = False, codec: Optional[str] = None
+    ):
+        clip = yield self._get_clip(id)
+        for frame in frames:
+            self._check_frame(id, clip, frame)
+        if not frames:
+            return []
 
-        with self.env.framebuffer() as f:
-            f[:len(frame)] = frame
+        # Render all frames at once and pack them into the slot one after another.
+        rendered = yield gather([clip[frame] for frame in frames])
+        view = self.env.framebuffer(slot, buffer) if buffer is not None else None
 
-        return len(frame)
+        offset = 0
+        result = []
+        try:
+            for frame in rendered:
+                data = frame.to_raw()
+                if inline:
+                    payload = self._inline(id, data, codec)
+                elif view is not None and offset + len(data) <= capacity:
+                    view[offset:offset+len(data)] = data
+                    payload = (offset, len(data))
+                    offset += len(data)
+                else:
+                    payload = OutOfBandFrame.create(data)
+                result.append((frame.size(), frame.format(), payload))
+        except BaseException:
+            # The main process never learns about the segments created so far.
+            discard_out_of_band(result)
+            raise
+        return result
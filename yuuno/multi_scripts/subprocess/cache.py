@@ -0,0 +1,133 @@
+# -*- encoding: utf-8 -*-
+
+# Yuuno - IPython + VapourSynth
+# Copyright (C) 2018 StuxCrystal (Roland Netzsch <stuxcrystal@encode.moe>)
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+from threading import Lock
+from collections import OrderedDict
+
+from typing import Any, Hashable, NamedTuple, Optional
+
+from yuuno.clip import Size, RawFormat
+
+
+class FrameKey(NamedTuple):
+    script: Hashable
+    output: str
+    frame: int
+    generation: int
+
+
+class CachedFrame(NamedTuple):
+    size: Size
+    format: RawFormat
+    raw: bytes
+
+
+class FrameCache(object):
+    """
+    Keeps recently transferred frames in the main process.
+
+    The cache is bounded by the size of the frame data and drops
+    the least recently used frames first. Scripts increase their
+    generation whenever they execute code, so frames rendered
+    before that are never returned again.
+    """
+
+    max_size: int
+    size: int
+    hits: int
+    misses: int
+
+    _frames: 'OrderedDict[FrameKey, CachedFrame]'
+    _lock: Lock
+
+    def __init__(self, max_size: int):
+        """
+        :param max_size: How many bytes of frame data are kept. 0 disables the cache.
+        """
+        self.max_size = max_size
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+
+        self._frames = OrderedDict()
+        self._lock = Lock()
+
+    def __len__(self):
+        return len(self._frames)
+
+    @property
+    def enabled(self) -> bool:
+        return self.max_size > 0
+
+    def get(self, key: FrameKey) -> Optional[CachedFrame]:
+        """
+        Returns a cached frame.
+
+        :param key: The key of the frame.
+        :return: The frame or None if it is not cached.
+        """
+        with self._lock:
+            frame = self._frames.get(key, None)
+            if frame is None:
+                self.misses += 1
+                return None
+            self._frames.move_to_end(key)
+            self.hits += 1
+            return frame
+
+    def put(self, key: FrameKey, size: Size, format: RawFormat, raw: bytes) -> None:
+        """
+        Stores a frame.
+
+        Frames larger than the cache are not stored.
+
+        :param key:    The key of the frame.
+        :param size:   The size of the frame.
+        :param format: The format of the frame.
+        :param raw:    The frame data.
+        """
+        if len(raw) > self.max_size:
+            return
+
+        with self._lock:
+            previous = self._frames.pop(key, None)
+            if previous is not None:
+                self.size -= len(previous.raw)
+
+            self._frames[key] = CachedFrame(size, format, raw)
+            self.size += len(raw)
+            while self.size > self.max_size:
+                _, dropped = self._frames.popitem(last=False)
+                self.size -= len(dropped.raw)
+
+    def invalidate(self, script: Any) -> None:
+        """
+        Removes all frames of a script.
+
+        :param script: The script-part of the keys.
+        """
+        with self._lock:
+            for key in [key for key in self._frames if key.script == script]:
+                self.size -= len(self._frames.pop(key).raw)
+
+    def clear(self) -> None:
+        """
+        Removes all frames.
+        """
+        with self._lock:
+            self._frames.clear()
+            self.size = 0
@@ -16,17 +16,24 @@
 # You should have received a copy of the GNU Lesser General Public License
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 from typing import TYPE_CHECKING
-from typing import Optional, Tuple
+from typing import Callable, List, Optional, Sequence, Tuple, TypeVar
+
+from asyncio import wrap_future
 
 from PIL.Image import Image, frombuffer, merge
 
 from yuuno.clip import Clip, Frame, Size, RawFormat
-from yuuno.utils import future_yield_coro, auto_join, inline_resolved, gather
+from yuuno.utils import future_yield_coro, inline_resolved, gather
+from yuuno.multi_scripts.subprocess.framebuffer import FrameBufferPool, OutOfBandFrame, InlineFrame, discard_out_of_band
+from yuuno.multi_scripts.subprocess.cache import FrameKey
 
 if TYPE_CHECKING:
     from yuuno.multi_scripts.subprocess.process import Subprocess
 
 
+T = TypeVar("T")
+
+
 class ProxyFrame(Frame):
 
     clip: str
@@ -46,10 +53,23 @@ class ProxyFrame(Frame):
         self._cached_meta = None
         self._cached_raw = None
 
+    def _cache_key(self, generation: Optional[int] = None) -> FrameKey:
+        if generation is None:
+            generation = self.script.generation
+        return FrameKey(self.script.cache_id, self.clip, self.frameno, generation)
+
+    def _from_cache(self) -> bool:
+        cached = self.script.frame_cache.get(self._cache_key())
+        if cached is None:
+            return False
+        self._cached_meta = (cached.size, cached.format)
+        self._cached_raw = cached.raw
+        return True
+
     @future_yield_coro
     def _meta(self):
-        if self._cached_meta is None:
-            self._cached_meta = yield self.script.requester.submit('script/subprocess/results/meta', {
+        if self._cached_meta is None and not self._from_cache():
+            self._cached_meta = yield self.script.submit('script/subprocess/results/meta', {
                 "id": self.clip,
                 "frame": self.frameno
             })
@@ -61,34 +81,96 @@ class ProxyFrame(Frame):
     def format(self) -> RawFormat:
         return self._meta().result()[1]
 
+    def _raw_size(self) -> int:
+        return sum(self.plane_size(i) for i in range(self.format().num_planes))
+
+    @future_yield_coro
+    def _fetch(self, consume: Callable[[Size, RawFormat, memoryview], T]):
+        # Fetches metadata and data with a single request.
+        # The frame is passed to consume() straight from shared memory.
+        # The view is only valid until consume() returns.
+        framebuffers = self.script.framebuffers
+        if framebuffers is None:
+            # Remote scripts send the frame along with the response.
+            size, format, payload = yield self.script.submit('script/subprocess/results/frame', {
+                "id": self.clip,
+                "frame": self.frameno,
+                "inline": True,
+                "codec": self.script.codec
+            }, protect=True)
+            self._cached_meta = (size, format)
+            return payload.consume(lambda view: consume(size, format, view))
+
+        slot = yield framebuffers.acquire()
+        try:
+            request = {"id": self.clip, "frame": self.frameno, "slot": slot}
+            if self._cached_meta is not None:
+                segment = framebuffers.reserve(slot, self._raw_size())
+            else:
+                # Try whatever the slot currently holds.
+                segment = framebuffers.segments[slot]
+            if segment is not None:
+                request.update(buffer=segment.name, capacity=segment.size)
+
+            size, format, payload = yield self.script.submit(
+                'script/subprocess/results/frame', request, protect=True
+            )
+            self._cached_meta = (size, format)
+            if isinstance(payload, OutOfBandFrame):
+                # The frame did not fit into the slot.
+                # Grow the slot so the next frame does.
+                result = payload.consume(lambda view: consume(size, format, view))
+                framebuffers.reserve(slot, payload.length)
+                return result
+
+            with framebuffers.view(slot)[:payload] as view:
+                return consume(size, format, view)
+        finally:
+            framebuffers.release(slot)
+
     @future_yield_coro
     def _raw_async(self) -> bytes:
-        if self._cached_raw is None:
-            with self.script.framebuffer() as buf:
-                result = yield self.script.requester.submit('script/subprocess/results/raw', {
-                    "id": self.clip,
-                    "frame": self.frameno
-                }, protect=True)
-                if isinstance(result, int):
-                    self._cached_raw = bytes(buf[:result])
-                else:
-                    # We got the actual object pickled.
-                    # This means we are dealing with extremely huge frames
-                    self._cached_raw = result
+        if self._cached_raw is None and not self._from_cache():
+            # Frames rendered before the script executed new code are stored with the old generation.
+            key = self._cache_key()
+            self._cached_raw = yield self._fetch(lambda size, format, view: bytes(view))
+            self.script.frame_cache.put(key, *self._cached_meta, self._cached_raw)
         return self._cached_raw
 
     def to_raw(self) -> bytes:
         return self._raw_async().result()
 
-    @auto_join
-    @future_yield_coro
-    def to_pil(self):
-        if self._cached_img is not None:
-            return self._cached_img
+    async def ato_raw(self) -> bytes:
+        """
+        Awaitable variant of to_raw() for asyncio event loops.
+        """
+        return await wrap_future(self._raw_async())
 
-        size, format, raw = yield self.get_raw_data_async()
-        raw = memoryview(raw)
+    def to_pil(self) -> Image:
+        return self._pil_async().result()
 
+    async def ato_pil(self) -> Image:
+        """
+        Awaitable variant of to_pil() for asyncio event loops.
+        """
+        return await wrap_future(self._pil_async())
+
+    @future_yield_coro
+    def _pil_async(self):
+        if self._cached_img is None:
+            if self._cached_raw is not None or self._from_cache():
+                size, format = self._cached_meta
+                self._cached_img = self._build_pil(size, format, memoryview(self._cached_raw))
+            else:
+                # Build the image directly from the framebuffer
+                # instead of copying the frame out of it first.
+                # Only frames that have been copied anyway are cached.
+                self._cached_img = yield self._fetch(self._build_pil)
+        return self._cached_img
+
+    def _build_pil(self, size: Size, format: RawFormat, raw: memoryview) -> Image:
+        # The planes reference the buffer without copying it.
+        # merge() copies them into the final image.
         index = 0
         planes = []
         for i in range(format.num_planes):
@@ -100,12 +182,18 @@ class ProxyFrame(Frame):
         pil_format = "RGB"
         if format.num_planes == 4:
             pil_format += "A"
-        return merge(pil_format, planes)
+        try:
+            return merge(pil_format, planes)
+        finally:
+            # Release the buffer before the slot is handed to the next request.
+            for image in planes:
+                image.close()
 
     @future_yield_coro
     def get_raw_data_async(self) -> Tuple[Size, RawFormat, bytes]:
-        m, raw = yield gather([self._meta(), self._raw_async()])
-        return m[0], m[1], raw
+        raw = yield self._raw_async()
+        size, format = self._cached_meta
+        return size, format, raw
 
 
 class ProxyClip(Clip):
@@ -113,10 +201,13 @@ class ProxyClip(Clip):
     script: 'Subprocess'
     length: int
 
+    _frame_size: Optional[int]
+
     def __init__(self, clip: str, length: int, script: 'Subprocess'):
         super(ProxyClip, self).__init__(clip)
         self.script = script
         self.length = length
+        self._frame_size = None
 
     def __len__(self):
         return self.length
@@ -126,3 +217,119 @@ class ProxyClip(Clip):
         if item >= len(self):
             raise IndexError("The clip does not have as many frames.")
         return ProxyFrame(clip=self.clip, frameno=item, script=self.script)
+
+    async def aget(self, item: int) -> ProxyFrame:
+        """
+        Awaitable variant of clip[item] for asyncio event loops.
+        """
+        return await wrap_future(self[item])
+
+    @future_yield_coro
+    def _get_batch(self, indices: Sequence[int]) -> List[ProxyFrame]:
+        framebuffers = self.script.framebuffers
+        generation = self.script.generation
+        if framebuffers is None:
+            # Remote scripts send the frames along with the response.
+            results = yield self.script.submit('script/subprocess/results/raw_batch', {
+                "id": self.clip,
+                "frames": list(indices),
+                "inline": True,
+                "codec": self.script.codec
+            }, protect=True)
+            return self._store_batch(indices, results, generation)
+
+        slot = yield framebuffers.acquire()
+        try:
+            request = {"id": self.clip, "frames": list(indices), "slot": slot}
+            segment = framebuffers.reserve(slot, self._frame_size * len(indices))
+            if segment is not None:
+                request.update(buffer=segment.name, capacity=segment.size)
+
+            results = yield self.script.submit('script/subprocess/results/raw_batch', request, protect=True)
+            return self._store_batch(indices, results, generation, framebuffers, slot)
+        finally:
+            framebuffers.release(slot)
+
+    def _store_batch(
+            self, indices: Sequence[int], results, generation: int,
+            framebuffers: Optional[FrameBufferPool] = None, slot: int = 0
+    ) -> List[ProxyFrame]:
+        frames = []
+        try:
+            for frameno, (size, format, payload) in zip(indices, results):
+                frame = ProxyFrame(clip=self.clip, frameno=frameno, script=self.script)
+                frame._cached_meta = (size, format)
+                if isinstance(payload, (OutOfBandFrame, InlineFrame)):
+                    frame._cached_raw = payload.read()
+                else:
+                    # Only frames packed into the slot need the slot.
+                    offset, length = payload
+                    frame._cached_raw = bytes(framebuffers.view(slot)[offset:offset+length])
+                self.script.frame_cache.put(frame._cache_key(generation), size, format, frame._cached_raw)
+                frames.append(frame)
+        except BaseException:
+            # Remove the segments of the frames that have not been read.
+            discard_out_of_band(results[len(frames):])
+            raise
+        return frames
+
+    @future_yield_coro
+    def get_frames(self, indices: Sequence[int]) -> List[ProxyFrame]:
+        """
+        Fetches multiple frames with as few requests as possible.
+
+        The frames are packed into the framebuffer-slots together
+        with their metadata. Only if they do not fit into a single slot,
+        they are split into multiple requests. Cached frames are not
+        requested again.
+
+        :param indices: The frame numbers.
+        :return: A future resolving with the frames that have their data already loaded.
+        """
+        indices = list(indices)
+        for frameno in indices:
+            if not 0 <= frameno < len(self):
+                raise IndexError("The clip does not have as many frames.")
+        frames: List[Optional[ProxyFrame]] = []
+        missing = []
+        for frameno in indices:
+            frame = ProxyFrame(clip=self.clip, frameno=frameno, script=self.script)
+            if frame._from_cache():
+                frames.append(frame)
+            else:
+                frames.append(None)
+                missing.append(frameno)
+        if not missing:
+            return frames
+
+        if self.script.framebuffers is None:
+            return self._merge(frames, (yield self._get_batch(missing)))
+
+        if self._frame_size is None:
+            # Use the first frame to find out how large the frames are.
+            first = ProxyFrame(clip=self.clip, frameno=missing[0], script=self.script)
+            yield first._meta()
+            self._frame_size = max(first._raw_size(), 1)
+
+        per_batch = len(missing)
+        max_size = self.script.framebuffers.max_size
+        if max_size:
+            per_batch = max(max_size // self._frame_size, 1)
+
+        batches = yield gather([
+            self._get_batch(missing[i:i+per_batch])
+            for i in range(0, len(missing), per_batch)
+        ])
+        return self._merge(frames, [frame for batch in batches for frame in batch])
+
+    @staticmethod
+    def _merge(frames: List[Optional[ProxyFrame]], fetched: List[ProxyFrame]) -> List[ProxyFrame]:
+        # Fills the frames that were not cached.
+        fetched = iter(fetched)
+        return [next(fetched) if frame is None else frame for frame in frames]
+
+    async def aget_frames(self, indices: Sequence[int]) -> List[ProxyFrame]:
+        """
+        Awaitable variant of get_frames() for asyncio event loops.
+        """
+        return await wrap_future(self.get_frames(indices))
@@ -0,0 +1,147 @@
+# -*- encoding: utf-8 -*-
+
+# Yuuno - IPython + VapourSynth
+# Copyright (C) 2018 StuxCrystal (Roland Netzsch <stuxcrystal@encode.moe>)
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+Compression of frames sent through a connection.
+
+Both ends report the codecs they support and the main process
+picks the first codec of its preference the subprocess supports.
+Frames that do not compress are sent as they are.
+"""
+import zlib
+from threading import Lock
+
+from typing import Callable, Dict, Iterable, List, NamedTuple, Optional, Tuple
+
+try:
+    import lz4.frame
+except ImportError:
+    lz4 = None
+
+
+# How much smaller a frame must become for compression to be worth it.
+MIN_RATIO = 0.9
+
+# How many frames of a stream are sent uncompressed after a frame did not compress.
+# Doubles every time the next attempt fails as well.
+MIN_BACKOFF = 1
+MAX_BACKOFF = 64
+
+
+class Codec(NamedTuple):
+    compress: Callable[[bytes], bytes]
+    decompress: Callable[[bytes], bytes]
+
+
+CODECS: Dict[str, Codec] = {
+    # Level 1 is several times faster than the default and
+    # barely worse on the flat areas that make frames compressible.
+    "zlib": Codec(lambda data: zlib.compress(data, 1), zlib.decompress)
+}
+if lz4 is not None:
+    CODECS["lz4"] = Codec(lz4.frame.compress, lz4.frame.decompress)
+
+# The codecs ordered by preference.
+PREFERENCE = ["lz4", "zlib"]
+
+
+def available_codecs() -> List[str]:
+    """
+    :return: The codecs supported by this process, ordered by preference.
+    """
+    return [name for name in PREFERENCE if name in CODECS]
+
+
+def negotiate(offered: Iterable[str]) -> Optional[str]:
+    """
+    Picks the codec to use.
+
+    :param offered: The codecs supported by the other end, ordered by its preference.
+    :return: The first offered codec this process supports or None.
+    """
+    for name in offered:
+        if name in CODECS:
+            return name
+    return None
+
+
+def decompress(codec: Optional[str], data: bytes) -> bytes:
+    """
+    :param codec: The codec the data was compressed with. None if it is not compressed.
+    :param data:  The data.
+    :return: The decompressed data.
+    """
+    if codec is None:
+        return data
+    return CODECS[codec].decompress(data)
+
+
+class _Stream(object):
+    __slots__ = ("skip", "backoff")
+
+    def __init__(self):
+        self.skip = 0
+        self.backoff = MIN_BACKOFF
+
+
+class AdaptiveCompressor(object):
+    """
+    Compresses the frames of multiple streams.
+
+    Noise and film grain do not compress, so compressing them only
+    costs time. When a frame of a stream does not compress, the next
+    frames of the stream are sent uncompressed. Failed attempts make
+    the compressor wait longer before it tries again.
+    """
+
+    streams: Dict[str, _Stream]
+
+    def __init__(self):
+        self.streams = {}
+        self._lock = Lock()
+
+    def compress(self, stream: str, data: bytes, codec: Optional[str]) -> Tuple[bytes, Optional[str]]:
+        """
+        Compresses a frame if it is worth it.
+
+        :param stream: The stream the frame belongs to. Usually the output it was rendered from.
+        :param data:   The frame.
+        :param codec:  The negotiated codec. None disables compression.
+        :return: The data to send and the codec it has been compressed with.
+        """
+        if codec is None or codec not in CODECS:
+            return data, None
+
+        with self._lock:
+            state = self.streams.setdefault(stream, _Stream())
+            if state.skip:
+                state.skip -= 1
+                return data, None
+
+        compressed = CODECS[codec].compress(data)
+        worth_it = len(compressed) < len(data) * MIN_RATIO
+
+        with self._lock:
+            if worth_it:
+                state.backoff = MIN_BACKOFF
+            else:
+                state.skip = state.backoff
+                state.backoff = min(state.backoff * 2, MAX_BACKOFF)
+
+        if not worth_it:
+            return data, None
+        return compressed, codec
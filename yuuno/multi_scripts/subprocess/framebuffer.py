@@ -0,0 +1,295 @@
+# -*- encoding: utf-8 -*-
+
+# Yuuno - IPython + VapourSynth
+# Copyright (C) 2018 StuxCrystal (Roland Netzsch <stuxcrystal@encode.moe>)
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+from threading import Lock
+from collections import deque
+from concurrent.futures import Future
+from multiprocessing.shared_memory import SharedMemory
+
+from typing import Any, Callable, Deque, Dict, List, NamedTuple, Optional, TypeVar
+
+from yuuno.multi_scripts.subprocess import compression
+
+
+T = TypeVar("T")
+
+
+class FrameBufferPool(object):
+    """
+    A fixed number of shared framebuffers.
+
+    The main process leases a slot for each frame that is in transit
+    and tells the subprocess which slot to write into. As every slot
+    is owned by exactly one request, the subprocess does not need to
+    lock anything and multiple transfers can run at the same time.
+
+    The memory of a slot is only allocated once a frame is transferred
+    through it and replaced by a larger segment if a frame does not fit.
+    Frames larger than max_size are not transferred through the slots.
+    """
+
+    segments: List[Optional[SharedMemory]]
+    size: int
+    max_size: int
+
+    _lock: Lock
+    _free: Deque[int]
+    _waiting: Deque[Future]
+
+    def __init__(self, slots: int, size: int = 0, max_size: int = 0):
+        """
+        :param slots:    The number of frames that can be transferred at the same time.
+        :param size:     The minimal size of a slot in bytes.
+        :param max_size: The maximal size of a slot in bytes. 0 means unlimited.
+        """
+        if slots < 1:
+            raise ValueError("At least one slot is required.")
+
+        self.size = size
+        self.max_size = max_size
+        self.segments = [None] * slots
+
+        self._lock = Lock()
+        self._free = deque(range(slots))
+        self._waiting = deque()
+
+    def __len__(self):
+        return len(self.segments)
+
+    def acquire(self) -> Future:
+        """
+        Leases a slot.
+
+        The future resolves with the index of the slot as soon as one is free.
+        It is never resolved while holding a lock, so the caller can safely
+        continue from inside a callback.
+
+        :return: A future resolving with the index of the slot.
+        """
+        fut = Future()
+        fut.set_running_or_notify_cancel()
+        with self._lock:
+            if not self._free:
+                self._waiting.append(fut)
+                return fut
+            index = self._free.popleft()
+        fut.set_result(index)
+        return fut
+
+    def release(self, index: int) -> None:
+        """
+        Returns the slot to the pool. If another request waits
+        for a slot, the slot is directly handed over.
+
+        :param index: The index of the slot.
+        """
+        with self._lock:
+            if not self._waiting:
+                self._free.append(index)
+                return
+            fut = self._waiting.popleft()
+        fut.set_result(index)
+
+    def reserve(self, index: int, size: int) -> Optional[SharedMemory]:
+        """
+        Makes sure the leased slot can hold the given amount of bytes.
+
+        :param index: The index of the slot.
+        :param size:  The number of bytes the slot must be able to hold.
+        :return: The shared memory segment of the slot or None if the frame is too large for a slot.
+        """
+        segment = self.segments[index]
+        if segment is not None and segment.size >= size:
+            return segment
+        if self.max_size and size > self.max_size:
+            return None
+
+        if segment is not None:
+            segment.close()
+            segment.unlink()
+
+        segment = SharedMemory(create=True, size=max(size, self.size, 1))
+        self.segments[index] = segment
+        return segment
+
+    def view(self, index: int) -> memoryview:
+        """
+        Returns a writable view of the slot.
+
+        :param index: The index of the slot.
+        :return: A memoryview of the slot.
+        """
+        return self.segments[index].buf
+
+    def close(self) -> None:
+        """
+        Frees the memory of all slots.
+        """
+        for index, segment in enumerate(self.segments):
+            if segment is None:
+                continue
+            segment.close()
+            segment.unlink()
+            self.segments[index] = None
+
+
+class FrameBufferAttachments(object):
+    """
+    The subprocess-side of the framebuffer-pool.
+
+    Keeps the segments of the slots mapped and follows
+    the main process when it replaces a segment.
+    """
+
+    segments: Dict[int, SharedMemory]
+
+    def __init__(self):
+        self.segments = {}
+        self._lock = Lock()
+
+    def get(self, slot: int, name: str) -> memoryview:
+        """
+        Returns the memory of the given slot.
+
+        :param slot: The index of the slot.
+        :param name: The name of the segment currently backing the slot.
+        :return: A memoryview of the segment.
+        """
+        with self._lock:
+            segment = self.segments.get(slot, None)
+            if segment is None or segment.name != name:
+                if segment is not None:
+                    segment.close()
+                segment = SharedMemory(name=name)
+                self.segments[slot] = segment
+            return segment.buf
+
+    def close(self) -> None:
+        """
+        Unmaps all segments.
+        """
+        with self._lock:
+            for segment in self.segments.values():
+                segment.close()
+            self.segments = {}
+
+
+class OutOfBandFrame(NamedTuple):
+    """
+    A frame that has been too large for its slot.
+
+    The subprocess puts it into a shared memory segment of its own
+    instead of sending it through the pipe. The main process removes
+    the segment once it has read the frame.
+    """
+    name: str
+    length: int
+
+    @classmethod
+    def create(cls, data: bytes) -> 'OutOfBandFrame':
+        """
+        Copies the frame into a new segment.
+
+        :param data: The raw frame.
+        :return: The reference to send to the main process.
+        """
+        segment = SharedMemory(create=True, size=max(len(data), 1))
+        try:
+            segment.buf[:len(data)] = data
+        finally:
+            segment.close()
+        return cls(segment.name, len(data))
+
+    def read(self) -> bytes:
+        """
+        Reads the frame and removes the segment.
+
+        :return: The raw frame.
+        """
+        return self.consume(bytes)
+
+    def consume(self, cb: Callable[[memoryview], T]) -> T:
+        """
+        Passes a view of the frame to the callback and removes the segment afterwards.
+
+        The view is only valid during the call.
+
+        :param cb: The callback.
+        :return: The result of the callback.
+        """
+        segment = SharedMemory(name=self.name)
+        try:
+            with segment.buf[:self.length] as view:
+                return cb(view)
+        finally:
+            segment.close()
+            segment.unlink()
+
+    def discard(self) -> None:
+        """
+        Removes the segment without reading the frame.
+        Does nothing if it has already been removed.
+        """
+        try:
+            segment = SharedMemory(name=self.name)
+        except FileNotFoundError:
+            return
+        segment.close()
+        segment.unlink()
+
+
+def discard_out_of_band(data: Any) -> None:
+    """
+    Removes the segments of all out-of-band frames in a response
+    that will not be read, for example because the request failed.
+
+    :param data: The response or a part of it.
+    """
+    if isinstance(data, OutOfBandFrame):
+        data.discard()
+    elif isinstance(data, (list, tuple)):
+        for item in data:
+            discard_out_of_band(item)
+
+
+class InlineFrame(NamedTuple):
+    """
+    A frame sent along with the response.
+
+    Used when the main process cannot map the memory of the
+    subprocess, for example when it runs on another machine.
+    The subprocess decides whether the frame is compressed.
+    See AdaptiveCompressor.
+    """
+    data: bytes
+    codec: Optional[str] = None
+
+    def read(self) -> bytes:
+        """
+        :return: The raw frame.
+        """
+        return self.consume(bytes)
+
+    def consume(self, cb: Callable[[memoryview], T]) -> T:
+        """
+        Passes a view of the frame to the callback.
+
+        :param cb: The callback.
+        :return: The result of the callback.
+        """
+        with memoryview(compression.decompress(self.codec, self.data)) as view:
+            return cb(view)
@@ -15,38 +15,302 @@
 #
 # You should have received a copy of the GNU Lesser General Public License
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
-from typing import Optional, Dict
-from multiprocessing import Pool, get_context
+import time
+import functools
+from collections import deque
+from concurrent.futures import Future
+from threading import Lock, Thread, Timer
+from typing import Optional, Dict, Deque, NamedTuple
+from multiprocessing import Pipe, Process, get_context, get_all_start_methods
+from multiprocessing.connection import Connection, wait
 from multiprocessing.context import BaseContext as Context
 
+from yuuno import Yuuno
 from yuuno.multi_scripts.script import ScriptManager, Script
 from yuuno.multi_scripts.subprocess.process import Subprocess
+from yuuno.multi_scripts.subprocess.process import FRAME_BUFFER_SLOTS, FRAME_BUFFER_SIZE, FRAME_BUFFER_MAX_SIZE
+from yuuno.multi_scripts.subprocess.process import FRAME_CACHE_SIZE, DISPATCH_WORKERS
+from yuuno.multi_scripts.subprocess.cache import FrameCache
 from yuuno.multi_scripts.subprocess.provider import ScriptProviderInfo
+from yuuno.multi_scripts.subprocess.sharded import ShardedScript, ROUND_ROBIN, ROUTINGS
+
+
+# How many initialized subprocesses are kept ready for new scripts.
+WARM_PROCESSES = 1
+
+# Restart subprocesses that died and replay the code executed in them.
+AUTO_RESTART = True
+
+# How often a script is restarted in a row before it is given up.
+# The count is reset once the code of the script has been executed again.
+MAX_RESTARTS = 3
+
+# How many seconds a restarted subprocess may take to execute
+# the code of its script again before it is restarted once more.
+REPLAY_TIMEOUT = 60.0
+
+# How subprocesses are started. Falls back to spawn where this is not supported.
+START_METHOD = "forkserver"
+
+# Modules imported once by the forkserver so the subprocesses forked
+# from it do not have to import them again. Missing modules are skipped.
+# The preload-module also sets up yuuno inside the server.
+FORKSERVER_PRELOAD = [
+    'PIL.Image',
+    'vapoursynth',
+    'yuuno.multi_scripts.subprocess.preload',
+]
+
+_forkserver_lock = Lock()
+_forkserver_configured = False
+
+
+def get_start_context(method: str) -> Context:
+    """
+    Returns the multiprocessing-context used to start subprocesses.
+
+    :param method: The start method. Unsupported methods fall back to spawn.
+    :return: The context.
+    """
+    if method not in get_all_start_methods():
+        method = "spawn"
+
+    ctx = get_context(method)
+    if method == "forkserver":
+        _configure_forkserver()
+    return ctx
+
+
+def _configure_forkserver() -> None:
+    # The forkserver is shared with everything else in this process.
+    # Add our modules once and keep the modules others asked for.
+    # Only has an effect if the forkserver has not been started yet.
+    global _forkserver_configured
+    with _forkserver_lock:
+        if _forkserver_configured:
+            return
+        _forkserver_configured = True
+
+        from multiprocessing import forkserver
+        current = getattr(forkserver._forkserver, "_preload_modules", ["__main__"])
+        forkserver.set_forkserver_preload(current + [m for m in FORKSERVER_PRELOAD if m not in current])
+
+
+class StartupStats(NamedTuple):
+    created: int = 0
+    warm: int = 0
+    total: float = 0.0
+    last: float = 0.0
+    longest: float = 0.0
+
+    @property
+    def cold(self) -> int:
+        return self.created - self.warm
+
+    @property
+    def average(self) -> float:
+        return self.total / self.created if self.created else 0.0
+
+    def record(self, elapsed: float, warm: bool) -> 'StartupStats':
+        return StartupStats(
+            created=self.created + 1,
+            warm=self.warm + int(warm),
+            total=self.total + elapsed,
+            last=elapsed,
+            longest=max(self.longest, elapsed)
+        )
+
+    def __str__(self):
+        return (
+            f"{self.created} scripts ({self.warm} warm), "
+            f"{self.average * 1000:.1f} ms average, "
+            f"{self.longest * 1000:.1f} ms longest"
+        )
 
 
 class SubprocessScriptManager(ScriptManager):
     """
     Manages and creates script-environments.
+
+    A number of subprocesses are started and initialized ahead of time
+    so new scripts do not have to wait for the subprocess to start.
+    The pool is refilled in the background whenever a script is created.
+
+    When the subprocess of a script dies, a supervisor replaces it
+    and executes the code of the script again.
     """
 
     instances: Dict[str, Subprocess]
+    sharded: Dict[str, ShardedScript]
     starter: ScriptProviderInfo
 
-    pool: Pool
-    _next_process: Subprocess
+    context: Context
+
+    framebuffer_slots: int
+    framebuffer_size: int
+    framebuffer_max_size: int
+    warm_processes: int
+    frame_cache: FrameCache
+    dispatch_workers: int
+    auto_restart: bool
+    max_restarts: int
+    replay_timeout: float
 
-    def __init__(self, starter: ScriptProviderInfo):
+    restarts: Dict[str, int]
+
+    startup_stats: StartupStats
+
+    _warm: Deque[Subprocess]
+    _lock: Lock
+    _refilling: bool
+    _disabled: bool
+
+    _supervisor: Optional[Thread]
+    _wakeup_read: Connection
+    _wakeup_write: Connection
+
+    def __init__(
+            self,
+            starter: ScriptProviderInfo,
+            *,
+            framebuffer_slots: Optional[int] = None,
+            framebuffer_size: Optional[int] = None,
+            framebuffer_max_size: Optional[int] = None,
+            warm_processes: Optional[int] = None,
+            start_method: Optional[str] = None,
+            frame_cache_size: Optional[int] = None,
+            dispatch_workers: Optional[int] = None,
+            auto_restart: Optional[bool] = None,
+            max_restarts: Optional[int] = None,
+            replay_timeout: Optional[float] = None
+    ):
+        """
+        :param starter:               The provider to run inside the subprocesses.
+        :param framebuffer_slots:     How many frames can be transferred at the same time. Defaults to the MultiScript-setting.
+        :param framebuffer_size:      The minimal size of a framebuffer-slot. Defaults to the MultiScript-setting.
+        :param framebuffer_max_size:  The maximal size of a framebuffer-slot. Defaults to the MultiScript-setting.
+        :param warm_processes:        How many subprocesses are kept ready. Defaults to the MultiScript-setting.
+        :param start_method:          How subprocesses are started. Defaults to the MultiScript-setting.
+        :param frame_cache_size:      How many bytes of frames are cached for all scripts. Defaults to the MultiScript-setting.
+        :param dispatch_workers:      How many commands a subprocess runs at the same time. Defaults to the MultiScript-setting.
+        :param auto_restart:          Restart subprocesses that died. Defaults to the MultiScript-setting.
+        :param max_restarts:          How often a script is restarted in a row before it is given up.
+                                      A successful replay resets the count. Defaults to the MultiScript-setting.
+        :param replay_timeout:        How many seconds a restarted subprocess may take to replay its script.
+                                      Defaults to the MultiScript-setting.
+        """
         self.instances = {}
+        self.sharded = {}
         self.starter = starter
-        ctx: Context = get_context("spawn")
-        self.pool = ctx.Pool()
-        self._next_process = None
-        self._checkout_next()
 
-    def _checkout_next(self):
-        prev = self._next_process
-        self._next_process = Subprocess(self.pool, self.starter)
-        return prev
+        extension = Yuuno.instance().get_extension('MultiScript')
+        if framebuffer_slots is None:
+            framebuffer_slots = FRAME_BUFFER_SLOTS if extension is None else extension.framebuffer_slots
+        if framebuffer_size is None:
+            framebuffer_size = FRAME_BUFFER_SIZE if extension is None else extension.framebuffer_size
+        if framebuffer_max_size is None:
+            framebuffer_max_size = FRAME_BUFFER_MAX_SIZE if extension is None else extension.framebuffer_max_size
+        if warm_processes is None:
+            warm_processes = WARM_PROCESSES if extension is None else extension.warm_processes
+        if start_method is None:
+            start_method = START_METHOD if extension is None else extension.start_method
+        if frame_cache_size is None:
+            frame_cache_size = FRAME_CACHE_SIZE if extension is None else extension.frame_cache_size
+        if dispatch_workers is None:
+            dispatch_workers = DISPATCH_WORKERS if extension is None else extension.dispatch_workers
+        if auto_restart is None:
+            auto_restart = AUTO_RESTART if extension is None else extension.auto_restart
+        if max_restarts is None:
+            max_restarts = MAX_RESTARTS if extension is None else extension.max_restarts
+        if replay_timeout is None:
+            replay_timeout = REPLAY_TIMEOUT if extension is None else extension.replay_timeout
+        self.framebuffer_slots = framebuffer_slots
+        self.framebuffer_size = framebuffer_size
+        self.framebuffer_max_size = framebuffer_max_size
+        self.warm_processes = warm_processes
+        self.frame_cache = FrameCache(frame_cache_size)
+        self.dispatch_workers = dispatch_workers
+        self.auto_restart = auto_restart
+        self.max_restarts = max_restarts
+        self.replay_timeout = replay_timeout
+        self.restarts = {}
+
+        self.startup_stats = StartupStats()
+
+        # Subprocesses are started directly from the context.
+        # A process pool would start a worker for each CPU which is never used.
+        self.context = get_start_context(start_method)
+
+        self._warm = deque()
+        self._lock = Lock()
+        self._refilling = False
+        self._disabled = False
+
+        # Started with the first script.
+        self._supervisor = None
+        self._wakeup_read, self._wakeup_write = Pipe(duplex=False)
+
+        self._refill()
+
+    def _spawn(self) -> Subprocess:
+        return Subprocess(
+            self.context, self.starter,
+            framebuffer_slots=self.framebuffer_slots,
+            framebuffer_size=self.framebuffer_size,
+            framebuffer_max_size=self.framebuffer_max_size,
+            frame_cache=self.frame_cache,
+            dispatch_workers=self.dispatch_workers
+        )
+
+    def _refill(self) -> None:
+        with self._lock:
+            if self._refilling or self._disabled or len(self._warm) >= self.warm_processes:
+                return
+            self._refilling = True
+        Thread(target=self._refill_worker, name="yuuno-warm-pool", daemon=True).start()
+
+    def _refill_worker(self) -> None:
+        while True:
+            with self._lock:
+                if self._disabled or len(self._warm) >= self.warm_processes:
+                    self._refilling = False
+                    return
+
+            process = None
+            try:
+                process = self._spawn()
+                process.initialize()
+            except Exception:
+                with self._lock:
+                    self._refilling = False
+                if process is not None:
+                    process.dispose()
+                raise
+
+            with self._lock:
+                if not self._disabled:
+                    self._warm.append(process)
+                    continue
+                self._refilling = False
+
+            # The manager has been disabled while the subprocess started.
+            process.dispose()
+            return
+
+    def _checkout_warm(self) -> Optional[Subprocess]:
+        dead = []
+        process = None
+        with self._lock:
+            while self._warm:
+                candidate = self._warm.popleft()
+                if candidate.alive:
+                    process = candidate
+                    break
+                dead.append(candidate)
+
+        for candidate in dead:
+            candidate.dispose()
+        return process
 
     def create(self, name: str, *, initialize=False) -> Script:
         """
@@ -54,16 +318,162 @@ class SubprocessScriptManager(ScriptManager):
         """
         if name in self.instances and self.instances[name].alive:
             raise ValueError("A core with this name already exists.")
-        process = self._checkout_next()
-        self.instances[name] = process
+
+        started = time.monotonic()
+        process = self._checkout_warm()
+        warm = process is not None
+        if not warm:
+            process = self._spawn()
+        self._refill()
+
+        with self._lock:
+            self.instances[name] = process
+            self.restarts.pop(name, None)
+        self._supervise_instances()
+
         if initialize:
             process.initialize()
+
+        with self._lock:
+            self.startup_stats = self.startup_stats.record(time.monotonic() - started, warm)
         return process
 
+    def create_sharded(self, name: str, shards: int, *, routing: str = ROUND_ROBIN, initialize=False) -> ShardedScript:
+        """
+        Creates a script environment that runs the code in multiple subprocesses.
+
+        The shards are regular scripts named "name#index", so they
+        are restarted and disposed like every other script.
+
+        :param name:       The name of the script.
+        :param shards:     The number of subprocesses.
+        :param routing:    How frames are assigned to the shards. (round-robin or range)
+        :param initialize: Initialize the subprocesses right away.
+        """
+        if name in self.sharded and self.sharded[name].alive:
+            raise ValueError("A core with this name already exists.")
+        if shards < 1:
+            raise ValueError("At least one shard is required.")
+        if routing not in ROUTINGS:
+            raise ValueError(f"Unknown routing {routing!r}.")
+
+        script = ShardedScript(
+            [self.create(f"{name}#{index}", initialize=initialize) for index in range(shards)],
+            routing
+        )
+        self.sharded[name] = script
+        return script
+
+    def _supervise_instances(self) -> None:
+        # Makes the supervisor watch the current instances.
+        if not self.auto_restart:
+            return
+
+        with self._lock:
+            if self._disabled:
+                return
+            if self._supervisor is None:
+                self._supervisor = Thread(target=self._supervise, name="yuuno-supervisor", daemon=True)
+                self._supervisor.start()
+                return
+
+        try:
+            self._wakeup_write.send_bytes(b"")
+        except OSError:
+            pass
+
+    def _supervise(self) -> None:
+        try:
+            while True:
+                with self._lock:
+                    if self._disabled:
+                        return
+                    watched = {
+                        script.process.sentinel: (name, script, script.process)
+                        for name, script in self.instances.items()
+                        if script.restartable and script.process is not None
+                    }
+
+                ready = wait(list(watched) + [self._wakeup_read])
+                if self._wakeup_read in ready:
+                    self._wakeup_read.recv_bytes()
+
+                for sentinel in ready:
+                    if sentinel not in watched:
+                        continue
+                    name, script, process = watched[sentinel]
+
+                    # Ignore scripts that have been disposed in the meantime.
+                    if script.process is not process or self._disabled:
+                        continue
+
+                    # Keep supervising the other scripts if a restart fails.
+                    try:
+                        self._restart(name, script)
+                    except Exception:
+                        Yuuno.instance().log.exception(f"Failed to restart the subprocess of {name}.")
+        finally:
+            self._wakeup_read.close()
+
+    def _restart(self, name: str, script: Subprocess) -> None:
+        with self._lock:
+            attempts = self.restarts.get(name, 0) + 1
+            self.restarts[name] = attempts
+
+        if attempts > self.max_restarts:
+            # Give up. Requests to the script fail from now on.
+            script.dispose()
+            return
+
+        replacement = None
+        try:
+            replacement = self._checkout_warm()
+            if replacement is None:
+                replacement = self._spawn()
+            self._refill()
+            replacement.initialize()
+        except Exception:
+            # The dead subprocess is still watched, so this is retried.
+            if replacement is not None:
+                replacement.dispose()
+            return
+
+        try:
+            script.adopt(replacement)
+        except Exception:
+            replacement.dispose()
+            raise
+
+        # Replay in the background so other scripts can be restarted in the meantime.
+        process = script.process
+        replay = script.replay()
+        timer = Timer(self.replay_timeout, self._replay_timed_out, (script, process, replay))
+        timer.daemon = True
+        timer.start()
+        replay.add_done_callback(functools.partial(self._replayed, name, timer))
+
+    def _replay_timed_out(self, script: Subprocess, process: Process, replay: Future) -> None:
+        # Requests are held back until the replay finishes.
+        # Kill the subprocess so the supervisor starts over.
+        if not replay.done() and script.process is process:
+            process.kill()
+
+    def _replayed(self, name: str, timer: Timer, replay: Future) -> None:
+        timer.cancel()
+        if replay.exception() is not None:
+            # Died again. The supervisor notices on its next iteration.
+            return
+
+        # The script works again. Only restarts in a row count towards max_restarts.
+        with self._lock:
+            self.restarts.pop(name, None)
+
     def get(self, name: str) -> Optional[Script]:
         """
         Returns the script with the given name.
         """
+        if name in self.sharded:
+            return self.sharded[name]
         return self.instances.get(name)
 
     def dispose_all(self) -> None:
@@ -71,13 +481,27 @@ class SubprocessScriptManager(ScriptManager):
         Disposes all scripts
         """
         for process in list(self.instances.values()):
-            if process.alive:
-                return
             process.dispose()
 
     def disable(self) -> None:
         """
         Disposes all scripts and tries to clean up.
         """
+        with self._lock:
+            self._disabled = True
+            warm = list(self._warm)
+            self._warm.clear()
+
+        # Scripts are not restarted anymore.
+        try:
+            self._wakeup_write.send_bytes(b"")
+        except OSError:
+            # The supervisor has already quit.
+            pass
+        if self._supervisor is not None:
+            self._supervisor.join()
+        self._wakeup_write.close()
+
         self.dispose_all()
-        self._next_process.dispose()
+        for process in warm:
+            process.dispose()
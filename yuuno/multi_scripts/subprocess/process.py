@@ -17,47 +17,71 @@
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 import os
 import functools
+import itertools
 from pathlib import Path
-from contextlib import contextmanager
 
-from threading import Lock, Event, Thread
+from asyncio import wrap_future
+from threading import Event, Thread
 from queue import Queue, Empty
-from concurrent.futures import Future
+from concurrent.futures import Future, ThreadPoolExecutor
 
-from ctypes import c_ubyte
-from multiprocessing import Pipe, Pool, Process
-from multiprocessing.sharedctypes import RawArray as Array
+from multiprocessing import Pipe, Process
+from multiprocessing.context import BaseContext as Context
 from multiprocessing.connection import Connection
 
-from typing import List, Callable, Any, NamedTuple, Sequence, Dict, Union
+from typing import List, Callable, Any, NamedTuple, Optional, Sequence, Dict, Union
 from typing import TYPE_CHECKING
 
 from traitlets.utils.importstring import import_item
-from traitlets import Instance
+from traitlets import Instance, CInt
 
 from yuuno.multi_scripts.subprocess.basic_commands import BasicCommands
 from yuuno.utils import future_yield_coro
 from yuuno.core.environment import Environment
 from yuuno.multi_scripts.utils import ConvertingMappingProxy
 from yuuno.multi_scripts.script import Script
-from yuuno.multi_scripts.environments import RequestManager
+from yuuno.multi_scripts.environments import RequestManager, CommandHandler
 from yuuno.multi_scripts.subprocess.provider import ScriptProviderInfo, ScriptProvider
-from yuuno.multi_scripts.subprocess.proxy import Responder, Requester
+from yuuno.multi_scripts.subprocess.framebuffer import FrameBufferPool, FrameBufferAttachments, discard_out_of_band
+from yuuno.multi_scripts.subprocess.cache import FrameCache
+from yuuno.multi_scripts.subprocess.dispatch import ReadWriteLock
+from yuuno.multi_scripts.subprocess import wire
+from yuuno.multi_scripts.subprocess.proxy import Responder, Requester, ConnectionLost
 from yuuno.multi_scripts.subprocess.clip import ProxyClip
 
 if TYPE_CHECKING:
     from yuuno.clip import Clip
 
 
-# This sets the size of the frame-buffer.
-# I expect 8K to be enough for now.
-FRAME_BUFFER_SIZE = 7680*4320*3
+# This sets the minimal size of a frame-buffer slot.
+# With 0, the slots are sized from the frames sent through them.
+FRAME_BUFFER_SIZE = 0
+
+# Frames larger than this are transferred in segments of their own
+# so the slots do not stay this large. 8K should be enough for now.
+FRAME_BUFFER_MAX_SIZE = 7680*4320*3
+
+# How many frames can be transferred at the same time.
+FRAME_BUFFER_SLOTS = 2
+
+# How many commands the subprocess runs at the same time.
+DISPATCH_WORKERS = 4
+
+# How many bytes of frame data are cached in the main process.
+FRAME_CACHE_SIZE = 256*1024*1024
+
+# Identifies the scripts in a shared frame cache.
+_script_ids = itertools.count()
+
+# Set once yuuno has been preloaded in this process or the forkserver it was forked from.
+_preloaded = False
 
 
 class RequestQueueItem(NamedTuple):
     future: Future
     cb: Callable[[Any], Any]
     args: Sequence[Any]
+    shared: bool
 
 
 class LocalSubprocessEnvironment(RequestManager, Environment):
@@ -70,13 +94,21 @@ class LocalSubprocessEnvironment(RequestManager, Environment):
     read: Connection
     provider: ScriptProvider = Instance(ScriptProvider)
 
-    _framebuffer: Array
-    _framebuffer_lock: Lock
+    dispatch_workers: int = CInt(DISPATCH_WORKERS, help="""
+        How many commands may run at the same time.
+        Only commands reading frames and results run concurrently,
+        executing code always waits for all other commands.
+        Set by the main process when it starts the subprocess.
+        """)
+
+    _framebuffers: FrameBufferAttachments
 
     queue: Queue
     stopped: Event
+    lock: ReadWriteLock
+    executor: ThreadPoolExecutor
     responder: Responder
-    commands: ConvertingMappingProxy[str, Callable[..., Any], Callable[[Any], Future]]
+    commands: ConvertingMappingProxy[str, CommandHandler, Callable[[Any], Future]]
 
     def additional_extensions(self) -> List[str]:
         """
@@ -105,6 +137,7 @@ class LocalSubprocessEnvironment(RequestManager, Environment):
         """
         self.queue = Queue()
         self.stopped = Event()
+        self.lock = ReadWriteLock()
         self.handlers = {}
         self.commands = ConvertingMappingProxy(self.handlers, self._wrap2queue)
 
@@ -113,11 +146,11 @@ class LocalSubprocessEnvironment(RequestManager, Environment):
 
         self.provider = provider_class(self.parent, **self._provider_meta.providerparams)
 
-    def _wrap2queue(self, unwrapped: Callable[[Any], Any]) -> Callable[[Any], Future]:
-        @functools.wraps(unwrapped)
+    def _wrap2queue(self, handler: CommandHandler) -> Callable[[Any], Future]:
+        @functools.wraps(handler.cb)
         def _wrapper(data: Any) -> Future:
             fut = Future()
-            self.queue.put(RequestQueueItem(fut, unwrapped, data))
+            self.queue.put(RequestQueueItem(fut, handler.cb, data, handler.shared))
             return fut
         return _wrapper
 
@@ -128,13 +161,21 @@ class LocalSubprocessEnvironment(RequestManager, Environment):
         interoperability for the given environment.
         """
         self.provider.initialize(self)
-        self.handlers.update(BasicCommands(self.provider.get_script(), self).commands)
-        self._framebuffer_lock = Lock()
+        commands = BasicCommands(self.provider.get_script(), self)
+        for name, cb in commands.commands.items():
+            self.register_command(name, cb, shared=name in commands.shared_commands)
+
+    def framebuffer(self, slot: int, name: str) -> memoryview:
+        """
+        Returns the framebuffer-slot leased by the main process.
 
-    @contextmanager
-    def framebuffer(self):
-        with self._framebuffer_lock:
-            yield memoryview(self._framebuffer).cast("B")
+        The main process leases each slot to exactly one request,
+        so no locking is required.
+
+        :param slot: The index of the slot.
+        :param name: The name of the shared memory segment backing the slot.
+        """
+        return self._framebuffers.get(slot, name)
 
     def _copy_result(self, source: Future, destination: Future):
         def _done(_):
@@ -145,36 +186,64 @@ class LocalSubprocessEnvironment(RequestManager, Environment):
             self.queue.task_done()
         source.add_done_callback(_done)
 
+    def _release(self, rqi: RequestQueueItem) -> None:
+        if rqi.shared:
+            self.lock.release_read()
+        else:
+            self.lock.release_write()
+
+    def _dispatch(self, rqi: RequestQueueItem) -> None:
+        try:
+            result = rqi.cb(**rqi.args)
+        except Exception as e:
+            rqi.future.set_exception(e)
+        else:
+            if not isinstance(result, Future):
+                rqi.future.set_result(result)
+                self.queue.task_done()
+            else:
+                self._copy_result(result, rqi.future)
+
     def run(self):
         """
         Wait for commands.
+
+        Commands are started in the order they arrive. Shared commands
+        run concurrently on the dispatch workers while every other command
+        waits until all commands before it have completed and blocks
+        the commands after it until it has completed.
         """
 
-        self.responder = Responder(self.read, self.write, self.commands)
+        self.responder = Responder(self.read, self.write, self.commands, on_disconnect=self.stop)
         self.responder.start()
 
+        self.executor = ThreadPoolExecutor(max(self.dispatch_workers, 1), thread_name_prefix="yuuno-dispatch")
+
         self.responder.send(None)
-        while not self.stopped.set():
+        while not self.stopped.is_set():
+            rqi: Optional[RequestQueueItem] = None
             try:
-                rqi: RequestQueueItem = self.queue.get(timeout=1)
-            except Empty:
-                continue
+                rqi = self.queue.get()
+                if rqi is None:
+                    # Woken up by stop()
+                    continue
 
-            if not rqi.future.set_running_or_notify_cancel():
-                continue
+                if not rqi.future.set_running_or_notify_cancel():
+                    continue
 
-            try:
-                result = rqi.cb(**rqi.args)
+                if rqi.shared:
+                    self.lock.acquire_read()
+                else:
+                    self.lock.acquire_write()
             except KeyboardInterrupt:
+                if rqi is not None and not rqi.future.done():
+                    rqi.future.set_exception(RuntimeError("System stoppped."))
                 self.stop()
-            except Exception as e:
-                rqi.future.set_exception(e)
-            else:
-                if not isinstance(result, Future):
-                    rqi.future.set_result(result)
-                    self.queue.task_done()
-                else:
-                    self._copy_result(result, rqi.future)
+                continue
+
+            # The lock is held until the command has completed, even if it completes asynchronously.
+            rqi.future.add_done_callback(lambda _, rqi=rqi: self._release(rqi))
+            self.executor.submit(self._dispatch, rqi)
 
         while True:
             try:
@@ -182,26 +251,39 @@ class LocalSubprocessEnvironment(RequestManager, Environment):
             except Empty:
                 break
 
-            rqi.future.set_exception(RuntimeError("System stoppped."))
+            if rqi is not None:
+                rqi.future.set_exception(RuntimeError("System stoppped."))
 
+        self.executor.shutdown(wait=False)
         self.responder.stop()
 
     def stop(self):
         self.stopped.set()
+        self.queue.put(None)
 
     def deinitialize(self) -> None:
         """
         Called by yuuno before it deconfigures itself.
         """
         self.provider.deinitialize()
+        self._framebuffers.close()
 
     @staticmethod
-    def _preload():
+    def preload() -> None:
+        """
+        Loads and configures yuuno once so starting the environment is fast.
+        Processes forked after the preload do not need to preload again.
+        """
+        global _preloaded
+        if _preloaded:
+            return
+
         print(os.getpid(), ">", "Preloading.")
         from yuuno import init_standalone
         y = init_standalone()
         y.start()
         y.stop()
+        _preloaded = True
         print(os.getpid(), ">", "Preload complete.")
 
     @staticmethod
@@ -213,19 +295,25 @@ class LocalSubprocessEnvironment(RequestManager, Environment):
         current.kill()
 
     @classmethod
-    def execute(cls, read: Connection, write: Connection, framebuffer: Array):
-        cls._preload()
+    def execute(cls, read: Connection, write: Connection, dispatch_workers: int = DISPATCH_WORKERS):
+        cls.preload()
         Thread(target=cls._check_parent,  daemon=True).start()
 
         from yuuno import Yuuno
         yuuno = Yuuno.instance(parent=None)
-        env = cls(parent=yuuno, read=read, write=write)
-        env._framebuffer = framebuffer
+        env = cls(parent=yuuno, dispatch_workers=dispatch_workers)
+        env.read = read
+        env.write = write
+        env._framebuffers = FrameBufferAttachments()
         yuuno.environment = env
 
         # Wait for the ProviderMeta to be set.
         print(os.getpid(), ">", "Ready to deploy!")
-        env._provider_meta = read.recv()
+        try:
+            env._provider_meta = read.recv()
+        except EOFError:
+            # The script has been disposed before it was initialized.
+            return
         yuuno.start()
         print(os.getpid(), ">", "Deployed", env._provider_meta)
 
@@ -237,43 +325,85 @@ class LocalSubprocessEnvironment(RequestManager, Environment):
 
 
 class Subprocess(Script):
+    # Whether a dead subprocess can be replaced by another one.
+    restartable: bool = True
+
     process: Process
     self_read: Connection
     self_write: Connection
     child_read: Connection
     child_write: Connection
     requester: Requester
-    pool: Pool
+    context: Context
     provider_info: ScriptProviderInfo
+    framebuffers: Optional[FrameBufferPool]
+    frame_cache: FrameCache
+    dispatch_workers: int
 
+    cache_id: int
+    generation: int
+    history: List[Union[str, Path]]
     running: bool
 
-    def __init__(self, pool: Pool, provider_info: ScriptProviderInfo):
+    _replayed: Future
+
+    def __init__(
+            self,
+            context: Context,
+            provider_info: ScriptProviderInfo,
+            framebuffer_slots: int = FRAME_BUFFER_SLOTS,
+            framebuffer_size: int = FRAME_BUFFER_SIZE,
+            framebuffer_max_size: int = FRAME_BUFFER_MAX_SIZE,
+            frame_cache: Optional[FrameCache] = None,
+            dispatch_workers: int = DISPATCH_WORKERS
+    ):
         self.process = None
-        self.pool = pool
-        self.self_read, self.self_write = Pipe(duplex=False)
-        self.child_read, self.child_write = Pipe(duplex=False)
-        self.requester = Requester(self.child_read, self.self_write)
-
+        self.context = context
         self.provider_info = provider_info
+        self.dispatch_workers = dispatch_workers
+
+        # The memory is only allocated once frames are transferred.
+        self.framebuffers = self._create_framebuffers(framebuffer_slots, framebuffer_size, framebuffer_max_size)
 
-        # Allow an 8K image to be transmitted.
-        # This should be enough.
-        self._fb = Array(c_ubyte, FRAME_BUFFER_SIZE)
-        self._fb_lock = Lock()
+        # The cache can be shared with other scripts.
+        self.frame_cache = FrameCache(FRAME_CACHE_SIZE) if frame_cache is None else frame_cache
+        self.cache_id = next(_script_ids)
+        self.generation = 0
+
+        # Replayed when the subprocess is replaced.
+        # Requests wait until the replay has finished.
+        self.history = []
+        self._replayed = Future()
+        self._replayed.set_result(None)
 
-        self._create()
         self.running = False
+        self._connect()
+
+    def _create_framebuffers(self, slots: int, size: int, max_size: int) -> Optional[FrameBufferPool]:
+        return FrameBufferPool(slots, size, max_size)
 
-    def _create(self):
-        self.process = self.pool.Process(
+    def _connect(self) -> None:
+        # Starts the subprocess and connects to it.
+        self.self_read, self.self_write = Pipe(duplex=False)
+        self.child_read, self.child_write = Pipe(duplex=False)
+        self.requester = Requester(self.child_read, self.self_write)
+        self.requester.on_unclaimed = discard_out_of_band
+
+        process = self.context.Process(
             target=LocalSubprocessEnvironment.execute,
             args=(
                 self.self_read, self.child_write,           # Commands
-                self._fb
+                self.dispatch_workers
             )
         )
-        self.process.start()
+        process.start()
+        self.process = process
+
+        # The subprocess has its own copies now. Without closing ours,
+        # reading from the subprocess would never fail if it dies.
+        self.self_read.close()
+        self.child_write.close()
+        self.requester.sentinel = self.process.sentinel
 
     @property
     def alive(self) -> bool:
@@ -282,13 +412,16 @@ class Subprocess(Script):
     def initialize(self):
         if self.alive:
             return
-        if self.running:
+        if self.running or self.process is None:
             raise ValueError("Already disposed!")
 
-        self.self_write.send(self.provider_info)
+        try:
+            self.self_write.send(self.provider_info)
 
-        # Block until initialization completes.
-        self.child_read.recv()
+            # Block until initialization completes.
+            wire.loads(self.child_read.recv_bytes())
+        except (EOFError, OSError) as e:
+            raise ConnectionLost("The subprocess died during initialization.") from e
         self.running = True
         self.requester.start()
 
@@ -296,28 +429,106 @@ class Subprocess(Script):
         """
         Disposes the script.
         """
-        if not self.alive:
+        # Subprocesses that have never been initialized are running as well.
+        if self.process is None:
             return
+        process, self.process = self.process, None
 
         if self.requester.is_alive():
             self.requester.stop()
-            self.requester.join()
+        self.requester.close()
 
         self.child_write.close()
         self.child_read.close()
         self.self_write.close()
         self.self_read.close()
 
-        self.process.terminate()
+        process.terminate()
+        process.join()
+        if self.framebuffers is not None:
+            self.framebuffers.close()
+        self.frame_cache.invalidate(self.cache_id)
+
+    def adopt(self, replacement: 'Subprocess') -> None:
+        """
+        Replaces the subprocess of this script with the one of another script,
+        for example after the subprocess has died.
+
+        Existing clips and frames keep working with the new subprocess.
+        The other script must not be used afterwards.
+        Call replay() to restore the outputs of the script.
+
+        :param replacement: A script that has not executed any code yet.
+        """
+        # Hold back requests until replay() has restored the outputs.
+        self._replayed = Future()
+        self._replayed.set_running_or_notify_cancel()
+
+        try:
+            self.dispose()
+        except Exception:
+            # Not replaced. Requests fail like with any other dead subprocess.
+            self._replayed.set_result(None)
+            raise
+
+        self.process, replacement.process = replacement.process, None
+        self.self_read = replacement.self_read
+        self.self_write = replacement.self_write
+        self.child_read = replacement.child_read
+        self.child_write = replacement.child_write
+        self.requester = replacement.requester
+        self.running = replacement.running
+        if replacement.framebuffers is not None:
+            replacement.framebuffers.close()
+
+        # The outputs are created again.
+        self.generation += 1
+        self.frame_cache.invalidate(self.cache_id)
+
+    @future_yield_coro
+    def replay(self):
+        """
+        Executes the code that has been executed so far again.
+        Code that failed the first time is expected to fail again.
+
+        Requests made in the meantime are sent once the replay has finished.
+        """
+        try:
+            for code in list(self.history):
+                try:
+                    yield self._submit_execute(code)
+                except ConnectionLost:
+                    raise
+                except Exception:
+                    pass
+        finally:
+            # Frames fetched while the outputs were incomplete are never used.
+            self.generation += 1
+            self.frame_cache.invalidate(self.cache_id)
+            if not self._replayed.done():
+                self._replayed.set_result(None)
+
+    def submit(self, type: str, data: Any, protect: bool = False) -> Future:
+        """
+        Sends a request to the subprocess.
+
+        :param type:    The command.
+        :param data:    The arguments of the command.
+        :param protect: Do not log the response, for example because it carries a frame.
+        :return: A future resolving with the response.
+        """
+        if self._replayed.done():
+            return self.requester.submit(type, data, protect)
+        return self._submit_after_replay(type, data, protect)
+
+    @future_yield_coro
+    def _submit_after_replay(self, type: str, data: Any, protect: bool):
+        yield self._replayed
+        return (yield self.requester.submit(type, data, protect))
 
     def __del__(self):
         self.dispose()
 
-    @contextmanager
-    def framebuffer(self):
-        with self._fb_lock:
-            yield memoryview(self._fb).cast("B")
-
     @future_yield_coro
     def get_results(self) -> Dict[str, 'Clip']:
         """
@@ -325,15 +536,39 @@ class Subprocess(Script):
         that represent the results of the script.
         """
 
-        indexes = yield self.requester.submit("script/subprocess/results", {})
+        indexes = yield self.submit("script/subprocess/results", {})
         return {name: ProxyClip(name, length, self) for name, length in indexes.items()}
 
     def execute(self, code: Union[str, Path]) -> Future:
         """
         Executes the code inside the environment
         """
-        return self.requester.submit("script/subprocess/execute", {
+        # The code may change the outputs. Frames of earlier generations are never used again.
+        self.generation += 1
+        self.frame_cache.invalidate(self.cache_id)
+        self.history.append(code)
+        return self.submit("script/subprocess/execute", self._execute_request(code))
+
+    def _submit_execute(self, code: Union[str, Path]) -> Future:
+        # Bypasses the requests held back during a replay.
+        return self.requester.submit("script/subprocess/execute", self._execute_request(code))
+
+    @staticmethod
+    def _execute_request(code: Union[str, Path]) -> Dict[str, str]:
+        return {
             "type": "path" if isinstance(code, Path) else "string",
             "code": str(code)
-        })
+        }
+
+    async def aget_results(self) -> Dict[str, 'Clip']:
+        """
+        Awaitable variant of get_results() for asyncio event loops.
+        """
+        return await wrap_future(self.get_results())
+
+    async def aexecute(self, code: Union[str, Path]) -> Any:
+        """
+        Awaitable variant of execute() for asyncio event loops.
+        """
+        return await wrap_future(self.execute(code))
 
@@ -17,12 +17,22 @@
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 import os
 import traceback
-from multiprocessing.connection import Connection
+from multiprocessing import Pipe
+from multiprocessing.connection import Connection, wait
 from threading import Thread, RLock as Lock, Event
 from typing import MutableMapping, Mapping, Optional, Any, Callable, Union
 from typing import NamedTuple, List
 from concurrent.futures import Future
 
+from yuuno.multi_scripts.subprocess import wire
+
+
+class ConnectionLost(ConnectionError):
+    """
+    The other side of the connection is gone and
+    the request will never be answered.
+    """
+
 
 class Response(NamedTuple):
     id: int
@@ -63,6 +73,9 @@ class Handler(Thread):
     write_lock: Lock
     stopped: Event
 
+    _wakeup_read: Connection
+    _wakeup_write: Connection
+
     def __init__(self, read: Connection, write: Connection):
         super(Handler, self).__init__(daemon=True)
         self.read = read
@@ -71,24 +84,67 @@ class Handler(Thread):
         self.stopped = Event()
         self.lock = Lock()
 
+        # Written to by stop() so the thread does not have to
+        # wake up periodically to check if it should stop.
+        self._wakeup_read, self._wakeup_write = Pipe(duplex=False)
+
     def _handle(self, obj: Union[Request, Response]):
         pass
 
+    def _disconnected(self):
+        """
+        Called when the other side closed the connection.
+        """
+        pass
+
+    def _watched(self) -> List[Any]:
+        """
+        Additional objects to wait for. The connection
+        counts as closed once one of them becomes ready.
+        """
+        return []
+
     def run(self):
         while not self.stopped.is_set():
-            if not self.read.poll(1):
+            watched = self._watched()
+            ready = wait([self.read, self._wakeup_read] + watched)
+            if self.read not in ready:
+                if any(w in ready for w in watched):
+                    self._disconnected()
+                    break
                 continue
 
-            data = self.read.recv()
+            try:
+                data = wire.loads(self.read.recv_bytes())
+            except (EOFError, OSError):
+                self._disconnected()
+                break
             self._handle(data)
 
     def send(self, obj):
+        data = wire.dumps(obj)
         with self.lock:
-            self.write.send(obj)
+            self.write.send_bytes(data)
 
     def stop(self):
         self.stopped.set()
+        try:
+            self._wakeup_write.send_bytes(b"")
+        except OSError:
+            # The thread has already quit.
+            pass
         self.join()
+        self.close()
+
+    def close(self):
+        """
+        Releases the pipe used by stop().
+
+        Stopping the thread does this already. Call it directly if the
+        thread has quit on its own or has never been started.
+        """
+        self._wakeup_read.close()
+        self._wakeup_write.close()
 
 
 class Responder(Handler):
@@ -99,10 +155,22 @@ class Responder(Handler):
     """
 
     handlers: Mapping[str, Callable[[Any], Future]]
-
-    def __init__(self, read: Connection, write: Connection, handlers: Mapping[str, Callable[[Any], Future]]):
+    on_disconnect: Optional[Callable[[], None]]
+
+    def __init__(
+            self,
+            read: Connection,
+            write: Connection,
+            handlers: Mapping[str, Callable[[Any], Future]],
+            on_disconnect: Optional[Callable[[], None]] = None
+    ):
         super(Responder, self).__init__(read, write)
         self.handlers = handlers
+        self.on_disconnect = on_disconnect
+
+    def _disconnected(self):
+        if self.on_disconnect is not None:
+            self.on_disconnect()
 
     def _handle(self, obj: Request):
         print(os.getpid(), ">", obj)
@@ -138,21 +206,72 @@ class Requester(Handler):
     max_id_lock: Lock
     waiting: MutableMapping[int, Future]
 
+    sentinel: Optional[int]
+    lost: Optional[ConnectionLost]
+    on_unclaimed: Optional[Callable[[Any], None]]
+
     def __init__(self, read: Connection, write: Connection):
         super(Requester, self).__init__(read, write)
         self.max_id = 0
         self.max_id_lock = Lock()
         self.waiting = {}
 
+        # The sentinel of the subprocess. Ready when it dies.
+        self.sentinel = None
+        self.lost = None
+
+        # Called with the data of responses nobody waits for anymore,
+        # so resources they reference can be released.
+        self.on_unclaimed = None
+
+    def _watched(self) -> List[Any]:
+        if self.sentinel is None:
+            return []
+        return [self.sentinel]
+
     def _handle(self, obj: Response):
-        if obj.id not in self.waiting:
-            return
-        fut = self.waiting[obj.id]
-        if fut.cancelled():
+        with self.max_id_lock:
+            fut = self.waiting.pop(obj.id, None)
+        if fut is None or fut.cancelled():
+            self._unclaimed(obj)
             return
 
         obj.store(fut)
 
+    def _unclaimed(self, obj: Response):
+        if obj.error is None and self.on_unclaimed is not None:
+            self.on_unclaimed(obj.data)
+
+    def _drain(self):
+        # Delivers the responses that have already arrived. Without this,
+        # the resources they reference would never be released.
+        try:
+            while self.read.poll():
+                self._handle(wire.loads(self.read.recv_bytes()))
+        except (EOFError, OSError):
+            pass
+
+    def _disconnected(self):
+        self._drain()
+        self._fail_all(ConnectionLost("The subprocess has closed the connection or died."))
+
+    def _fail_all(self, error: ConnectionLost):
+        # Requests submitted after this fail immediately.
+        with self.max_id_lock:
+            if self.lost is None:
+                self.lost = error
+            waiting = list(self.waiting.values())
+            self.waiting.clear()
+
+        for fut in waiting:
+            if not fut.done():
+                fut.set_exception(self.lost)
+
+    def stop(self):
+        super(Requester, self).stop()
+        self._drain()
+        self._fail_all(ConnectionLost("The connection to the subprocess has been closed."))
+
     def _generate_id(self) -> int:
         with self.max_id_lock:
             new_id = self.max_id
@@ -163,6 +282,19 @@ class Requester(Handler):
         req = Request(id=self._generate_id(), type=type, data=data, protect=protect)
         fut = Future()
         fut.set_running_or_notify_cancel()
-        self.waiting[req.id] = fut
-        self.send(req)
+
+        with self.max_id_lock:
+            if self.lost is not None:
+                fut.set_exception(self.lost)
+                return fut
+            self.waiting[req.id] = fut
+
+        try:
+            self.send(req)
+        except Exception as e:
+            with self.max_id_lock:
+                self.waiting.pop(req.id, None)
+            if isinstance(e, OSError):
+                e = ConnectionLost(f"Failed to send the request: {e}")
+            fut.set_exception(e)
         return fut
@@ -0,0 +1,192 @@
+# -*- encoding: utf-8 -*-
+
+# Yuuno - IPython + VapourSynth
+# Copyright (C) 2018 StuxCrystal (Roland Netzsch <stuxcrystal@encode.moe>)
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+Runs scripts in workers that are connected through a socket.
+
+The worker is started with ``yuuno worker <address>`` and starts a
+subprocess for each connection. As the main process cannot map the
+memory of the worker, frames are sent through the connection.
+"""
+import multiprocessing
+from multiprocessing.connection import Connection, Listener, Client, AuthenticationError
+from multiprocessing.context import BaseContext as Context
+
+from typing import Optional, Tuple, Union
+
+from yuuno.multi_scripts.subprocess import wire
+from yuuno.multi_scripts.subprocess.cache import FrameCache
+from yuuno.multi_scripts.subprocess.compression import available_codecs
+from yuuno.multi_scripts.subprocess.process import Subprocess, LocalSubprocessEnvironment, DISPATCH_WORKERS
+from yuuno.multi_scripts.subprocess.provider import ScriptProviderInfo
+from yuuno.multi_scripts.subprocess.proxy import Requester, ConnectionLost
+
+
+Address = Union[str, Tuple[str, int]]
+
+
+def parse_address(address: str) -> Tuple[Address, str]:
+    """
+    Parses the address of a worker.
+
+    ``unix:/path/to/socket`` is a unix socket, ``host:port`` a TCP socket.
+
+    :param address: The address.
+    :return: The address and the family as used by multiprocessing.connection.
+    """
+    if address.startswith("unix:"):
+        return address[len("unix:"):], "AF_UNIX"
+
+    host, sep, port = address.rpartition(":")
+    if not sep or not port.isdigit():
+        raise ValueError(f"Invalid address {address!r}. Use host:port or unix:/path/to/socket.")
+    return (host or "127.0.0.1", int(port)), "AF_INET"
+
+
+def serve(
+        address: str,
+        *,
+        authkey: Optional[bytes] = None,
+        context: Optional[Context] = None,
+        dispatch_workers: int = DISPATCH_WORKERS
+) -> None:
+    """
+    Runs the scripts of the RemoteScripts connecting to the address.
+
+    Every connection gets a subprocess of its own that
+    runs until the connection is closed.
+
+    :param address: Where to listen. See parse_address().
+    :param authkey: The key clients have to authenticate with.
+    :param context: The multiprocessing-context used to start the subprocesses.
+    :param dispatch_workers: How many commands each subprocess runs at the same time.
+    """
+    if context is None:
+        from yuuno.multi_scripts.subprocess.manager import get_start_context, START_METHOD
+        context = get_start_context(START_METHOD)
+
+    address, family = parse_address(address)
+    with Listener(address, family, authkey=authkey) as listener:
+        while True:
+            try:
+                connection = listener.accept()
+            except (AuthenticationError, EOFError, ConnectionError):
+                continue
+
+            context.Process(
+                target=LocalSubprocessEnvironment.execute,
+                args=(connection, connection, dispatch_workers)
+            ).start()
+            connection.close()
+
+            # Reap the subprocesses of closed connections.
+            multiprocessing.active_children()
+
+
+class RemoteScript(Subprocess):
+    """
+    A script running in a worker, possibly on another machine.
+    """
+
+    # The worker starts the subprocess. It cannot be replaced from here.
+    restartable = False
+
+    address: str
+    authkey: Optional[bytes]
+
+    connection: Connection
+    compression: bool
+    codec: Optional[str]
+
+    def __init__(
+            self,
+            address: str,
+            provider_info: ScriptProviderInfo,
+            *,
+            authkey: Optional[bytes] = None,
+            compression: bool = True,
+            frame_cache: Optional[FrameCache] = None
+    ):
+        """
+        :param address:       The address of the worker. See parse_address().
+        :param provider_info: The provider to run inside the worker.
+        :param authkey:       The key of the worker.
+        :param compression:   Compress frames with a codec supported by both ends.
+        :param frame_cache:   The cache for transferred frames.
+        """
+        self.connection = None
+        self.address = address
+        self.authkey = authkey
+        self.compression = compression
+        self.codec = None
+        super(RemoteScript, self).__init__(None, provider_info, frame_cache=frame_cache)
+
+    def _create_framebuffers(self, slots: int, size: int, max_size: int) -> None:
+        # Frames are sent through the connection.
+        return None
+
+    def _connect(self) -> None:
+        address, family = parse_address(self.address)
+        self.connection = Client(address, family, authkey=self.authkey)
+        self.requester = Requester(self.connection, self.connection)
+
+    @property
+    def alive(self) -> bool:
+        return self.running and not self.connection.closed and self.requester.lost is None
+
+    def initialize(self):
+        if self.alive:
+            return
+        if self.running or self.connection.closed:
+            raise ValueError("Already disposed!")
+
+        try:
+            self.connection.send(self.provider_info)
+
+            # Block until initialization completes.
+            wire.loads(self.connection.recv_bytes())
+        except (EOFError, OSError) as e:
+            raise ConnectionLost("The worker closed the connection during initialization.") from e
+        self.running = True
+        self.requester.start()
+
+        if self.compression:
+            self.codec = self._negotiate()
+
+    def _negotiate(self) -> Optional[str]:
+        try:
+            return self.requester.submit('script/subprocess/codecs', {"offered": available_codecs()}).result()
+        except NotImplementedError:
+            # The worker does not know how to compress frames.
+            return None
+
+    def adopt(self, replacement: 'Subprocess') -> None:
+        raise NotImplementedError("Remote scripts cannot be restarted.")
+
+    def dispose(self) -> None:
+        """
+        Disposes the script. The worker stops its subprocess.
+        """
+        if self.connection is None or self.connection.closed:
+            return
+
+        if self.requester.is_alive():
+            self.requester.stop()
+        self.requester.close()
+
+        self.connection.close()
+        self.frame_cache.invalidate(self.cache_id)
@@ -0,0 +1,185 @@
+# -*- encoding: utf-8 -*-
+
+# Yuuno - IPython + VapourSynth
+# Copyright (C) 2018 StuxCrystal (Roland Netzsch <stuxcrystal@encode.moe>)
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+from asyncio import wrap_future
+from pathlib import Path
+from concurrent.futures import Future
+
+from typing import Any, Dict, List, Sequence, Union
+
+from yuuno.clip import Clip, Frame
+from yuuno.utils import future_yield_coro, inline_resolved, gather
+from yuuno.multi_scripts.script import Script
+
+
+# Frame n is rendered by shard n % shards.
+# Spreads the load evenly, even when only a few frames are requested.
+ROUND_ROBIN = "round-robin"
+
+# Every shard renders a contiguous part of the clip.
+# Filters looking at neighbouring frames profit from the caches of their shard.
+RANGE = "range"
+
+ROUTINGS = (ROUND_ROBIN, RANGE)
+
+
+class ShardedClip(Clip):
+    """
+    An output of a sharded script.
+
+    Every shard renders the same clip, the frames are
+    requested from the shard chosen by the routing.
+    """
+
+    shards: List[Clip]
+    routing: str
+
+    def __init__(self, clip: str, shards: Sequence[Clip], routing: str):
+        super(ShardedClip, self).__init__(clip)
+        self.shards = list(shards)
+        self.routing = routing
+
+    def __len__(self):
+        return len(self.shards[0])
+
+    def shard_of(self, item: int) -> int:
+        """
+        :param item: The frame number.
+        :return: The index of the shard that renders the frame.
+        """
+        if self.routing == RANGE:
+            return item * len(self.shards) // len(self)
+        return item % len(self.shards)
+
+    def __getitem__(self, item: int) -> Future:
+        if not 0 <= item < len(self):
+            return inline_resolved(self._out_of_range)()
+        return self.shards[self.shard_of(item)][item]
+
+    @staticmethod
+    def _out_of_range():
+        raise IndexError("The clip does not have as many frames.")
+
+    async def aget(self, item: int) -> Frame:
+        """
+        Awaitable variant of clip[item] for asyncio event loops.
+        """
+        return await wrap_future(self[item])
+
+    @future_yield_coro
+    def get_frames(self, indices: Sequence[int]) -> List[Frame]:
+        """
+        Fetches multiple frames. Every shard fetches its frames at the same time.
+
+        :param indices: The frame numbers.
+        :return: A future resolving with the frames.
+        """
+        indices = list(indices)
+        for frameno in indices:
+            if not 0 <= frameno < len(self):
+                raise IndexError("The clip does not have as many frames.")
+
+        by_shard: Dict[int, List[int]] = {}
+        for frameno in indices:
+            by_shard.setdefault(self.shard_of(frameno), []).append(frameno)
+        if not by_shard:
+            return []
+
+        shards = list(by_shard)
+        results = yield gather([self.shards[shard].get_frames(by_shard[shard]) for shard in shards])
+
+        # Restore the requested order.
+        fetched = {shard: iter(frames) for shard, frames in zip(shards, results)}
+        return [next(fetched[self.shard_of(frameno)]) for frameno in indices]
+
+    async def aget_frames(self, indices: Sequence[int]) -> List[Frame]:
+        """
+        Awaitable variant of get_frames() for asyncio event loops.
+        """
+        return await wrap_future(self.get_frames(indices))
+
+
+class ShardedScript(Script):
+    """
+    Runs the same script in multiple subprocesses and
+    spreads the frame requests over them.
+
+    Filters that hold the GIL or do not scale inside a single
+    core can thus use more than one process.
+    """
+
+    shards: List[Script]
+    routing: str
+
+    def __init__(self, shards: Sequence[Script], routing: str = ROUND_ROBIN):
+        """
+        :param shards:  The scripts to run the code in.
+        :param routing: How frames are assigned to the shards. (round-robin or range)
+        """
+        if not shards:
+            raise ValueError("At least one shard is required.")
+        if routing not in ROUTINGS:
+            raise ValueError(f"Unknown routing {routing!r}.")
+        self.shards = list(shards)
+        self.routing = routing
+
+    @property
+    def alive(self) -> bool:
+        return all(shard.alive for shard in self.shards)
+
+    def initialize(self) -> None:
+        for shard in self.shards:
+            shard.initialize()
+
+    def dispose(self) -> None:
+        for shard in self.shards:
+            shard.dispose()
+
+    @future_yield_coro
+    def execute(self, code: Union[str, Path]):
+        """
+        Executes the code inside every shard.
+        """
+        results = yield gather([shard.execute(code) for shard in self.shards])
+        return results[0]
+
+    @future_yield_coro
+    def get_results(self) -> Dict[str, ShardedClip]:
+        """
+        Returns the outputs of the script.
+        """
+        results = yield gather([shard.get_results() for shard in self.shards])
+
+        outputs = {}
+        for name, clip in results[0].items():
+            shards = [result.get(name, None) for result in results]
+            if any(shard is None or len(shard) != len(clip) for shard in shards):
+                raise ValueError(f"The shards disagree about the output {name}.")
+            outputs[name] = ShardedClip(name, shards, self.routing)
+        return outputs
+
+    async def aget_results(self) -> Dict[str, ShardedClip]:
+        """
+        Awaitable variant of get_results() for asyncio event loops.
+        """
+        return await wrap_future(self.get_results())
+
+    async def aexecute(self, code: Union[str, Path]) -> Any:
+        """
+        Awaitable variant of execute() for asyncio event loops.
+        """
+        return await wrap_future(self.execute(code))
@@ -0,0 +1,298 @@
+# -*- encoding: utf-8 -*-
+
+# Yuuno - IPython + VapourSynth
+# Copyright (C) 2018 StuxCrystal (Roland Netzsch <stuxcrystal@encode.moe>)
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+Compact binary encoding of the messages exchanged with subprocesses.
+
+Every message starts with a fixed header::
+
+    kind (u8) | flags (u8) | id (u64)
+
+The requests and responses of the frame commands are sent as packed
+structs. Everything else (including failed responses) is pickled.
+"""
+import pickle
+import struct
+from functools import lru_cache
+from typing import Any, List, Optional, Union
+
+from yuuno.clip import Size, RawFormat
+from yuuno.multi_scripts.subprocess import proxy
+from yuuno.multi_scripts.subprocess.framebuffer import OutOfBandFrame
+
+
+KIND_PICKLE = 0
+KIND_FRAME_REQUEST = 1
+KIND_BATCH_REQUEST = 2
+KIND_INT_RESPONSE = 3
+KIND_FRAME_RESPONSE = 4
+KIND_BATCH_RESPONSE = 5
+
+FLAG_PROTECTED = 1
+FLAG_BUFFER = 2
+
+HEADER = struct.Struct("!BBQ")
+
+# Commands sharing the layout of a frame request.
+FRAME_COMMANDS = [
+    'script/subprocess/results/frame',
+    'script/subprocess/results/raw',
+]
+BATCH_COMMAND = 'script/subprocess/results/raw_batch'
+
+# command, frame, slot, capacity, len(id), len(buffer)
+_FRAME_REQUEST = struct.Struct("!BqIQHH")
+# slot, capacity, len(id), len(buffer), len(frames)
+_BATCH_REQUEST = struct.Struct("!IQHHI")
+_INT = struct.Struct("!q")
+# width, height, bits_per_sample, num_planes, family, sample_type, subsampling_h, subsampling_w
+_META = struct.Struct("!IIBBBBBB")
+# kind, offset, length, len(name)
+_PAYLOAD = struct.Struct("!BQQH")
+
+# meta, then payload
+_BATCH_ENTRY_FORMAT = "IIBBBBBBBQQH"
+_BATCH_ENTRY = struct.Struct("!" + _BATCH_ENTRY_FORMAT)
+
+PAYLOAD_SLOT = 0
+PAYLOAD_OUT_OF_BAND = 1
+
+_FRAME_REQUEST_KEYS = {"id", "frame", "slot", "buffer", "capacity"}
+_BATCH_REQUEST_KEYS = {"id", "frames", "slot", "buffer", "capacity"}
+
+
+class Unencodable(Exception):
+    pass
+
+
+def _is_int(value: Any) -> bool:
+    return type(value) is int and -2**63 <= value < 2**63
+
+
+def _encode_str(value: Any) -> bytes:
+    if type(value) is not str:
+        raise Unencodable(value)
+    data = value.encode("utf-8")
+    if len(data) > 0xFFFF:
+        raise Unencodable(value)
+    return data
+
+
+def _encode_payload(value: Union[int, OutOfBandFrame]) -> bytes:
+    if type(value) is OutOfBandFrame:
+        name = _encode_str(value.name)
+        return _PAYLOAD.pack(PAYLOAD_OUT_OF_BAND, 0, value.length, len(name)) + name
+
+    if not _is_int(value) or value < 0:
+        raise Unencodable(value)
+    return _PAYLOAD.pack(PAYLOAD_SLOT, 0, value, 0)
+
+
+def _decode_payload(data: memoryview, pos: int):
+    kind, _, length, name_length = _PAYLOAD.unpack_from(data, pos)
+    pos += _PAYLOAD.size
+    if kind == PAYLOAD_OUT_OF_BAND:
+        name = bytes(data[pos:pos+name_length]).decode("utf-8")
+        return OutOfBandFrame(name, length), pos + name_length
+    return length, pos
+
+
+# The frames of a clip usually share their size and format.
+@lru_cache(maxsize=64)
+def _meta_of(width: int, height: int, bits: int, planes: int, family: int, sample_type: int, ssh: int, ssw: int):
+    format = RawFormat(bits, planes, RawFormat.ColorFamily(family), RawFormat.SampleType(sample_type), ssh, ssw)
+    return Size(width, height), format
+
+
+def _encode_meta(size: Any, format: Any) -> bytes:
+    if type(size) is not Size or type(format) is not RawFormat:
+        raise Unencodable((size, format))
+    return _META.pack(*size, *format)
+
+
+def _decode_meta(data: memoryview, pos: int):
+    size, format = _meta_of(*_META.unpack_from(data, pos))
+    return size, format, pos + _META.size
+
+
+def _encode_location(data: dict, keys: set):
+    if type(data) is not dict or not {"id", "slot"} <= data.keys() <= keys:
+        raise Unencodable(data)
+
+    buffer: Optional[str] = data.get("buffer", None)
+    capacity = data.get("capacity", 0)
+    if not _is_int(data["slot"]) or not _is_int(capacity) or data["slot"] < 0 or capacity < 0:
+        raise Unencodable(data)
+
+    return _encode_str(data["id"]), (b"" if buffer is None else _encode_str(buffer)), buffer is not None
+
+
+def _encode_request(obj: 'proxy.Request') -> bytes:
+    flags = FLAG_PROTECTED if obj.protect else 0
+
+    if obj.type in FRAME_COMMANDS:
+        id, buffer, has_buffer = _encode_location(obj.data, _FRAME_REQUEST_KEYS)
+        if not _is_int(obj.data.get("frame", None)):
+            raise Unencodable(obj.data)
+        return b"".join((
+            HEADER.pack(KIND_FRAME_REQUEST, flags | (FLAG_BUFFER if has_buffer else 0), obj.id),
+            _FRAME_REQUEST.pack(
+                FRAME_COMMANDS.index(obj.type), obj.data["frame"], obj.data["slot"],
+                obj.data.get("capacity", 0), len(id), len(buffer)
+            ),
+            id, buffer
+        ))
+
+    if obj.type == BATCH_COMMAND:
+        id, buffer, has_buffer = _encode_location(obj.data, _BATCH_REQUEST_KEYS)
+        frames = obj.data.get("frames", None)
+        if type(frames) is not list or not all(_is_int(f) for f in frames):
+            raise Unencodable(obj.data)
+        return b"".join((
+            HEADER.pack(KIND_BATCH_REQUEST, flags | (FLAG_BUFFER if has_buffer else 0), obj.id),
+            _BATCH_REQUEST.pack(obj.data["slot"], obj.data.get("capacity", 0), len(id), len(buffer), len(frames)),
+            id, buffer,
+            struct.pack(f"!{len(frames)}q", *frames)
+        ))
+
+    raise Unencodable(obj)
+
+
+def _encode_response(obj: 'proxy.Response') -> bytes:
+    flags = FLAG_PROTECTED if obj.protected else 0
+    data = obj.data
+
+    if _is_int(data):
+        return HEADER.pack(KIND_INT_RESPONSE, flags, obj.id) + _INT.pack(data)
+
+    if type(data) is tuple and len(data) == 3:
+        return b"".join((
+            HEADER.pack(KIND_FRAME_RESPONSE, flags, obj.id),
+            _encode_meta(data[0], data[1]),
+            _encode_payload(data[2])
+        ))
+
+    if type(data) is list and data:
+        # Fixed-size entries packed at once. The names of out-of-band frames follow them.
+        values = []
+        names: List[bytes] = []
+        for entry in data:
+            if type(entry) is not tuple or len(entry) != 3:
+                raise Unencodable(data)
+            size, format, payload = entry
+            if type(size) is not Size or type(format) is not RawFormat:
+                raise Unencodable(data)
+            values.extend(size)
+            values.extend(format)
+
+            if type(payload) is OutOfBandFrame:
+                name = _encode_str(payload.name)
+                values.extend((PAYLOAD_OUT_OF_BAND, 0, payload.length, len(name)))
+                names.append(name)
+            elif type(payload) is tuple and len(payload) == 2 and all(_is_int(v) and v >= 0 for v in payload):
+                values.extend((PAYLOAD_SLOT, payload[0], payload[1], 0))
+            else:
+                raise Unencodable(data)
+
+        return b"".join((
+            HEADER.pack(KIND_BATCH_RESPONSE, flags, obj.id),
+            _INT.pack(len(data)),
+            struct.pack("!" + _BATCH_ENTRY_FORMAT * len(data), *values),
+            *names
+        ))
+
+    raise Unencodable(obj)
+
+
+def dumps(obj: Any) -> bytes:
+    """
+    Encodes a message.
+
+    :param obj: The message to encode.
+    :return: The encoded message.
+    """
+    try:
+        if type(obj) is proxy.Request:
+            return _encode_request(obj)
+        if type(obj) is proxy.Response and obj.error is None:
+            return _encode_response(obj)
+    except Unencodable:
+        pass
+    return HEADER.pack(KIND_PICKLE, 0, 0) + pickle.dumps(obj, protocol=pickle.HIGHEST_PROTOCOL)
+
+
+def _decode_location(data: memoryview, pos: int, flags: int, id_length: int, buffer_length: int, capacity: int, slot: int):
+    result = {"id": bytes(data[pos:pos+id_length]).decode("utf-8"), "slot": slot}
+    pos += id_length
+    if flags & FLAG_BUFFER:
+        result["buffer"] = bytes(data[pos:pos+buffer_length]).decode("utf-8")
+        result["capacity"] = capacity
+    return result, pos + buffer_length
+
+
+def loads(data: bytes) -> Any:
+    """
+    Decodes a message.
+
+    :param data: The encoded message.
+    :return: The message.
+    """
+    data = memoryview(data)
+    kind, flags, id = HEADER.unpack_from(data, 0)
+    pos = HEADER.size
+    protected = bool(flags & FLAG_PROTECTED)
+
+    if kind == KIND_PICKLE:
+        return pickle.loads(data[pos:])
+
+    if kind == KIND_FRAME_REQUEST:
+        command, frame, slot, capacity, id_length, buffer_length = _FRAME_REQUEST.unpack_from(data, pos)
+        body, _ = _decode_location(data, pos + _FRAME_REQUEST.size, flags, id_length, buffer_length, capacity, slot)
+        body["frame"] = frame
+        return proxy.Request(id=id, type=FRAME_COMMANDS[command], data=body, protect=protected)
+
+    if kind == KIND_BATCH_REQUEST:
+        slot, capacity, id_length, buffer_length, count = _BATCH_REQUEST.unpack_from(data, pos)
+        body, pos = _decode_location(data, pos + _BATCH_REQUEST.size, flags, id_length, buffer_length, capacity, slot)
+        body["frames"] = list(struct.unpack_from(f"!{count}q", data, pos))
+        return proxy.Request(id=id, type=BATCH_COMMAND, data=body, protect=protected)
+
+    if kind == KIND_INT_RESPONSE:
+        return proxy.Response(id=id, data=_INT.unpack_from(data, pos)[0], protected=protected)
+
+    if kind == KIND_FRAME_RESPONSE:
+        size, format, pos = _decode_meta(data, pos)
+        payload, _ = _decode_payload(data, pos)
+        return proxy.Response(id=id, data=(size, format, payload), protected=protected)
+
+    if kind == KIND_BATCH_RESPONSE:
+        count = _INT.unpack_from(data, pos)[0]
+        pos += _INT.size
+        end = pos + count * _BATCH_ENTRY.size
+
+        entries = []
+        for *meta, payload_kind, offset, length, name_length in _BATCH_ENTRY.iter_unpack(data[pos:end]):
+            size, format = _meta_of(*meta)
+            if payload_kind == PAYLOAD_OUT_OF_BAND:
+                payload = OutOfBandFrame(bytes(data[end:end+name_length]).decode("utf-8"), length)
+                end += name_length
+            else:
+                payload = (offset, length)
+            entries.append((size, format, payload))
+        return proxy.Response(id=id, data=entries, protected=protected)
+
+    raise ValueError(f"Unknown message kind {kind}.")
@@ -1 +1,4 @@
 from yuuno.output.pil2png import YuunoImageOutput
+from yuuno.output.animated import YuunoAnimatedOutput
+from yuuno.output.tiled import YuunoTiledOutput
+from yuuno.output.delta import YuunoDeltaOutput
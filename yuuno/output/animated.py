@@ -0,0 +1,197 @@
+# -*- encoding: utf-8 -*-
+
+# Yuuno - IPython + VapourSynth
+# Copyright (C) 2017,2018 StuxCrystal (Roland Netzsch <stuxcrystal@encode.moe>)
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+import struct
+from io import BytesIO
+from typing import BinaryIO, Iterator, Optional
+
+from traitlets import CInt, CaselessStrEnum, Any, Instance
+from traitlets import default
+from traitlets.config import Configurable
+from PIL.Image import Image
+
+from yuuno.clip import Clip, Size, GRAY8, RGB24, RGBA32, iter_frames
+from yuuno.output import raw2png
+from yuuno.output.pil2png import YuunoImageOutput
+
+
+PIL_FORMATS = {
+    "L": GRAY8,
+    "RGB": RGB24,
+    "RGBA": RGBA32
+}
+
+
+def _gif_image_block(im: Image, duration: int) -> bytes:
+    """
+    Encodes the image as a single GIF-file and extracts the image-block.
+
+    The global color table of the file is turned into a local
+    color table so the block can be appended to any animation.
+    """
+    f = BytesIO()
+    im.save(f, format="GIF", duration=duration)
+    data = f.getvalue()
+
+    packed = data[10]
+    pos = 13
+    table = b""
+    if packed & 0x80:
+        table_size = 3 << ((packed & 0x07) + 1)
+        table = data[pos:pos+table_size]
+        pos += table_size
+
+    result = bytearray()
+    while data[pos] == 0x21:
+        # Extension blocks: Copy the Graphic Control Extension.
+        end = pos + 2
+        while data[end] != 0:
+            end += data[end] + 1
+        end += 1
+        if data[pos+1] == 0xF9:
+            result += data[pos:end]
+        pos = end
+
+    if data[pos] != 0x2C or data[-1] != 0x3B:
+        raise ValueError("PIL wrote an unexpected GIF-structure.")
+
+    descriptor = bytearray(data[pos:pos+10])
+    pos += 10
+    if table and not descriptor[9] & 0x80:
+        descriptor[9] |= 0x80 | (packed & 0x07)
+        descriptor += table
+
+    result += descriptor
+    result += data[pos:-1]
+    return bytes(result)
+
+
+class YuunoAnimatedOutput(Configurable):
+    """
+    Defines an output for animated PNG- and GIF-files.
+
+    Frames are fetched concurrently and encoded one after another
+    directly into the output. Only the prefetched frames are held
+    in memory.
+    """
+
+    ################
+    # Settings
+    yuuno = Any(help="Reference to the current Yuuno instance.")
+    image_output: YuunoImageOutput = Instance(YuunoImageOutput, help="The output whose compression and color settings are used.")
+
+    format: str = CaselessStrEnum(["apng", "gif"], default_value="apng", help="The format of the animation.", config=True)
+    duration: int = CInt(42, help="How long a single frame is shown in milliseconds.", config=True)
+    loop: int = CInt(0, help="How often the animation is played. 0 means forever.", config=True)
+    prefetch: int = CInt(4, help="How many frames are requested ahead of the encoder.", config=True)
+
+    @default("image_output")
+    def _default_image_output(self):
+        if self.yuuno is not None:
+            return self.yuuno.output
+        return YuunoImageOutput()
+
+    def _iter_images(self, clip: Clip, frames: range) -> Iterator[Image]:
+        for frame in iter_frames(clip, frames, prefetch=self.prefetch):
+            if not isinstance(frame, Image):
+                frame = frame.to_pil()
+            yield frame
+
+    def _write_apng(self, fp: BinaryIO, images: Iterator[Image], count: int) -> None:
+        sequence = 0
+        mode: Optional[str] = None
+        size: Optional[Size] = None
+
+        for im in images:
+            if mode is None:
+                mode = im.mode if im.mode in PIL_FORMATS else "RGB"
+                size = Size(*im.size)
+                raw2png.write_header(fp, size, PIL_FORMATS[mode], self.image_output._icc_profile_data())
+                raw2png.write_chunk(fp, b"acTL", struct.pack("!II", count, self.loop))
+
+            if im.size != size:
+                raise ValueError("All frames of an animation must have the same size.")
+            if im.mode != mode:
+                im = im.convert(mode)
+
+            raw2png.write_chunk(fp, b"fcTL", struct.pack(
+                "!IIIIIHHBB", sequence, size.width, size.height, 0, 0, self.duration, 1000, 0, 0
+            ))
+            first = sequence == 0
+            sequence += 1
+
+            blocks = raw2png.iter_filtered(im.tobytes(), size, len(mode), self.image_output.raw_filter)
+            for data in raw2png.iter_compressed(blocks, self.image_output.zlib_compression):
+                if first:
+                    raw2png.write_chunk(fp, b"IDAT", data)
+                else:
+                    raw2png.write_chunk(fp, b"fdAT", struct.pack("!I", sequence) + data)
+                    sequence += 1
+
+        raw2png.write_chunk(fp, b"IEND")
+
+    def _write_gif(self, fp: BinaryIO, images: Iterator[Image]) -> None:
+        size: Optional[Size] = None
+
+        for im in images:
+            if size is None:
+                size = Size(*im.size)
+                fp.write(b"GIF89a" + struct.pack("<HHBBB", size.width, size.height, 0, 0, 0))
+                fp.write(b"!\xFF\x0BNETSCAPE2.0\x03\x01" + struct.pack("<H", self.loop) + b"\0")
+
+            if im.size != size:
+                raise ValueError("All frames of an animation must have the same size.")
+            fp.write(_gif_image_block(im, self.duration))
+
+        fp.write(b";")
+
+    def write_to(self, clip: Clip, fp: BinaryIO, start: int = 0, end: Optional[int] = None, step: int = 1) -> None:
+        """
+        Renders the given range of the clip as an animation
+        and writes it into the file-like object.
+
+        :param clip:  The clip to render.
+        :param fp:    A writable binary file-like object.
+        :param start: The first frame.
+        :param end:   The frame after the last frame. Defaults to the end of the clip.
+        :param step:  Only render every n-th frame.
+        """
+        if end is None or end > len(clip):
+            end = len(clip)
+        frames = range(start, end, step)
+        if not frames:
+            raise ValueError("The range does not contain any frames.")
+
+        images = self._iter_images(clip, frames)
+        if self.format == "gif":
+            self._write_gif(fp, images)
+        else:
+            self._write_apng(fp, images, len(frames))
+
+    def bytes_of(self, clip: Clip, start: int = 0, end: Optional[int] = None, step: int = 1) -> bytes:
+        """
+        Renders the given range of the clip as an animation.
+
+        :param clip:  The clip to render.
+        :param start: The first frame.
+        :param end:   The frame after the last frame. Defaults to the end of the clip.
+        :param step:  Only render every n-th frame.
+        :return: A bytes-object containing the animation.
+        """
+        f = BytesIO()
+        self.write_to(clip, f, start, end, step)
+        return f.getvalue()
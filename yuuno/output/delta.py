@@ -0,0 +1,235 @@
+# -*- encoding: utf-8 -*-
+
+# Yuuno - IPython + VapourSynth
+# Copyright (C) 2017,2018 StuxCrystal (Roland Netzsch <stuxcrystal@encode.moe>)
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+import zlib
+from io import BytesIO
+from functools import reduce
+from typing import List, NamedTuple, Optional, Sequence, Tuple, Union
+
+from traitlets import CInt, CFloat, Any, Instance
+from traitlets import default
+from traitlets.config import Configurable
+from PIL import Image as PILImage, ImageChops
+from PIL.Image import Image
+
+from yuuno.clip import Frame, Size
+from yuuno.output.pil2png import YuunoImageOutput
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+
+class Rect(NamedTuple):
+    x: int
+    y: int
+    width: int
+    height: int
+
+
+class FrameDelta(NamedTuple):
+    """
+    The difference between two frames.
+
+    kind is one of:
+      "unchanged" - Nothing changed.
+      "rects"     - regions contains PNG-files of the changed rectangles.
+      "residual"  - payload contains the zlib-compressed per-byte
+                    difference (modulo 256) to the previous frame.
+      "full"      - regions contains a single PNG-file with the whole frame.
+    """
+    kind: str
+    size: Size
+    mode: str
+    regions: Sequence[Tuple[Rect, bytes]] = ()
+    payload: Optional[bytes] = None
+
+
+def _merge_blocks(dirty: List[List[bool]], block_size: int, size: Size) -> List[Rect]:
+    # Merge horizontal runs of dirty blocks first and then extend
+    # rectangles downwards while the next row has the same run.
+    open_rects = {}
+    rects = []
+    for by, row in enumerate(dirty):
+        runs = []
+        bx = 0
+        while bx < len(row):
+            if not row[bx]:
+                bx += 1
+                continue
+            start = bx
+            while bx < len(row) and row[bx]:
+                bx += 1
+            runs.append((start, bx))
+
+        next_open = {}
+        for run in runs:
+            if run in open_rects:
+                x, y, w, h = open_rects.pop(run)
+                next_open[run] = (x, y, w, h + 1)
+            else:
+                next_open[run] = (run[0], by, run[1] - run[0], 1)
+        rects.extend(open_rects.values())
+        open_rects = next_open
+    rects.extend(open_rects.values())
+
+    result = []
+    for x, y, w, h in sorted(rects, key=lambda r: (r[1], r[0])):
+        x, y = x * block_size, y * block_size
+        result.append(Rect(
+            x, y,
+            min(w * block_size, size.width - x),
+            min(h * block_size, size.height - y)
+        ))
+    return result
+
+
+def apply_delta(previous: Optional[Image], delta: FrameDelta) -> Image:
+    """
+    Reconstructs the frame from the previous frame and the delta.
+
+    :param previous: The frame the delta was computed against.
+    :param delta:    The delta.
+    :return: The new frame.
+    """
+    if delta.kind == "full":
+        return PILImage.open(BytesIO(delta.regions[0][1])).convert(delta.mode)
+
+    if delta.kind == "unchanged":
+        return previous.copy()
+
+    if delta.kind == "residual":
+        residual = PILImage.frombytes(delta.mode, delta.size, zlib.decompress(delta.payload))
+        return ImageChops.add_modulo(previous, residual)
+
+    result = previous.copy()
+    for rect, data in delta.regions:
+        result.paste(PILImage.open(BytesIO(data)).convert(delta.mode), (rect.x, rect.y))
+    return result
+
+
+class YuunoDeltaOutput(Configurable):
+    """
+    Encodes only what changed compared to the previously sent frame.
+
+    This is made for viewers that step through a clip frame by frame.
+    On mostly static content only a fraction of the frame is transferred.
+    """
+
+    ################
+    # Settings
+    yuuno = Any(help="Reference to the current Yuuno instance.")
+    image_output: YuunoImageOutput = Instance(YuunoImageOutput, help="The output used to encode the changed regions.")
+
+    block_size: int = CInt(64, help="The granularity in pixels at which changed regions are detected.", config=True)
+    max_rect_coverage: float = CFloat(0.3, help="Send a residual instead of rectangles if more than this fraction of the frame changed.", config=True)
+    max_residual_ratio: float = CFloat(0.25, help="Send the full frame if the compressed residual is larger than this fraction of the raw frame.", config=True)
+
+    @default("image_output")
+    def _default_image_output(self):
+        if self.yuuno is not None:
+            return self.yuuno.output
+        return YuunoImageOutput()
+
+    @staticmethod
+    def _to_image(im: Union[Frame, Image]) -> Image:
+        if not isinstance(im, Image):
+            im = im.to_pil()
+        if im.mode not in ("RGB", "RGBA", "L"):
+            im = im.convert("RGB")
+        return im
+
+    def _full(self, im: Image) -> FrameDelta:
+        size = Size(*im.size)
+        return FrameDelta(
+            kind="full", size=size, mode=im.mode,
+            regions=[(Rect(0, 0, size.width, size.height), self.image_output.bytes_of(im))]
+        )
+
+    def _dirty_blocks(self, im: Image, previous: Image) -> Optional[List[List[bool]]]:
+        # Returns which blocks changed or None if nothing changed.
+        bs = max(self.block_size, 1)
+        width, height = im.size
+        rows, cols = (height + bs - 1) // bs, (width + bs - 1) // bs
+
+        if numpy is not None:
+            changed = numpy.asarray(im) != numpy.asarray(previous)
+            if changed.ndim == 3:
+                changed = changed.any(axis=2)
+            if not changed.any():
+                return None
+
+            # Pad to whole blocks, then reduce every block at once.
+            padded = numpy.zeros((rows * bs, cols * bs), dtype=bool)
+            padded[:height, :width] = changed
+            return padded.reshape(rows, bs, cols, bs).any(axis=(1, 3)).tolist()
+
+        # The maximum difference of all bands, so getbbox() sees every change.
+        diff = reduce(ImageChops.lighter, ImageChops.difference(im, previous).split())
+        bbox = diff.getbbox()
+        if bbox is None:
+            return None
+
+        left, top, right, bottom = bbox
+        dirty = [[False] * cols for _ in range(rows)]
+        for by in range(top // bs, (bottom + bs - 1) // bs):
+            for bx in range(left // bs, (right + bs - 1) // bs):
+                box = (bx*bs, by*bs, min((bx+1)*bs, width), min((by+1)*bs, height))
+                dirty[by][bx] = diff.crop(box).getbbox() is not None
+        return dirty
+
+    def delta_of(self, im: Union[Frame, Image], previous: Union[Frame, Image, None]) -> FrameDelta:
+        """
+        Encodes the frame relative to the previously sent frame.
+
+        :param im:       The frame to send.
+        :param previous: The frame that has been sent before. None sends the full frame.
+        :return: The delta to send.
+        """
+        im = self._to_image(im)
+        if previous is None:
+            return self._full(im)
+
+        previous = self._to_image(previous)
+        if previous.size != im.size or previous.mode != im.mode:
+            return self._full(im)
+
+        size = Size(*im.size)
+
+        dirty = self._dirty_blocks(im, previous)
+        if dirty is None:
+            return FrameDelta(kind="unchanged", size=size, mode=im.mode)
+
+        rects = _merge_blocks(dirty, max(self.block_size, 1), size)
+        coverage = sum(r.width * r.height for r in rects) / (size.width * size.height)
+
+        if coverage <= self.max_rect_coverage:
+            return FrameDelta(
+                kind="rects", size=size, mode=im.mode,
+                regions=[
+                    (r, self.image_output.bytes_of(im.crop((r.x, r.y, r.x+r.width, r.y+r.height))))
+                    for r in rects
+                ]
+            )
+
+        raw = ImageChops.subtract_modulo(im, previous).tobytes()
+        payload = zlib.compress(raw, max(self.image_output.zlib_compression, 1))
+        if len(payload) > len(raw) * self.max_residual_ratio:
+            return self._full(im)
+
+        return FrameDelta(kind="residual", size=size, mode=im.mode, payload=payload)
@@ -17,15 +17,54 @@
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
 from io import BytesIO
+from queue import Queue
+from threading import Thread
+from typing import BinaryIO, Iterator, Tuple, Union
 
-from traitlets import Unicode, CInt, Any
+from traitlets import Unicode, CInt, CBool, CaselessStrEnum, Any
 from traitlets.config import Configurable
 from PIL.Image import Image
 
 from yuuno.clip import Frame
+from yuuno.output import raw2png
 from yuuno.output.srgb_png import srgb
 
 
+class _ChunkedWriter(object):
+    """
+    File-like object that forwards everything written into it
+    to a bounded queue in chunks of the given size.
+    """
+
+    def __init__(self, queue: Queue, chunk_size: int):
+        self.queue = queue
+        self.chunk_size = chunk_size
+        self.buffer = bytearray()
+        self.closed = False
+
+    def send(self, item) -> None:
+        # The consumer sets closed before draining the queue, so at most
+        # one item can be put after the drain which keeps put() from blocking.
+        if self.closed:
+            raise IOError("The consumer stopped reading the image.")
+        self.queue.put(item)
+
+    def write(self, data: bytes) -> int:
+        self.buffer += data
+        while len(self.buffer) >= self.chunk_size:
+            self.send(bytes(self.buffer[:self.chunk_size]))
+            del self.buffer[:self.chunk_size]
+        return len(data)
+
+    def flush(self) -> None:
+        pass
+
+    def finish(self) -> None:
+        if self.buffer:
+            self.send(bytes(self.buffer))
+            self.buffer = bytearray()
+
+
 class YuunoImageOutput(Configurable):
     """
     Defines an output for PNG-files
@@ -38,14 +77,12 @@ class YuunoImageOutput(Configurable):
     zlib_compression: int = CInt(6, help="0=No compression\n1=Fastest\n9=Slowest", config=True)
     icc_profile: str = Unicode("sRGB", help="Specify the path to an ICC-Profile (Defaults to sRGB).", allow_none=True, config=True)
 
-    def bytes_of(self, im: Frame) -> bytes:
-        """
-        Converts the frame into a bytes-object containing
-        the frame as a PNG-file.
+    chunk_size: int = CInt(64*1024, help="Size of the chunks returned by iter_chunks.", config=True)
+    chunk_queue_size: int = CInt(16, help="How many chunks may be encoded ahead of the consumer.", config=True)
+    raw_encoding: bool = CBool(False, help="Encode 8bit RGB and GRAY frames directly from their planar raw data instead of building a PIL-Image first.", config=True)
+    raw_filter: str = CaselessStrEnum(list(raw2png.FILTERS), default_value="sub", help="PNG-filter used by the raw encoder. 'adaptive' compresses best but is the slowest.", config=True)
 
-        :param im: the frame to convert.
-        :return: A bytes-object containing the image.
-        """
+    def _prepare(self, im: Union[Frame, Image]) -> Tuple[Image, dict]:
         if not isinstance(im, Image):
             im = im.to_pil()
         if im.mode not in ("RGBA", "RGB", "1", "L", "P"):
@@ -57,11 +94,95 @@ class YuunoImageOutput(Configurable):
         }
         if self.icc_profile is not None:
             if self.icc_profile != "sRGB":
-                with open(self.icc_profile, "rb") as f:
-                    settings["icc_profile"] = f.read()
+                settings["icc_profile"] = self._icc_profile_data()
             else:
                 settings.update(srgb())
 
+        return im, settings
+
+    def _icc_profile_data(self) -> Union[str, bytes, None]:
+        if self.icc_profile is None or self.icc_profile == "sRGB":
+            return self.icc_profile
+        with open(self.icc_profile, "rb") as f:
+            return f.read()
+
+    def _write_raw(self, im: Frame, fp: BinaryIO) -> bool:
+        format = im.format()
+        if not raw2png.is_supported(format):
+            return False
+
+        raw2png.write_png(
+            fp, im.size(), format, im.to_raw(),
+            compress_level=self.zlib_compression,
+            icc_profile=self._icc_profile_data(),
+            filter=self.raw_filter
+        )
+        return True
+
+    def write_to(self, im: Union[Frame, Image], fp: BinaryIO) -> None:
+        """
+        Encodes the frame as a PNG-file and writes it
+        directly into the given file-like object.
+
+        :param im: the frame to convert.
+        :param fp: A writable binary file-like object.
+        """
+        if self.raw_encoding and not isinstance(im, Image):
+            if self._write_raw(im, fp):
+                return
+
+        im, settings = self._prepare(im)
+        im.save(fp, **settings)
+
+    def iter_chunks(self, im: Union[Frame, Image]) -> Iterator[bytes]:
+        """
+        Encodes the frame as a PNG-file and yields the file
+        in chunks while it is still being encoded.
+
+        The encoder runs in a background thread and is at most
+        chunk_queue_size chunks ahead of the consumer.
+
+        :param im: the frame to convert.
+        :return: An iterator over the chunks of the PNG-file.
+        """
+        queue = Queue(maxsize=max(self.chunk_queue_size, 1))
+        writer = _ChunkedWriter(queue, max(self.chunk_size, 1))
+        done = object()
+
+        def _encode():
+            try:
+                self.write_to(im, writer)
+                writer.finish()
+                writer.send(done)
+            except Exception as e:
+                try:
+                    writer.send(e)
+                except IOError:
+                    pass
+
+        Thread(target=_encode, daemon=True).start()
+        try:
+            while True:
+                chunk = queue.get()
+                if chunk is done:
+                    return
+                if isinstance(chunk, Exception):
+                    raise chunk
+                yield chunk
+        finally:
+            # Unblock the encoder if the consumer stops early.
+            writer.closed = True
+            while not queue.empty():
+                queue.get_nowait()
+
+    def bytes_of(self, im: Union[Frame, Image]) -> bytes:
+        """
+        Converts the frame into a bytes-object containing
+        the frame as a PNG-file.
+
+        :param im: the frame to convert.
+        :return: A bytes-object containing the image.
+        """
         f = BytesIO()
-        im.save(f, **settings)
+        self.write_to(im, f)
         return f.getvalue()
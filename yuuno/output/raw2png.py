@@ -0,0 +1,267 @@
+# -*- encoding: utf-8 -*-
+
+# Yuuno - IPython + VapourSynth
+# Copyright (C) 2017,2018 StuxCrystal (Roland Netzsch <stuxcrystal@encode.moe>)
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+import zlib
+import struct
+from typing import BinaryIO, Iterator, Optional, Union
+
+from yuuno.clip import RawFormat, Size
+from yuuno.output.srgb_png import GAMA_SRGB, CHRM_SRGB, SRGB_INTENT
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+
+PNG_MAGIC = b"\x89PNG\r\n\x1a\n"
+
+# Color types as defined by the PNG specification.
+COLOR_TYPES = {1: 0, 3: 2, 4: 6}
+
+# Filter-types as defined by the PNG specification.
+FILTER_NONE = 0
+FILTER_SUB = 1
+FILTER_UP = 2
+FILTERS = {"none": FILTER_NONE, "sub": FILTER_SUB, "up": FILTER_UP, "adaptive": None}
+
+# Amount of scanline-bytes that are filtered at once.
+# Blocks that stay in the CPU-cache are considerably faster to filter
+# and bound the memory required for very large frames.
+BYTES_PER_BLOCK = 64*1024
+
+
+def is_supported(format: RawFormat) -> bool:
+    """
+    Checks if the raw-format can be encoded without going through PIL.
+
+    :param format: The raw-format of the frame.
+    :return: True if the frame can be encoded directly.
+    """
+    return (
+        format.bits_per_sample == 8
+        and format.sample_type == RawFormat.SampleType.INTEGER
+        and format.family in (RawFormat.ColorFamily.RGB, RawFormat.ColorFamily.GREY)
+        and format.num_planes in COLOR_TYPES
+        and format.subsampling_w == 0
+        and format.subsampling_h == 0
+    )
+
+
+def write_chunk(fp: BinaryIO, cid: bytes, data: bytes = b"") -> None:
+    """
+    Writes a single PNG-chunk into the file.
+    """
+    fp.write(struct.pack("!I", len(data)))
+    fp.write(cid)
+    fp.write(data)
+    fp.write(struct.pack("!I", zlib.crc32(data, zlib.crc32(cid)) & 0xFFFFFFFF))
+
+
+def write_header(fp: BinaryIO, size: Size, format: RawFormat, icc_profile: Union[str, bytes, None] = "sRGB") -> None:
+    """
+    Writes the signature, the IHDR-chunk and the color information.
+
+    :param icc_profile: "sRGB" to emit the sRGB-chunks, the data of an ICC-Profile or None.
+    """
+    fp.write(PNG_MAGIC)
+    write_chunk(fp, b"IHDR", struct.pack(
+        "!IIBBBBB", size.width, size.height, 8, COLOR_TYPES[format.num_planes], 0, 0, 0
+    ))
+
+    if icc_profile == "sRGB":
+        write_chunk(fp, b"sRGB", SRGB_INTENT)
+        write_chunk(fp, b"gAMA", GAMA_SRGB)
+        write_chunk(fp, b"cHRM", CHRM_SRGB)
+    elif icc_profile is not None:
+        write_chunk(fp, b"iCCP", b"ICC Profile\0\0" + zlib.compress(icc_profile))
+
+
+def interleave(raw: bytes, size: Size, format: RawFormat) -> bytes:
+    """
+    Converts planar data into interleaved pixels.
+
+    :param raw:    The planar data as returned by Frame.to_raw()
+    :param size:   The size of the frame.
+    :param format: The raw-format of the frame.
+    :return: Interleaved pixel data.
+    """
+    planes = format.num_planes
+    plane_size = size.width * size.height
+    if planes == 1:
+        return bytes(raw[:plane_size])
+
+    raw = memoryview(raw)
+    result = bytearray(plane_size * planes)
+    for i in range(planes):
+        result[i::planes] = raw[i*plane_size:(i+1)*plane_size]
+    return bytes(result)
+
+
+def _filter_block_python(data: memoryview, stride: int, rows: int) -> bytes:
+    # Filter type 0 (None) on every scanline.
+    return b"".join(
+        b"\0" + bytes(data[row*stride:(row+1)*stride])
+        for row in range(rows)
+    )
+
+
+def _filter_block_fixed(data: memoryview, stride: int, rows: int, bpp: int, previous: Optional[memoryview], filter: int) -> bytes:
+    cur = numpy.frombuffer(data, dtype=numpy.uint8, count=rows*stride).reshape(rows, stride)
+
+    result = numpy.empty((rows, stride+1), dtype=numpy.uint8)
+    result[:, 0] = filter
+    if filter == FILTER_SUB:
+        result[:, 1:bpp+1] = cur[:, :bpp]
+        numpy.subtract(cur[:, bpp:], cur[:, :-bpp], out=result[:, bpp+1:])
+    elif filter == FILTER_UP:
+        numpy.subtract(cur[1:], cur[:-1], out=result[1:, 1:])
+        if previous is None:
+            result[0, 1:] = cur[0]
+        else:
+            numpy.subtract(cur[0], numpy.frombuffer(previous, dtype=numpy.uint8), out=result[0, 1:])
+    else:
+        result[:, 1:] = cur
+    return result.tobytes()
+
+
+def _filter_block_adaptive(data: memoryview, stride: int, rows: int, bpp: int, previous: Optional[memoryview]) -> bytes:
+    cur = numpy.frombuffer(data, dtype=numpy.uint8, count=rows*stride).reshape(rows, stride)
+
+    up = numpy.empty_like(cur)
+    up[1:] = cur[:-1]
+    if previous is None:
+        up[0] = 0
+    else:
+        up[0] = numpy.frombuffer(previous, dtype=numpy.uint8)
+
+    left = numpy.zeros_like(cur)
+    left[:, bpp:] = cur[:, :-bpp]
+    up_left = numpy.zeros_like(cur)
+    up_left[:, bpp:] = up[:, :-bpp]
+
+    # None, Sub, Up, Average, Paeth. uint8-arithmetic wraps around as required.
+    candidates = numpy.empty((5, rows, stride), dtype=numpy.uint8)
+    candidates[0] = cur
+    numpy.subtract(cur, left, out=candidates[1])
+    numpy.subtract(cur, up, out=candidates[2])
+
+    left16, up16, up_left16 = left.astype(numpy.int16), up.astype(numpy.int16), up_left.astype(numpy.int16)
+    numpy.subtract(cur, ((left16 + up16) >> 1).astype(numpy.uint8), out=candidates[3])
+
+    pa = numpy.abs(up16 - up_left16)
+    pb = numpy.abs(left16 - up_left16)
+    pc = numpy.abs(left16 + up16 - 2*up_left16)
+    paeth = numpy.where((pa <= pb) & (pa <= pc), left, numpy.where(pb <= pc, up, up_left))
+    numpy.subtract(cur, paeth, out=candidates[4])
+
+    # Heuristic from the PNG specification:
+    # Choose the filter with the smallest sum of absolute signed differences.
+    scores = candidates.view(numpy.int8).astype(numpy.int16)
+    numpy.abs(scores, out=scores)
+    best = scores.sum(axis=2, dtype=numpy.int32).argmin(axis=0)
+
+    result = numpy.empty((rows, stride+1), dtype=numpy.uint8)
+    result[:, 0] = best
+    result[:, 1:] = candidates[best, numpy.arange(rows)]
+    return result.tobytes()
+
+
+def iter_filtered(pixels: bytes, size: Size, bpp: int, filter: str = "sub") -> Iterator[bytes]:
+    """
+    Applies the PNG-filters on the interleaved pixel data.
+
+    "adaptive" chooses the best filter for each scanline which
+    compresses best but takes the most time. Without NumPy
+    all scanlines are stored unfiltered.
+
+    :param pixels: The interleaved pixel data.
+    :param size:   The size of the image.
+    :param bpp:    The bytes per pixel.
+    :param filter: One of "adaptive", "none", "sub" or "up".
+    :return: An iterator over blocks of filtered scanlines.
+    """
+    if filter not in FILTERS:
+        raise ValueError(f"Unknown filter {filter!r}")
+
+    stride = size.width * bpp
+    pixels = memoryview(pixels)
+    previous = None
+    rows_per_block = max(1, BYTES_PER_BLOCK // stride)
+
+    for start in range(0, size.height, rows_per_block):
+        rows = min(rows_per_block, size.height - start)
+        block = pixels[start*stride:(start+rows)*stride]
+
+        if numpy is None:
+            yield _filter_block_python(block, stride, rows)
+        elif FILTERS[filter] is None:
+            yield _filter_block_adaptive(block, stride, rows, bpp, previous)
+        else:
+            yield _filter_block_fixed(block, stride, rows, bpp, previous, FILTERS[filter])
+
+        previous = block[(rows-1)*stride:]
+
+
+def iter_compressed(blocks: Iterator[bytes], compress_level: int = 6) -> Iterator[bytes]:
+    """
+    Compresses the filtered scanlines into the zlib-stream of the image.
+    """
+    compressor = zlib.compressobj(compress_level)
+    for block in blocks:
+        data = compressor.compress(block)
+        if data:
+            yield data
+    yield compressor.flush()
+
+
+def write_image_data(fp: BinaryIO, blocks: Iterator[bytes], compress_level: int = 6) -> None:
+    """
+    Compresses the filtered scanlines and writes them as IDAT-chunks.
+    """
+    for data in iter_compressed(blocks, compress_level):
+        write_chunk(fp, b"IDAT", data)
+
+
+def write_png(
+        fp: BinaryIO,
+        size: Size,
+        format: RawFormat,
+        raw: bytes,
+        *,
+        compress_level: int = 6,
+        icc_profile: Union[str, bytes, None] = "sRGB",
+        filter: str = "sub"
+) -> None:
+    """
+    Encodes planar raw data as a PNG-file without constructing a PIL-Image.
+
+    :param fp:             The file to write into.
+    :param size:           The size of the frame.
+    :param format:         The raw-format of the frame. Check is_supported() first.
+    :param raw:            The planar data as returned by Frame.to_raw()
+    :param compress_level: The zlib compression level.
+    :param icc_profile:    "sRGB", the data of an ICC-Profile or None.
+    :param filter:         The filter-strategy. See iter_filtered().
+    """
+    if not is_supported(format):
+        raise ValueError(f"Unsupported raw-format {format!r}")
+
+    pixels = interleave(raw, size, format)
+    write_header(fp, size, format, icc_profile)
+    write_image_data(fp, iter_filtered(pixels, size, format.num_planes, filter), compress_level)
+    write_chunk(fp, b"IEND")
@@ -26,6 +26,7 @@ FORMAT_NAME = "png+srgb.yuuno"
 # These values allow older browsers to have sRGB-like color-settings.
 GAMA_SRGB = struct.pack('!I', 45455)
 CHRM_SRGB = struct.pack("!8I", 31270, 32900, 64000, 33000, 30000, 60000, 15000, 6000)
+SRGB_INTENT = b'\3'
 
 
 SRGB_PNGINFO = PngInfo()
@@ -35,7 +36,7 @@ SRGB_PNGINFO.add(b"cHRM", CHRM_SRGB)
 
 def putchunk_srgb(fp, cid, *data):
     if cid == b"iCCP":
-        return putchunk(fp, b'sRGB', b'\3')
+        return putchunk(fp, b'sRGB', SRGB_INTENT)
 
     return putchunk(fp, cid, *data)
 
@@ -0,0 +1,156 @@
+# -*- encoding: utf-8 -*-
+
+# Yuuno - IPython + VapourSynth
+# Copyright (C) 2017,2018 StuxCrystal (Roland Netzsch <stuxcrystal@encode.moe>)
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+import os
+import atexit
+from threading import Lock
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import Dict, Iterator, List, NamedTuple, Tuple, Union
+
+from traitlets import CInt, Any, Instance
+from traitlets import default
+from traitlets.config import Configurable
+from PIL.Image import Image
+
+from yuuno.clip import Frame, Size
+from yuuno.output.pil2png import YuunoImageOutput
+
+
+# Writers are never closed, so all of them share one pool per worker count.
+_executors: Dict[int, ThreadPoolExecutor] = {}
+_executors_lock = Lock()
+
+
+def _shared_executor(workers: int) -> ThreadPoolExecutor:
+    with _executors_lock:
+        if workers not in _executors:
+            _executors[workers] = ThreadPoolExecutor(workers, thread_name_prefix="yuuno-tiles")
+        return _executors[workers]
+
+
+@atexit.register
+def shutdown_executors() -> None:
+    """
+    Stops the threads encoding tiles.
+
+    Called when Yuuno stops. Writers used afterwards start new threads.
+    """
+    with _executors_lock:
+        executors = list(_executors.values())
+        _executors.clear()
+
+    for executor in executors:
+        executor.shutdown(wait=True)
+
+
+class Tile(NamedTuple):
+    index: int
+    x: int
+    y: int
+    width: int
+    height: int
+
+
+class TileManifest(NamedTuple):
+    size: Size
+    tile_size: Size
+    tiles: List[Tile]
+
+    def as_dict(self) -> dict:
+        """
+        Returns a JSON-serializable representation of the manifest.
+        """
+        return {
+            "width": self.size.width,
+            "height": self.size.height,
+            "tile_width": self.tile_size.width,
+            "tile_height": self.tile_size.height,
+            "tiles": [tile._asdict() for tile in self.tiles]
+        }
+
+
+class YuunoTiledOutput(Configurable):
+    """
+    Splits frames into tiles and encodes them in parallel as PNG-files.
+
+    Each tile is delivered as soon as it has been encoded so viewers
+    can start painting before the whole frame is done.
+    """
+
+    ################
+    # Settings
+    yuuno = Any(help="Reference to the current Yuuno instance.")
+    image_output: YuunoImageOutput = Instance(YuunoImageOutput, help="The output used to encode the tiles.")
+
+    tile_size: int = CInt(512, help="The width and height of a tile.", config=True)
+    workers: int = CInt(0, help="Number of threads encoding tiles. Defaults to the number of CPUs.", config=True)
+
+    @default("image_output")
+    def _default_image_output(self):
+        if self.yuuno is not None:
+            return self.yuuno.output
+        return YuunoImageOutput()
+
+    @property
+    def executor(self) -> ThreadPoolExecutor:
+        return _shared_executor(self.workers or os.cpu_count() or 1)
+
+    def manifest_of(self, size: Size) -> TileManifest:
+        """
+        Calculates the tiles for a frame of the given size.
+
+        :param size: The size of the frame.
+        :return: The manifest describing the tiles.
+        """
+        ts = max(self.tile_size, 1)
+        tiles = []
+        for y in range(0, size.height, ts):
+            for x in range(0, size.width, ts):
+                tiles.append(Tile(
+                    index=len(tiles), x=x, y=y,
+                    width=min(ts, size.width - x),
+                    height=min(ts, size.height - y)
+                ))
+        return TileManifest(size=size, tile_size=Size(ts, ts), tiles=tiles)
+
+    def _encode(self, im: Image, tile: Tile) -> bytes:
+        return self.image_output.bytes_of(im.crop((tile.x, tile.y, tile.x+tile.width, tile.y+tile.height)))
+
+    def tiles_of(self, im: Union[Frame, Image]) -> Tuple[TileManifest, Iterator[Tuple[Tile, bytes]]]:
+        """
+        Starts encoding the tiles of the frame.
+
+        The manifest is available immediately while the iterator yields
+        the encoded tiles in the order they complete.
+
+        :param im: The frame to encode.
+        :return: The manifest and an iterator over (tile, png-data)
+        """
+        if not isinstance(im, Image):
+            im = im.to_pil()
+        manifest = self.manifest_of(Size(*im.size))
+        futures = {self.executor.submit(self._encode, im, tile): tile for tile in manifest.tiles}
+
+        def _completed():
+            try:
+                for future in as_completed(futures):
+                    yield futures[future], future.result()
+            finally:
+                for future in futures:
+                    future.cancel()
+
+        return manifest, _completed()
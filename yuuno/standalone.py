@@ -28,7 +28,7 @@ class StandaloneEnvironment(Environment):
 
 def init_standalone(*, additional_extensions=()) -> Yuuno:
     y = Yuuno.instance(parent=None)
-    y.environment = StandaloneEnvironment()
+    y.environment = StandaloneEnvironment(parent=y)
     y.environment.additional_extensions = lambda: list(additional_extensions)
     y.start()
     return y
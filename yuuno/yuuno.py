@@ -28,6 +28,7 @@ from yuuno.core.namespace import Namespace
 from yuuno.core.settings import Settings
 
 from yuuno.output import YuunoImageOutput
+from yuuno.output.tiled import shutdown_executors
 
 T = TypeVar("T")
 
@@ -122,6 +123,7 @@ class Yuuno(Settings):
         """
         self.environment.deinitialize()
         self._deinitialize_extensions()
+        shutdown_executors()
         self.clear_instance()
 
     def wrap(self, obj: object) -> object: